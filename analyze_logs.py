@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Analyze client-N-{load,exec,save}.log files of a benchmark.
+#
+# Client log lines use the log4j pattern from log4j.properties:
+#
+#   yy/MM/dd HH:mm:ss LEVEL Category: message
+#
+# Lines with "Operation" describe one request. As in check_load_log.sh
+# the 7th field is the number of records processed by the request, the
+# request latency is the first "<number> ms" on the line.
+#
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import csv
+import json
+import math
+import glob
+import time
+import argparse
+
+PHASES = ('load', 'exec', 'save')
+LOG_RE = re.compile(r'client-(\d+)-(load|exec|save)\.log$')
+TIMING_RE = re.compile(r'client-(\d+)-timing\.tsv$')
+TS_FORMAT = '%y/%m/%d %H:%M:%S'
+LATENCY_RE = re.compile(r'(\d[\d,]*(?:\.\d+)?)\s*ms\b')
+# A client is a straggler if its phase takes STRAGGLER_FACTOR times
+# longer than the median client
+STRAGGLER_FACTOR = 1.5
+
+class Histogram(object):
+    """
+    Log-linear histogram in the spirit of HdrHistogram: values are kept
+    with `digits` significant decimal digits, memory does not depend on
+    the number of values. Values are integer microseconds, as in
+    bank-client.py, summary() reports milliseconds.
+    """
+    def __init__(self, digits=2):
+        self.sub_buckets = 10 ** digits
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def key(self, value):
+        if value < self.sub_buckets:
+            return (0, int(value))
+        exponent = int(math.log10(value)) - int(math.log10(self.sub_buckets)) + 1
+        return (exponent, int(value / 10 ** exponent))
+
+    def record(self, value, count=1):
+        k = self.key(value)
+        self.counts[k] = self.counts.get(k, 0) + count
+        self.total += count
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for k, count in other.counts.items():
+            self.counts[k] = self.counts.get(k, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if self.total == 0:
+            return None
+        rank = max(1, int(math.ceil(self.total * p / 100.0)))
+        seen = 0
+        for (exponent, mantissa) in sorted(self.counts):
+            seen += self.counts[(exponent, mantissa)]
+            if seen >= rank:
+                # Highest value equivalent to the bucket
+                return min((mantissa + 1) * 10 ** exponent - 1, self.max)
+        return self.max
+
+    def summary(self):
+        def ms(value):
+            return value is None and None or value / 1000.0
+        return {
+            'count': self.total,
+            'p50': ms(self.percentile(50)),
+            'p99': ms(self.percentile(99)),
+            'p999': ms(self.percentile(99.9)),
+            'max': ms(self.max),
+        }
+
+def parse_number(s):
+    return float(s.replace(',', ''))
+
+def parse_log(path):
+    """
+    Stream one client log, return per-second record counts, latency
+    histogram and the first/last timestamps.
+    """
+    series = {}
+    hist = Histogram()
+    first = last = None
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            try:
+                ts = int(time.mktime(time.strptime(fields[0] + ' ' + fields[1],
+                                                   TS_FORMAT)))
+            except ValueError:
+                # Continuation lines of stack traces and the like
+                continue
+            if first is None:
+                first = ts
+            last = ts
+            if 'Operation' not in line:
+                continue
+            records = 1
+            if len(fields) >= 7:
+                try:
+                    records = int(parse_number(fields[6]))
+                except ValueError:
+                    pass
+            series[ts] = series.get(ts, 0) + records
+            m = LATENCY_RE.search(line)
+            if m:
+                hist.record(int(round(parse_number(m.group(1)) * 1000)))
+    return {'series': series, 'hist': hist, 'first': first, 'last': last}
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+def analyze(result_dir):
+    """
+    Analyze all client logs in result_dir, write analytics.json and
+    throughput.csv there and return the report.
+    """
+    clients = {}
+    for path in sorted(glob.glob(os.path.join(result_dir, 'client-*-*.log'))):
+        m = LOG_RE.search(path)
+        if not m:
+            continue
+        client_id, phase = int(m.group(1)), m.group(2)
+        clients.setdefault(client_id, {})[phase] = parse_log(path)
+
+    report = {'clients': {}, 'phases': {}}
+    rows = []
+    for phase in PHASES:
+        hist = Histogram()
+        total = {}
+        durations = {}
+        records = 0
+        for client_id, logs in sorted(clients.items()):
+            data = logs.get(phase)
+            if data is None or data['first'] is None:
+                continue
+            hist.merge(data['hist'])
+            duration = data['last'] - data['first'] + 1
+            durations[client_id] = duration
+            count = sum(data['series'].values())
+            records += count
+            for ts, value in sorted(data['series'].items()):
+                total[ts] = total.get(ts, 0) + value
+                rows.append((phase, ts, client_id, value))
+            report['clients'].setdefault(str(client_id), {})[phase] = {
+                'records': count,
+                'duration': duration,
+                'throughput': float(count) / duration,
+                'latency_ms': data['hist'].summary(),
+            }
+        for ts, value in sorted(total.items()):
+            rows.append((phase, ts, 'all', value))
+        if not durations:
+            continue
+        typical = median(durations.values())
+        stragglers = sorted(client_id for client_id, d in durations.items()
+                            if d > typical * STRAGGLER_FACTOR)
+        makespan = max(total) - min(total) + 1 if total else 0
+        report['phases'][phase] = {
+            'clients': len(durations),
+            'records': records,
+            'makespan': makespan,
+            'throughput': makespan and float(records) / makespan or 0,
+            'peak_throughput': total and max(total.values()) or 0,
+            'median_client_duration': typical,
+            'stragglers': stragglers,
+            'latency_ms': hist.summary(),
+        }
+
+    with open(os.path.join(result_dir, 'analytics.json'), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    with open(os.path.join(result_dir, 'throughput.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(('phase', 'timestamp', 'client', 'records'))
+        for row in rows:
+            writer.writerow(row)
+    return report
+
+def read_timing(path):
+    """Return {phase: [start_ns, end_ns]} from a client-N-timing.tsv"""
+    phases = {}
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 2 or '_' not in fields[0]:
+                continue
+            phase, what = fields[0].rsplit('_', 1)
+            if what not in ('start', 'end'):
+                continue
+            try:
+                ns = int(fields[1])
+            except ValueError:
+                continue
+            phases.setdefault(phase, [None, None])[what == 'end'] = ns
+    return phases
+
+def analyze_timing(result_dir):
+    """
+    Per-phase client durations, makespan and start/end skew between the
+    clients from the nanosecond timestamps of client-N-timing.tsv. Writes
+    timing.json into result_dir and returns the report. Throughput is
+    taken from analytics.json when analyze() has been run.
+    """
+    clients = {}
+    for path in sorted(glob.glob(os.path.join(result_dir,
+                                              'client-*-timing.tsv'))):
+        m = TIMING_RE.search(path)
+        if m:
+            clients[int(m.group(1))] = read_timing(path)
+    records = {}
+    analytics_path = os.path.join(result_dir, 'analytics.json')
+    if os.path.exists(analytics_path):
+        with open(analytics_path) as f:
+            for phase, stats in json.load(f)['phases'].items():
+                records[phase] = stats['records']
+
+    report = {'clients': {}, 'phases': {}}
+    for phase in PHASES:
+        starts, ends, durations = [], [], {}
+        for client_id, phases in sorted(clients.items()):
+            start, end = phases.get(phase, (None, None))
+            if start is None or end is None:
+                continue
+            starts.append(start)
+            ends.append(end)
+            durations[client_id] = (end - start) / 1e9
+            report['clients'].setdefault(str(client_id), {})[phase] = {
+                'start_ns': start,
+                'end_ns': end,
+                'duration': durations[client_id],
+            }
+        if not durations:
+            continue
+        makespan = (max(ends) - min(starts)) / 1e9
+        count = records.get(phase)
+        report['phases'][phase] = {
+            'clients': len(durations),
+            'start_ns': min(starts),
+            'end_ns': max(ends),
+            'makespan': makespan,
+            'min_duration': min(durations.values()),
+            'median_duration': median(durations.values()),
+            'max_duration': max(durations.values()),
+            # Time between the first and the last client to start/finish
+            'start_skew': (max(starts) - min(starts)) / 1e9,
+            'end_skew': (max(ends) - min(ends)) / 1e9,
+            'records': count,
+            'throughput': count is not None and makespan and
+                          round(count / makespan, 1) or None,
+        }
+
+    with open(os.path.join(result_dir, 'timing.json'), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Throughput and latency of client logs in out/<id>')
+    parser.add_argument('result_dirs', nargs='+')
+    args = parser.parse_args()
+    for result_dir in args.result_dirs:
+        report = analyze(result_dir)
+        for phase, stats in sorted(report['phases'].items()):
+            print('{0} {1}: {2} records in {3} s, {4:.1f} rec/s, '
+                  'latency p50={5} p99={6} p999={7} ms, stragglers={8}'.format(
+                result_dir, phase, stats['records'], stats['makespan'],
+                stats['throughput'], stats['latency_ms']['p50'],
+                stats['latency_ms']['p99'], stats['latency_ms']['p999'],
+                stats['stragglers']))
+        timing = analyze_timing(result_dir)
+        for phase in PHASES:
+            stats = timing['phases'].get(phase)
+            if stats is None:
+                continue
+            print('{0} {1}: makespan {2:.3f} s, clients {3:.3f}..{4:.3f} s, '
+                  'skew start {5:.3f} s end {6:.3f} s'.format(
+                result_dir, phase, stats['makespan'], stats['min_duration'],
+                stats['max_duration'], stats['start_skew'],
+                stats['end_skew']))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Convert <host>.sar files of a benchmark into per-host time series and
+# per-phase utilization reports.
+#
+# Binary sar files are decoded with sadf(1) from sysstat, which must be
+# compatible with the sysstat version on the benchmark hosts. Phases are
+# taken from the .timestamp_{start,load,exec,save} files written by the
+# client role.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import csv
+import json
+import glob
+import fnmatch
+import argparse
+import subprocess
+
+PHASES = (('load', 'start', 'load'), ('exec', 'load', 'exec'),
+          ('save', 'exec', 'save'))
+COLUMNS = ('timestamp', 'cpu_usr', 'cpu_sys', 'cpu_iowait', 'cpu_soft',
+           'cpu_busy', 'net_rxpck', 'net_txpck', 'net_rxkB', 'net_txkB',
+           'net_ifutil', 'mem_used')
+# Utilization (percent) above which a resource is considered saturated
+SATURATED = 85.0
+# Virtual interfaces, not counted in net_* by default: container traffic
+# passes a veth pair and docker0 before the physical NIC
+VIRTUAL_INTERFACES = ('lo', 'docker*', 'veth*', 'br-*', 'virbr*', 'vnet*',
+                      'tun*', 'tap*')
+
+def physical(interface, interfaces=None):
+    """
+    True if net_* count interface: it matches one of the interfaces
+    patterns, or without them is not a VIRTUAL_INTERFACES one
+    """
+    if interfaces:
+        return any(fnmatch.fnmatch(interface, p) for p in interfaces)
+    return not any(fnmatch.fnmatch(interface, p) for p in VIRTUAL_INTERFACES)
+
+def sadf(path, *report):
+    """Run sadf and yield rows as dicts, timestamps are epoch seconds"""
+    cmd = ['sadf', '-d', '-U', path, '--'] + list(report)
+    output = subprocess.check_output(cmd).decode('utf-8', 'replace')
+    header = None
+    for line in output.splitlines():
+        if line.startswith('#'):
+            header = line.lstrip('# ').split(';')
+            continue
+        if not line or header is None:
+            continue
+        row = dict(zip(header, line.split(';')))
+        row['timestamp'] = int(float(row['timestamp']))
+        yield row
+
+def to_float(value):
+    try:
+        return float(value.replace(',', '.'))
+    except (ValueError, AttributeError):
+        return 0.0
+
+def load_sar(path, interfaces=None):
+    """
+    Return per-sample rows with COLUMNS as keys sorted by time, net_* are
+    summed over the interfaces accepted by physical()
+    """
+    samples = {}
+
+    def sample(ts):
+        if ts not in samples:
+            samples[ts] = dict((c, 0.0) for c in COLUMNS)
+            samples[ts]['timestamp'] = ts
+        return samples[ts]
+
+    for row in sadf(path, '-u', 'ALL'):
+        if row.get('CPU') not in ('-1', 'all'):
+            continue
+        s = sample(row['timestamp'])
+        s['cpu_usr'] = to_float(row.get('%usr'))
+        s['cpu_sys'] = to_float(row.get('%sys'))
+        s['cpu_iowait'] = to_float(row.get('%iowait'))
+        s['cpu_soft'] = to_float(row.get('%soft'))
+        s['cpu_busy'] = 100.0 - to_float(row.get('%idle'))
+    for row in sadf(path, '-n', 'DEV'):
+        if not physical(row.get('IFACE', ''), interfaces):
+            continue
+        s = sample(row['timestamp'])
+        s['net_rxpck'] += to_float(row.get('rxpck/s'))
+        s['net_txpck'] += to_float(row.get('txpck/s'))
+        s['net_rxkB'] += to_float(row.get('rxkB/s'))
+        s['net_txkB'] += to_float(row.get('txkB/s'))
+        s['net_ifutil'] = max(s['net_ifutil'], to_float(row.get('%ifutil')))
+    for row in sadf(path, '-r'):
+        s = sample(row['timestamp'])
+        s['mem_used'] = to_float(row.get('%memused'))
+    return [samples[ts] for ts in sorted(samples)]
+
+def read_timestamps(result_dir):
+    times = {}
+    for what in ('start', 'load', 'exec', 'save'):
+        path = os.path.join(result_dir, '.timestamp_' + what)
+        if os.path.exists(path):
+            with open(path) as f:
+                times[what] = int(f.read())
+    return times
+
+def read_roles(result_dir):
+    """Map host to 'server', 'client' or 'mixed' using out/<id>/hosts"""
+    roles = {}
+    path = os.path.join(result_dir, 'hosts')
+    if not os.path.exists(path):
+        return roles
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            opts = dict(field.split('=', 1) for field in fields[1:]
+                        if '=' in field)
+            if 'server_count' not in opts:
+                continue
+            servers = int(opts['server_count'])
+            clients = int(opts['client_count'])
+            roles[fields[0]] = (servers and clients and 'mixed' or
+                                servers and 'server' or 'client')
+    return roles
+
+def average(rows, begin, end):
+    rows = [r for r in rows if begin <= r['timestamp'] <= end]
+    result = {'samples': len(rows)}
+    for c in COLUMNS[1:]:
+        result[c] = rows and sum(r[c] for r in rows) / len(rows) or 0.0
+        result[c + '_max'] = rows and max(r[c] for r in rows) or 0.0
+    return result
+
+def bottleneck(hosts, roles):
+    """Guess what limited a phase from per-host averages"""
+    # Hosts without sar rows in the phase would look idle
+    hosts = dict((host, stats) for host, stats in hosts.items()
+                 if stats['samples'])
+    if not hosts:
+        return 'no data'
+    def busiest(role, column):
+        values = [stats[column] for host, stats in hosts.items()
+                  if roles.get(host, 'mixed') in (role, 'mixed')]
+        return values and max(values) or 0.0
+    if busiest('server', 'cpu_busy') >= SATURATED:
+        return 'server cpu'
+    if busiest('server', 'net_ifutil') >= SATURATED or \
+       busiest('client', 'net_ifutil') >= SATURATED:
+        return 'network'
+    if busiest('client', 'cpu_busy') >= SATURATED:
+        return 'client cpu'
+    return 'none saturated'
+
+def analyze(result_dir, interfaces=None):
+    """
+    Write <host>.sar.csv time series and sar_report.json into result_dir
+    and return the report. interfaces are the fnmatch patterns of the
+    interfaces counted in net_*, by default all but the virtual ones.
+    """
+    times = read_timestamps(result_dir)
+    roles = read_roles(result_dir)
+    throughput = {}
+    analytics_path = os.path.join(result_dir, 'analytics.json')
+    if os.path.exists(analytics_path):
+        with open(analytics_path) as f:
+            for phase, stats in json.load(f)['phases'].items():
+                throughput[phase] = stats['throughput']
+
+    series = {}
+    for path in sorted(glob.glob(os.path.join(result_dir, '*.sar'))):
+        host = os.path.basename(path)[:-len('.sar')]
+        rows = load_sar(path, interfaces)
+        series[host] = rows
+        with open(path + '.csv', 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow([row[c] for c in COLUMNS])
+
+    report = {'phases': {}}
+    for (phase, begin, end) in PHASES:
+        if begin not in times or end not in times:
+            continue
+        hosts = dict((host, average(rows, times[begin], times[end]))
+                     for host, rows in series.items())
+        for host, stats in hosts.items():
+            stats['role'] = roles.get(host, 'unknown')
+        report['phases'][phase] = {
+            'begin': times[begin],
+            'end': times[end],
+            'throughput': throughput.get(phase),
+            'bottleneck': bottleneck(hosts, roles),
+            'hosts': hosts,
+        }
+    with open(os.path.join(result_dir, 'sar_report.json'), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+def format_phase(phase, stats):
+    lines = ['{0}: {1} s, throughput {2}, bottleneck: {3}'.format(phase,
+        stats['end'] - stats['begin'], stats['throughput'],
+        stats['bottleneck'])]
+    for host, h in sorted(stats['hosts'].items()):
+        lines.append('  {0} ({1}): cpu {2:.0f}% (soft {3:.0f}%), '
+            'net rx {4:.0f}/tx {5:.0f} pck/s {6:.0f}/{7:.0f} kB/s, '
+            'mem {8:.0f}%'.format(host, h['role'], h['cpu_busy'],
+            h['cpu_soft'], h['net_rxpck'], h['net_txpck'], h['net_rxkB'],
+            h['net_txkB'], h['mem_used']))
+    return lines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Per-phase host utilization from sar files in out/<id>')
+    parser.add_argument('result_dirs', nargs='+')
+    parser.add_argument('--interface', dest='interfaces', action='append',
+        help='count only this interface in network totals, a glob, may be '
+        'repeated (default: all but lo, docker*, veth* and other virtual '
+        'ones)')
+    args = parser.parse_args()
+    for result_dir in args.result_dirs:
+        report = analyze(result_dir, args.interfaces)
+        print(result_dir)
+        for (phase, begin, end) in PHASES:
+            if phase in report['phases']:
+                print('\n'.join(format_phase(phase, report['phases'][phase])))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#
+# Describe the contention of a transaction dataset before running it:
+#
+#   ./analyze_workload.py roles/client/files/trx-24 --batch 100 --top 20
+#
+# Every transaction is two legs, an update of the source and of the
+# destination account (the two q_update calls of bank.lua). Reported are:
+#
+#  * hotness: legs per account, its percentiles and the share of legs
+#    that go to the hottest 0.1%, 1% and 10% of accounts;
+#  * the top-K hottest accounts;
+#  * same-account conflicts per batch for every --batch size: legs of a
+#    batch that hit an account already updated in the same batch. They are
+#    measured on batches cut in file order, and predicted for a random
+#    order from the hotness alone;
+#  * per-client (per trxNNN.txt) transactions, distinct accounts and the
+#    accounts shared by several clients.
+#
+# Files are read in chunks of CHUNK_SIZE bytes by a process pool; measured
+# batches restart at chunk boundaries.
+#
+
+import os
+import sys
+import glob
+import json
+import math
+import time
+import argparse
+import collections
+import multiprocessing
+
+CHUNK_SIZE = 256 * 1024 * 1024
+READ_BUFFER = 4 * 1024 * 1024
+SHARES = (0.001, 0.01, 0.1)
+PERCENTILES = (50, 90, 99, 99.9)
+
+def chunks(path, size=CHUNK_SIZE):
+    """Split a file into [begin, end) ranges cut after a newline"""
+    total = os.path.getsize(path)
+    ranges = []
+    begin = 0
+    with open(path, 'rb') as f:
+        while begin < total:
+            end = begin + size
+            if end >= total:
+                end = total
+            else:
+                f.seek(end)
+                end += len(f.readline())
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+def read_lines(path, begin, end):
+    with open(path, 'rb', buffering=READ_BUFFER) as f:
+        f.seek(begin)
+        pos = begin
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+def scan(task):
+    """Count legs per account and batch conflicts of a chunk"""
+    (client, path, begin, end, batches) = task
+    legs = collections.Counter()
+    transactions = 0
+    # batch size -> [batches, conflicting legs, batches with conflicts]
+    conflicts = dict((size, [0, 0, 0]) for size in batches)
+    # batch size -> [accounts of the current batch, it has a conflict]
+    current = dict((size, [set(), False]) for size in batches)
+    for line in read_lines(path, begin, end):
+        fields = line.split(b'\t')
+        if len(fields) != 5:
+            continue
+        src, dst = fields[2], fields[3]
+        legs[src] += 1
+        legs[dst] += 1
+        transactions += 1
+        for size, batch in current.items():
+            stats = conflicts[size]
+            seen = batch[0]
+            for account_id in (src, dst):
+                if account_id in seen:
+                    stats[1] += 1
+                    batch[1] = True
+                seen.add(account_id)
+            if transactions % size == 0:
+                stats[0] += 1
+                stats[2] += batch[1]
+                seen.clear()
+                batch[1] = False
+    for size, (seen, conflicting) in current.items():
+        if seen:
+            conflicts[size][0] += 1
+            conflicts[size][2] += conflicting
+    return client, transactions, legs, conflicts
+
+def percentile(values, p):
+    """p-th percentile of sorted values, nearest rank"""
+    if not values:
+        return 0
+    rank = max(int(-(-p * len(values) // 100)), 1)
+    return values[rank - 1]
+
+def expected_conflicts(histogram, total_legs, size):
+    """
+    Expected same-account legs in a batch of size transactions drawn at
+    random: legs minus the expected number of distinct accounts. histogram
+    maps legs per account to the number of such accounts. Legs are drawn
+    without replacement, an account with count legs is missed by the
+    batch with probability ~(1 - n / total_legs) ** count.
+    """
+    n = 2 * size
+    if n >= total_legs:
+        return total_legs - sum(histogram.values())
+    missed = math.log1p(-float(n) / total_legs)
+    distinct = sum(accounts * -math.expm1(count * missed)
+                   for count, accounts in histogram.items())
+    return n - distinct
+
+def analyze(paths, batches, top, jobs):
+    tasks = []
+    for client, path in enumerate(paths):
+        for (begin, end) in chunks(path):
+            tasks.append((client, path, begin, end, batches))
+    legs = collections.Counter()
+    clients = [{'path': path, 'transactions': 0, 'accounts': 0}
+               for path in paths]
+    client_legs = [collections.Counter() for path in paths]
+    measured = dict((size, [0, 0, 0]) for size in batches)
+    with multiprocessing.Pool(jobs) as pool:
+        for (client, transactions, part, conflicts) in \
+                pool.imap_unordered(scan, tasks):
+            clients[client]['transactions'] += transactions
+            client_legs[client].update(part)
+            for size, stats in conflicts.items():
+                for i, value in enumerate(stats):
+                    measured[size][i] += value
+    # Number of clients touching every account
+    spread = collections.Counter()
+    for client, part in enumerate(client_legs):
+        clients[client]['accounts'] = len(part)
+        legs.update(part)
+        spread.update(part.keys())
+    client_legs = None
+
+    total_legs = sum(legs.values())
+    counts = sorted(legs.values())
+    histogram = collections.Counter(counts)
+    descending = counts[::-1]
+    hotness = {
+        'accounts': len(counts),
+        'legs': total_legs,
+        'max': counts and counts[-1] or 0,
+        'mean': total_legs / max(len(counts), 1),
+        'percentiles': dict(('p{}'.format(p), percentile(counts, p))
+                            for p in PERCENTILES),
+        'top_share': dict(('{}%'.format(share * 100),
+            sum(descending[:max(int(len(counts) * share), 1)]) /
+            max(total_legs, 1)) for share in SHARES),
+    }
+    top_accounts = [{'account_id': account_id.decode('utf-8', 'replace'),
+                     'legs': count, 'share': count / max(total_legs, 1)}
+                    for account_id, count in legs.most_common(top)]
+    conflicts = {}
+    for size in batches:
+        (count, conflicting, with_conflicts) = measured[size]
+        conflicts[str(size)] = {
+            'batches': count,
+            'measured_per_batch': conflicting / max(count, 1),
+            'measured_batches_with_conflicts': with_conflicts / max(count, 1),
+            'expected_per_batch': total_legs and
+                expected_conflicts(histogram, total_legs, size) or 0,
+        }
+    sizes = [c['transactions'] for c in clients]
+    mean = sum(sizes) / max(len(sizes), 1)
+    balance = {
+        'clients': clients,
+        'min_transactions': min(sizes),
+        'max_transactions': max(sizes),
+        'imbalance': mean and max(sizes) / mean - 1 or 0,
+        'shared_accounts': sum(1 for n in spread.values() if n > 1),
+        'shared_account_ratio': sum(1 for n in spread.values() if n > 1) /
+            max(len(spread), 1),
+    }
+    return {'transactions': sum(sizes), 'hotness': hotness,
+            'top': top_accounts, 'conflicts': conflicts, 'balance': balance,
+            'chunks': len(tasks)}
+
+def format_report(report):
+    hotness = report['hotness']
+    lines = ['{} transactions, {} accounts, legs per account: mean {:.1f}, '
+             'max {}, {}'.format(report['transactions'], hotness['accounts'],
+             hotness['mean'], hotness['max'], ', '.join('{} {}'.format(k, v)
+             for k, v in sorted(hotness['percentiles'].items(),
+                                key=lambda kv: float(kv[0][1:]))))]
+    lines.append('share of legs on the hottest accounts: ' + ', '.join(
+        '{} {:.1%}'.format(k, v) for k, v in sorted(
+            hotness['top_share'].items(), key=lambda kv: float(kv[0][:-1]))))
+    for account in report['top']:
+        lines.append('  {account_id}\t{legs}\t{share:.3%}'.format(**account))
+    for size, stats in sorted(report['conflicts'].items(),
+                              key=lambda kv: int(kv[0])):
+        lines.append('batch {}: conflicts per batch measured {:.2f}, '
+                     'expected {:.2f} in random order, {:.1%} of batches '
+                     'conflict'.format(size, stats['measured_per_batch'],
+                     stats['expected_per_batch'],
+                     stats['measured_batches_with_conflicts']))
+    if report['chunks'] > len(report['balance']['clients']):
+        lines.append('measured batches restart at the {} chunk boundaries '
+                     'of the files'.format(report['chunks'] -
+                     len(report['balance']['clients'])))
+    balance = report['balance']
+    lines.append('clients: transactions {}..{}, imbalance {:.1%}, {} '
+                 'accounts ({:.1%}) used by several clients'.format(
+                 balance['min_transactions'], balance['max_transactions'],
+                 balance['imbalance'], balance['shared_accounts'],
+                 balance['shared_account_ratio']))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report account hotness, batch conflicts and client '
+        'balance of trxNNN.txt files')
+    parser.add_argument('trx', nargs='+',
+        help='directories with trx*.txt files or files')
+    parser.add_argument('--batch', type=int, action='append',
+        help='batch size in transactions, may be repeated (default 100)')
+    parser.add_argument('--top', type=int, default=10,
+        help='number of hottest accounts to list')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='number of processes')
+    parser.add_argument('--json', help='also write the report to this file')
+    opts = parser.parse_args()
+
+    paths = []
+    for arg in opts.trx:
+        if os.path.isdir(arg):
+            paths.extend(sorted(glob.glob(os.path.join(arg, 'trx*.txt'))))
+        else:
+            paths.append(arg)
+    if not paths:
+        parser.error('no transaction files')
+    start_time = time.time()
+    report = analyze(paths, opts.batch or [100], opts.top, opts.jobs)
+    print(format_report(report))
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    print('analyzed {} files in {:.1f} s'.format(len(paths),
+        time.time() - start_time), file = sys.stderr)
+
+# vim: et ts=4 bs=4
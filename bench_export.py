@@ -1,15 +1,181 @@
 import requests
-from urllib import urlencode
+import requests.adapters
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
 import os
+import sys
+import json
+import time
+import fcntl
+import random
+import logging
+import threading
+import multiprocessing.pool
 
-def push(results, cfg, log, version):
+# Every result is appended here first and removed from the pending part
+# only after the server has accepted it
+SPOOL_PATH = 'export.spool'
+WORKERS = 8
+BATCH_SIZE = 64
+TIMEOUT = 10
+RETRIES = 4
+BACKOFF = 0.5
+# Seconds wait_background() gives drains to finish before exit
+JOIN_TIMEOUT = 60
+
+# Threads of drain_background() not waited for yet
+background = []
+
+def parse_cfg(cfg):
+    """
+    Return (server, key) from the 'host[:port]:key' export setting
+    """
+    if not cfg or ':' not in cfg:
+        return cfg, None
+    return tuple(cfg.rsplit(':', 1))
+
+def make_session(workers=WORKERS):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class Spool(object):
+    """
+    Append-only file of JSON records. The offset of the first record
+    which is not exported yet is kept in <path>.offset. Once every
+    record is exported the file is truncated by compact().
+    """
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self.offset_path = path + '.offset'
+
+    def append(self, records):
+        data = ''.join(json.dumps(r, sort_keys=True) + '\n' for r in records)
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, OSError):
+            return 0
+
+    def write_offset(self, offset):
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.rename(tmp_path, self.offset_path)
+
+    def compact(self):
+        """Truncate the file and reset the offset if all is exported"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'a') as f:
+            # Appends wait, the size can't change until the file is empty
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_size != self.read_offset():
+                return
+            f.truncate(0)
+            self.write_offset(0)
+
+    def pending(self):
+        """Return (records, end offset) after the saved offset"""
+        if not os.path.exists(self.path):
+            return [], 0
+        offset = self.read_offset()
+        if offset > os.path.getsize(self.path):
+            # Truncated by compact() before the offset was reset
+            offset = 0
+        records = []
+        with open(self.path) as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    # Being written right now
+                    break
+                records.append(json.loads(line))
+                offset += len(line.encode('utf-8'))
+        return records, offset
+
+def send(session, record, log, retries=None, timeout=None):
+    if retries is None:
+        retries = RETRIES
+    if timeout is None:
+        timeout = TIMEOUT
+    url = 'http://%s/push?%s' % (record['server'], urlencode(record['params']))
+    for attempt in range(retries + 1):
+        try:
+            resp = session.get(url, timeout=timeout)
+            if resp.status_code == 200:
+                return True
+            # Client errors will not go away on retry
+            if 400 <= resp.status_code < 500:
+                log.error("can't push %s to result server: http %d",
+                          record['params']['name'], resp.status_code)
+                return True
+            reason = 'http %d' % resp.status_code
+        except requests.RequestException as e:
+            reason = str(e)
+        if attempt < retries:
+            time.sleep(BACKOFF * 2 ** attempt * (1 + random.random()))
+    log.info("can't push %s to result server: %s, keeping it in spool",
+             record['params']['name'], reason)
+    return False
+
+def drain(log, spool=None, session=None, workers=WORKERS):
+    """
+    Export all pending records of the spool. Records that fail after all
+    retries are appended to the spool again for the next drain.
+    Returns the number of exported records.
+    """
+    spool = spool or Spool()
+    lock = open(spool.path + '.lock', 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        records, offset = spool.pending()
+        if not records:
+            spool.compact()
+            return 0
+        session = session or make_session(workers)
+        pool = multiprocessing.pool.ThreadPool(workers)
+        exported = 0
+        try:
+            for i in range(0, len(records), BATCH_SIZE):
+                batch = records[i:i + BATCH_SIZE]
+                ok = pool.map(lambda r: send(session, r, log), batch)
+                failed = [r for r, sent in zip(batch, ok) if not sent]
+                exported += len(batch) - len(failed)
+                if failed:
+                    spool.append(failed)
+        finally:
+            pool.close()
+            pool.join()
+        spool.write_offset(offset)
+        spool.compact()
+        log.info('pushed %d of %d results to result server', exported,
+                 len(records))
+        return exported
+    finally:
+        lock.close()
+
+def push(results, cfg, log, version, spool=None, background=True):
     """
-    Push results into benchmark server
+    Push results into benchmark server: results are spooled first and
+    exported by a background thread, so this never blocks on the network
     """
     if cfg is None:
         log.info('there is no export section in config.yml')
         return
-    server, key = cfg.split(':')
+    server, key = parse_cfg(cfg)
 
     if not server:
         log.info('result server is not specified in config.yml')
@@ -18,17 +184,37 @@ def push(results, cfg, log, version):
     if not server or not key:
         return
 
-    for bench_key, val in results.items():
-        url = 'http://%s/push?%s' % (server, urlencode(dict(
+    spool = spool or Spool()
+    spool.append({'server': server, 'params': dict(
             key=key, name='bank.%s' % bench_key, param=str(val),
             v=version, unit='sec', tab='bank'
-        )))
-
-        resp = requests.get(url)
-        if resp.status_code == 200:
-            log.info('pushed %s to result server' % bench_key)
-        else:
-            log.info(
-                "can't push %s to result server: http %d",
-                resp.status_code
-            )
+        )} for bench_key, val in results.items())
+
+    if not background:
+        return drain(log, spool)
+    return drain_background(log, spool)
+
+def drain_background(log, spool=None):
+    thread = threading.Thread(target=drain, args=(log, spool))
+    thread.daemon = True
+    thread.start()
+    background.append(thread)
+    return thread
+
+def wait_background(timeout=JOIN_TIMEOUT):
+    """
+    Wait up to timeout seconds for the drain_background() threads. They
+    are daemons and die with the process, so call this before it exits.
+    Returns False if some are still running, their records stay in the
+    spool.
+    """
+    deadline = time.time() + timeout
+    for thread in list(background):
+        thread.join(max(deadline - time.time(), 0))
+    background[:] = [thread for thread in background if thread.is_alive()]
+    return not background
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    path = len(sys.argv) > 1 and sys.argv[1] or SPOOL_PATH
+    drain(logging.getLogger('export'), Spool(path))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Content-addressed dataset distribution for run.py.
+#
+# Every accountsNNN, trxNNN.txt and trxNNN.txt.batch file a benchmark needs
+# is named by the sha1 of its content. The file is compressed once into
+# <archive_dir>/<sha1>.gz on this host. 13_push_datasets.yml copies to every
+# container host only the archives missing from its dataset_cache_dir, and
+# unpacks and verifies them there. Client containers mount the cache, and
+# deploy.yml links the files of a client instead of copying them. Repeated
+# benchmarks with the same data transfer nothing.
+#
+# Digests are cached in <archive_dir>/digests.json by path, size and mtime,
+# so unchanged multi-GB files are not read again either.
+#
+#   datasets.py archive_dir file...
+#
+# prints the digests of files and archives them.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import multiprocessing
+
+READ_BUFFER = 4 * 1024 * 1024
+# Fast compression: the archive is built once, but the first benchmark
+# waits for it
+COMPRESS_LEVEL = 1
+DIGESTS = 'digests.json'
+
+def file_digest(path):
+    """Return the hex sha1 of a file, as sha1sum prints it"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(READ_BUFFER)
+            if not data:
+                break
+            sha1.update(data)
+    return path, sha1.hexdigest()
+
+def compress(task):
+    """Write path to archive_path with gzip, through a temporary file"""
+    (path, archive_path) = task
+    tmp_path = '{0}.{1}.tmp'.format(archive_path, os.getpid())
+    with open(path, 'rb') as src:
+        dst = gzip.GzipFile(tmp_path, 'wb', COMPRESS_LEVEL)
+        try:
+            shutil.copyfileobj(src, dst, READ_BUFFER)
+        finally:
+            dst.close()
+    os.rename(tmp_path, archive_path)
+    return archive_path
+
+def archive_path(archive_dir, digest):
+    return os.path.join(archive_dir, digest + '.gz')
+
+def load_digests(archive_dir):
+    try:
+        with open(os.path.join(archive_dir, DIGESTS)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def save_digests(archive_dir, digests):
+    # Benchmarks run in parallel may save at the same time, the last one
+    # wins and the other digests are computed again next time
+    path = os.path.join(archive_dir, DIGESTS)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(digests, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+def archive(paths, archive_dir, jobs=None):
+    """
+    Return {path: digest} of files and make sure archive_dir has an archive
+    of each. Files are hashed and compressed by a pool of jobs processes.
+    """
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+    cached = load_digests(archive_dir)
+    digests = {}
+    stale = []
+    for path in set(os.path.abspath(p) for p in paths):
+        st = os.stat(path)
+        entry = cached.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            digests[path] = entry[2]
+        else:
+            stale.append(path)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for (path, digest) in pool.imap_unordered(file_digest, stale):
+            st = os.stat(path)
+            digests[path] = digest
+            cached[path] = [st.st_size, st.st_mtime, digest]
+        if stale:
+            save_digests(archive_dir, cached)
+        missing = {}
+        for path, digest in digests.items():
+            if not os.path.exists(archive_path(archive_dir, digest)):
+                missing[digest] = path
+        list(pool.imap_unordered(compress, [(path, archive_path(archive_dir,
+            digest)) for digest, path in missing.items()]))
+    finally:
+        pool.close()
+        pool.join()
+    return digests
+
+def client_files(client_id, accounts_dir, trx_dir, batch):
+    """Return {name: path} of the dataset files of a client"""
+    trx = os.path.join(trx_dir, 'trx{0:03d}.txt'.format(client_id))
+    files = {
+        'accounts': os.path.join(accounts_dir,
+                                 'accounts{0:03d}'.format(client_id)),
+        'transactions': trx,
+    }
+    if batch:
+        files['batch'] = trx + '.batch'
+    return files
+
+def prepare(clients, accounts_dir, trx_dir, batch, archive_dir, jobs=None):
+    """
+    Archive the datasets of clients, a list of (client_id, hostname).
+    Return the variables of 13_push_datasets.yml and deploy.yml:
+    host_datasets, the digests to push to every host, and
+    client_datasets, {client_id: {name: digest}}.
+    """
+    files = dict((client_id, client_files(client_id, accounts_dir, trx_dir,
+                                          batch))
+                 for (client_id, hostname) in clients)
+    digests = archive([path for names in files.values()
+                       for path in names.values()], archive_dir, jobs)
+    host_datasets = {}
+    client_datasets = {}
+    for (client_id, hostname) in clients:
+        names = dict((name, digests[os.path.abspath(path)])
+                     for name, path in files[client_id].items())
+        # String keys survive a JSON round trip, deploy.yml looks up
+        # client_id|string
+        client_datasets[str(client_id)] = names
+        pushed = host_datasets.setdefault(hostname, [])
+        for digest in sorted(names.values()):
+            if digest not in pushed:
+                pushed.append(digest)
+    return {'host_datasets': host_datasets,
+            'client_datasets': client_datasets}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: datasets.py archive_dir file...', file=sys.stderr)
+        sys.exit(2)
+    for path, digest in sorted(archive(sys.argv[2:], sys.argv[1]).items()):
+        print('{0}  {1}'.format(digest, path))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# asyncio stand-in for roles/tarantool/files/bank.lua, started by
+# `run.py --local` as one process per server:
+#
+#   local_bank.py --index I --peers 127.0.0.1:P0,127.0.0.1:P1,...
+#
+# Like shard.lua, process I owns the accounts with
+# crc32(account_id) % len(peers) == I. /bulk_load and /transactions split
+# the posted lines by owner and forward foreign ones to the peers, so the
+# cross-server traffic of the real cluster is kept. /get_all returns the
+# accounts of this process only. There is no redundancy: every account
+# has exactly one copy.
+#
+# Money is kept in integer kopecks and formatted exactly as bank.lua does.
+#
+
+import sys
+import zlib
+import asyncio
+import logging
+import argparse
+
+log = logging.getLogger('bank')
+
+def tomoney(s):
+    if s.startswith('-'):
+        return -tomoney(s[1:])
+    roubles, _, kopecks = s.partition('.')
+    if len(kopecks) > 2:
+        raise ValueError('Invalid amount: ' + s)
+    return int(roubles or 0) * 100 + int(kopecks.ljust(2, '0'))
+
+def frommoney(num):
+    roubles, kopecks = divmod(abs(num), 100)
+    return '{0}{1}.{2:02d}'.format(num < 0 and '-' or '', roubles, kopecks)
+
+class HTTPError(Exception):
+    pass
+
+async def read_message(reader):
+    """Return (first line fields, headers, body) of an HTTP message"""
+    line = await reader.readline()
+    if not line:
+        return None
+    fields = line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = length and await reader.readexactly(length) or b''
+    return fields, headers, body
+
+class Link(object):
+    """Keep-alive connections to a peer"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.idle = []
+
+    async def post(self, path, body):
+        if self.idle:
+            reader, writer = self.idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection(self.host,
+                                                           self.port)
+        try:
+            writer.write('POST {0} HTTP/1.1\r\nHost: {1}:{2}\r\n'
+                         'Content-Length: {3}\r\n\r\n'.format(path, self.host,
+                         self.port, len(body)).encode('ascii') + body)
+            message = await read_message(reader)
+            if message is None:
+                raise HTTPError('connection closed by {0}:{1}'.format(
+                    self.host, self.port))
+        except:
+            writer.close()
+            raise
+        self.idle.append((reader, writer))
+        fields, headers, data = message
+        if fields[1] != '200':
+            raise HTTPError('{0}:{1}{2}: {3}'.format(self.host, self.port,
+                path, data.decode('utf-8', 'replace')))
+        return data
+
+class Bank(object):
+    def __init__(self, index, peers):
+        self.index = index
+        self.count = len(peers)
+        self.links = dict((i, Link(*peer)) for i, peer in enumerate(peers)
+                          if i != index)
+        # account_id -> [balance, info]
+        self.accounts = {}
+
+    def owner(self, account_id):
+        return zlib.crc32(account_id) % self.count
+
+    async def scatter(self, path, lines, apply):
+        """Apply own lines, forward the rest to their owners"""
+        parts = {}
+        for key, line in lines:
+            parts.setdefault(self.owner(key), []).append(line)
+        local = parts.pop(self.index, [])
+        await asyncio.gather(*[self.links[i].post(path, b''.join(part))
+                               for i, part in parts.items()])
+        apply(local)
+
+    def load_accounts(self, lines):
+        for line in lines:
+            account_id, rest = line.rstrip(b'\n').split(b'\t', 1)
+            info, balance = rest.rsplit(b'\t', 1)
+            if account_id in self.accounts:
+                log.error('failed to insert account_id = %s: Duplicate key',
+                          account_id.decode())
+                continue
+            self.accounts[account_id] = [tomoney(balance.decode()), info]
+
+    def apply_deltas(self, lines):
+        for line in lines:
+            account_id, delta = line.split()
+            account = self.accounts.get(account_id)
+            # Like an update of a missing tuple in Tarantool
+            if account is not None:
+                account[0] += int(delta)
+
+    def parse_accounts(self, body):
+        for line in body.splitlines(True):
+            if line.strip():
+                yield line.split(b'\t', 1)[0], line
+
+    def parse_transactions(self, body):
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            fields = line.split()
+            if len(fields) != 5:
+                raise ValueError('invalid line in /transactions: [{0}]'.format(
+                    line.decode('utf-8', 'replace')))
+            src, dst, amount = fields[2], fields[3], tomoney(fields[4].decode())
+            yield src, b'%s\t%d\n' % (src, -amount)
+            yield dst, b'%s\t%d\n' % (dst, amount)
+
+    async def bulk_load(self, body):
+        lines = list(self.parse_accounts(body))
+        await self.scatter('/_load', lines,
+                           lambda part: self.load_accounts(part))
+        log.info('loaded %d accounts', len(lines))
+        return 'loaded {0} accounts'.format(len(lines))
+
+    async def transactions(self, body):
+        legs = list(self.parse_transactions(body))
+        await self.scatter('/_apply', legs,
+                           lambda part: self.apply_deltas(part))
+        return 'processed {0} transactions'.format(len(legs) // 2)
+
+    def get_all(self):
+        return b''.join(b'%s\t%s\t%s\n' % (account_id, info,
+                        frommoney(balance).encode())
+                        for account_id, (balance, info)
+                        in self.accounts.items())
+
+    async def route(self, method, path, body):
+        path = path.split('?', 1)[0]
+        if method == 'POST' and path == '/bulk_load':
+            return (await self.bulk_load(body)).encode()
+        if method == 'POST' and path == '/transactions':
+            return (await self.transactions(body)).encode()
+        if method == 'GET' and path == '/get_all':
+            return self.get_all()
+        # Requests forwarded by peers, already split by owner
+        if method == 'POST' and path == '/_load':
+            self.load_accounts(body.splitlines(True))
+            return b''
+        if method == 'POST' and path == '/_apply':
+            self.apply_deltas(body.splitlines())
+            return b''
+        return None
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                (fields, headers, body) = message
+                try:
+                    status, data = 200, await self.route(fields[0], fields[1],
+                                                         body)
+                    if data is None:
+                        status, data = 404, fields[1].encode()
+                except Exception as e:
+                    log.exception('%s %s failed', fields[0], fields[1])
+                    status, data = 500, str(e).encode()
+                writer.write('HTTP/1.1 {0} {1}\r\n'
+                             'Content-Type: application/octet-stream\r\n'
+                             'Content-Length: {2}\r\n\r\n'.format(status,
+                             status == 200 and 'OK' or 'Error',
+                             len(data)).encode('ascii') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def parse_peer(peer):
+    host, _, port = peer.rpartition(':')
+    return host, int(port)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='asyncio stand-in for the bank.lua HTTP API')
+    parser.add_argument('--index', type=int, required=True,
+        help='position of this server in --peers')
+    parser.add_argument('--peers', required=True,
+        help='comma-separated host:port of all servers, including this one')
+    opts = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    peers = [parse_peer(p) for p in opts.peers.split(',')]
+    bank = Bank(opts.index, peers)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    host, port = peers[opts.index]
+    server = loop.run_until_complete(asyncio.start_server(bank.serve, host,
+                                                          port))
+    log.info('server %d of %d listening on %s:%d', opts.index, len(peers),
+             host, port)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.close()
+
+if __name__ == '__main__':
+    main()
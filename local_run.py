@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# run.py --local: run a benchmark on this host without Docker, Ansible and
+# Tarantool. Servers are local_bank.py processes, clients are
+# roles/client/files/bank-client.py processes. Client logs, saved accounts,
+# timings and .timestamp_* files are left in results_dir under the names
+# the playbooks use, so run.py reports and analyzes them as usual.
+#
+
+import os
+import time
+import shutil
+import socket
+import subprocess
+
+PYTHON = 'python3'
+# Transactions generated for all clients when trx-N does not exist
+TRANSACTIONS = 100000
+SEED = 1
+# Seconds to wait for local_bank.py to accept connections
+STARTUP_TIMEOUT = 10
+POLL_INTERVAL = 0.01
+
+LOCAL_BANK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'local_bank.py')
+
+def now_ns():
+    return int(time.time() * 1e9)
+
+def free_ports(count):
+    socks = []
+    try:
+        for i in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            socks.append(sock)
+        return [sock.getsockname()[1] for sock in socks]
+    finally:
+        for sock in socks:
+            sock.close()
+
+def wait_port(port, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(POLL_INTERVAL)
+    return False
+
+def write_timestamp(results_dir, what):
+    with open(os.path.join(results_dir, '.timestamp_' + what), 'w') as f:
+        f.write('{0:d}\n'.format(int(time.time())))
+
+def dataset_dirs(benchmark, client_dir):
+    clients = benchmark['client_count']
+    return (os.path.abspath(os.path.join(client_dir,
+                                         'accounts-{0}'.format(clients))),
+            os.path.abspath(os.path.join(client_dir,
+                                         'trx-{0}'.format(clients))))
+
+def prepare(benchmark, client_dir, cfg, log):
+    """Generate accounts-N and trx-N in client_dir unless they exist"""
+    python = cfg.get('local_python', PYTHON)
+    clients = str(benchmark['client_count'])
+    seed = str(cfg.get('local_seed', SEED))
+    accounts_dir, trx_dir = dataset_dirs(benchmark, client_dir)
+    if not os.path.isdir(accounts_dir):
+        log.info("generate %s", accounts_dir)
+        subprocess.check_call([python, 'gen-accounts.py', clients,
+                               '--seed', seed], cwd=client_dir)
+    if not os.path.isdir(trx_dir):
+        log.info("generate %s", trx_dir)
+        subprocess.check_call([python, 'gen-transactions.py',
+                               str(cfg.get('local_transactions', TRANSACTIONS)),
+                               '--clients', clients, '--seed', seed],
+                              cwd=client_dir)
+
+class Servers(object):
+    """local_bank.py processes on free ports of 127.0.0.1"""
+    def __init__(self, count, log_dir, python=PYTHON):
+        self.count = count
+        self.log_dir = log_dir
+        self.python = python
+        self.procs = []
+        self.ports = []
+
+    @property
+    def address(self):
+        return ','.join('127.0.0.1:{0}'.format(port) for port in self.ports)
+
+    def log_names(self):
+        return ['local-server-{0}.log'.format(i) for i in range(self.count)]
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        self.ports = free_ports(self.count)
+        for i, name in enumerate(self.log_names()):
+            with open(os.path.join(self.log_dir, name), 'w') as out:
+                self.procs.append(subprocess.Popen([self.python, LOCAL_BANK,
+                    '--index', str(i), '--peers', self.address],
+                    stdout=out, stderr=subprocess.STDOUT))
+        return all(wait_port(port, proc, timeout)
+                   for port, proc in zip(self.ports, self.procs))
+
+    def stop(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self.procs:
+            proc.wait()
+        self.procs = []
+
+def run_clients(commands, workdirs):
+    """
+    Run one command per client concurrently, return a list of
+    (start_ns, end_ns, exit code). Ends are noticed within POLL_INTERVAL.
+    """
+    running = {}
+    for i, (command, workdir) in enumerate(zip(commands, workdirs)):
+        out = open(os.path.join(workdir, 'driver.out'), 'a')
+        running[i] = (subprocess.Popen(command, cwd=workdir, stdout=out,
+                                       stderr=subprocess.STDOUT),
+                      out, now_ns())
+    result = [None] * len(commands)
+    while running:
+        time.sleep(POLL_INTERVAL)
+        for i in list(running):
+            (proc, out, start) = running[i]
+            if proc.poll() is None:
+                continue
+            result[i] = (start, now_ns(), proc.returncode)
+            out.close()
+            del running[i]
+    return result
+
+def run(benchmark, manifest, client_dir, result_dir, results_dir, cfg, log):
+    """
+    Prepare data and run load, exec and save against local servers.
+    Returns False if data could not be generated or the servers could not
+    be started.
+    """
+    if not manifest.finished('prepare'):
+        manifest.start('prepare')
+        try:
+            prepare(benchmark, client_dir, cfg, log)
+        except subprocess.CalledProcessError as e:
+            log.error("failed to prepare data: %s", e)
+            return False
+        manifest.finish('prepare')
+    if manifest.finished('run'):
+        return True
+
+    python = cfg.get('local_python', PYTHON)
+    clients = benchmark['client_count']
+    accounts_dir, trx_dir = dataset_dirs(benchmark, client_dir)
+    if os.path.isdir(results_dir):
+        shutil.rmtree(results_dir)
+    workdirs = [os.path.join(results_dir, 'client-{0}'.format(i))
+                for i in range(clients)]
+    for workdir in workdirs:
+        os.makedirs(workdir)
+
+    manifest.start('run')
+    servers = Servers(benchmark['server_count'], results_dir, python)
+    started = time.time()
+    try:
+        if not servers.start():
+            log.error("failed to start local servers, see %s",
+                      ' '.join(servers.log_names()))
+            return False
+        log.info("%d local servers started in %.3f s", servers.count,
+                 time.time() - started)
+
+        def command(i, *args):
+            return [python, os.path.abspath(os.path.join(client_dir,
+                    'bank-client.py')), '-id', str(i), '-server',
+                    servers.address, '-concurrency',
+                    str(cfg.get('client_concurrency', 4))] + list(args)
+
+        def exec_args(i):
+            path = os.path.join(trx_dir, 'trx{0:03d}.txt'.format(i))
+            args = ['-batch', str(cfg.get('client_trx_batch', 100))]
+            if benchmark['batch'] and os.path.exists(path + '.batch'):
+                args += ['-batch-file', path + '.batch']
+            if cfg.get('client_rate'):
+                args += ['-rate', str(cfg['client_rate'])]
+            return args + [path]
+
+        phases = (
+            ('load', lambda i: command(i, 'load', '-batch',
+                str(cfg.get('client_load_batch', 25000)),
+                os.path.join(accounts_dir, 'accounts{0:03d}'.format(i)))),
+            ('exec', lambda i: command(i, 'exec-trans', *exec_args(i))),
+            ('save', lambda i: command(i, 'save', '-out', 'accounts_out.tsv')),
+        )
+        timing = [[] for i in range(clients)]
+        write_timestamp(results_dir, 'start')
+        for (phase, make_command) in phases:
+            log.info("local %s", phase)
+            result = run_clients([make_command(i) for i in range(clients)],
+                                 workdirs)
+            for i, (start, end, code) in enumerate(result):
+                if code:
+                    log.error("client %d failed %s with exit code %d", i,
+                              phase, code)
+                timing[i].append((phase, start, end))
+                src_path = os.path.join(workdirs[i], 'client-{0}.log'.format(i))
+                if os.path.exists(src_path):
+                    shutil.copy(src_path, os.path.join(results_dir,
+                        'client-{0}-{1}.log'.format(i, phase)))
+            write_timestamp(results_dir, phase)
+    finally:
+        servers.stop()
+
+    # Like save.yml, keep the first dump and the ones whose digest differs
+    first = None
+    for i, workdir in enumerate(workdirs):
+        src_path = os.path.join(workdir, 'accounts_out.tsv')
+        if not os.path.exists(src_path):
+            continue
+        digest = subprocess.check_output([python, os.path.join(client_dir,
+                                          'digest.py'), src_path])
+        with open(os.path.join(results_dir,
+                               'accounts{0:03d}.digest'.format(i)), 'wb') as f:
+            f.write(digest)
+        if first is None:
+            first = digest
+        elif digest == first and not cfg.get('fetch_all_results'):
+            continue
+        os.rename(src_path, os.path.join(results_dir,
+                                         'accounts{0:03d}.tsv'.format(i)))
+
+    for i in range(clients):
+        with open(os.path.join(results_dir,
+                               'client-{0}-timing.tsv'.format(i)), 'w') as f:
+            for (phase, start, end) in timing[i]:
+                f.write('{0}_start\t{1}\n{0}_end\t{2}\n'.format(phase, start,
+                                                              end))
+    for name in servers.log_names():
+        os.rename(os.path.join(results_dir, name),
+                  os.path.join(result_dir, name))
+        manifest.add_artifact(name)
+    times = {}
+    for what in ('load', 'exec'):
+        with open(os.path.join(results_dir, '.timestamp_' + what)) as f:
+            times[what] = int(f.read())
+    with open(os.path.join(results_dir, '_results.txt'), 'w') as f:
+        f.write('Execution time - {0}\n'.format(times['exec'] - times['load']))
+    manifest.finish('run')
+    return True
+
+def verify(benchmark, client_dir, result_dir, cfg, log):
+    """Check saved accounts in result_dir with check.py"""
+    python = cfg.get('local_python', PYTHON)
+    accounts_dir, trx_dir = dataset_dirs(benchmark, client_dir)
+    code = subprocess.call([python, 'check.py', str(benchmark['client_count']),
+                            '--accounts', accounts_dir, '--trx', trx_dir,
+                            '--results', result_dir], cwd=client_dir)
+    if code:
+        log.error("check.py failed with exit code %d, see checker.log", code)
+    return code == 0
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+#
+# Partition the transactions of trxNNN.txt files across client_count
+# clients by the accounts they touch.
+#
+# regroup.py cuts the input stream blindly, so every client transfers
+# between all accounts. Here transactions are first read into an
+# account-transfer graph (accounts are vertices, every transaction is an
+# edge from its source to its destination), then assigned to clients by
+# one of the strategies:
+#
+#   round-robin  transaction i goes to client i % client_count
+#   source       crc32 of the source account id
+#   mincut       accounts are labeled by balanced label propagation to
+#                keep transfers inside a label, a transaction goes to the
+#                label of its source account
+#
+# The report gives the cross-partition edge ratio: the share of
+# transactions whose source and destination accounts have different home
+# clients, the home of an account being the client that executes most of
+# its transfers. It also gives the share of accounts touched by more than
+# one client. The input is read twice, transactions are kept in memory as
+# account numbers only.
+#
+
+import os
+import sys
+import glob
+import json
+import time
+import zlib
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STRATEGIES = ('round-robin', 'source', 'mincut')
+WRITE_BUFFER = 4 * 1024 * 1024
+
+def fname(i):
+    return "trx%03d.txt" % i
+
+class Graph(object):
+    """Transfers of trx*.txt files with account ids interned to numbers"""
+    def __init__(self):
+        self.ids = []
+        self.index = {}
+        self.src = None
+        self.dst = None
+
+    def intern(self, account_id):
+        i = self.index.get(account_id)
+        if i is None:
+            i = self.index[account_id] = len(self.ids)
+            self.ids.append(account_id)
+        return i
+
+    def load(self, paths):
+        src, dst = [], []
+        for path in paths:
+            with open(path, 'rb') as f:
+                for line in f:
+                    fields = line.split(b'\t')
+                    if len(fields) != 5:
+                        raise ValueError('{}: invalid line [{}]'.format(path,
+                            line.rstrip(b'\n').decode('utf-8', 'replace')))
+                    src.append(self.intern(fields[2]))
+                    dst.append(self.intern(fields[3]))
+        self.src = np.array(src, dtype=np.int64)
+        self.dst = np.array(dst, dtype=np.int64)
+        return self
+
+    @property
+    def accounts(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.src)
+
+#
+# Strategies: return the client of every transaction
+#
+
+def round_robin(graph, parts, opts):
+    return np.arange(len(graph), dtype=np.int64) % parts
+
+def by_source(graph, parts, opts):
+    owner = np.array([zlib.crc32(account_id) % parts
+                      for account_id in graph.ids], dtype=np.int64)
+    return owner[graph.src]
+
+def min_cut(graph, parts, opts):
+    """
+    Label propagation with a load limit. Every round a random half of the
+    accounts moves to the label most of its transfers lead to; moves are
+    accepted by decreasing gain while the target label stays within
+    (1 + imbalance) of the mean load, the load being the number of
+    transactions an account is the source of.
+    """
+    rng = np.random.default_rng(opts.seed)
+    n = graph.accounts
+    # Start from the labels of the source strategy
+    label = np.array([zlib.crc32(account_id) % parts
+                      for account_id in graph.ids], dtype=np.int64)
+    weight = np.bincount(graph.src, minlength=n)
+    capacity = (1 + opts.imbalance) * len(graph) / parts
+    # Undirected edges
+    u = np.concatenate((graph.src, graph.dst))
+    v = np.concatenate((graph.dst, graph.src))
+    keep = u != v
+    u, v = u[keep], v[keep]
+    degree = np.maximum(np.bincount(u, minlength=n), 1)
+    for round_no in range(opts.rounds):
+        # Score of moving every account to every label of its neighbours:
+        # the share of its transfers that stay inside the label, minus a
+        # penalty for the load of the label
+        load = np.bincount(label, weights=weight, minlength=parts)
+        penalty = opts.balance_weight * load / capacity
+        keys, counts = np.unique(u * parts + label[v], return_counts=True)
+        account, target = keys // parts, keys % parts
+        score = counts / degree[account] - penalty[target]
+        current = -penalty[label]
+        own = target == label[account]
+        current[account[own]] = score[own]
+        # The best label of every account: the last one after sorting by
+        # (account, score)
+        order = np.lexsort((score, account))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = account[order][1:] != account[order][:-1]
+        best = order[last]
+        gain = score[best] - current[account[best]]
+        movers = account[best]
+        target = target[best]
+        candidate = ((gain > 0) & (target != label[movers]) &
+                     (rng.random(len(movers)) < 0.5))
+        movers, target, gain = movers[candidate], target[candidate], \
+            gain[candidate]
+        if not len(movers):
+            break
+        # Accept by decreasing gain while the target has room. Room freed
+        # by leaving accounts counts only if their moves are accepted too,
+        # which shrinks the accepted set until it is a fixed point
+        order = np.lexsort((-gain, target))
+        movers, target = movers[order], target[order]
+        source = label[movers]
+        moved = weight[movers]
+        first = np.searchsorted(target, np.arange(parts))
+        accepted = np.ones(len(movers), dtype=bool)
+        while True:
+            cumulative = np.cumsum(moved * accepted)
+            base = np.concatenate(([0], cumulative))[first]
+            arriving = cumulative - base[target]
+            freed = np.bincount(source, weights=moved * accepted,
+                                minlength=parts)
+            fits = load[target] - freed[target] + arriving <= capacity
+            if (fits | ~accepted).all():
+                break
+            accepted &= fits
+        label[movers[accepted]] = target[accepted]
+        print('round {}: moved {} of {} accounts'.format(round_no + 1,
+            int(accepted.sum()), n), file = sys.stderr)
+        if not accepted.any():
+            break
+    return label[graph.src]
+
+PARTITIONERS = {
+    'round-robin': round_robin,
+    'source': by_source,
+    'mincut': min_cut,
+}
+
+def report(graph, client, parts):
+    """Return partitioning statistics as a dict"""
+    n = graph.accounts
+    legs = np.concatenate((graph.src, graph.dst)) * parts + \
+        np.concatenate((client, client))
+    keys, counts = np.unique(legs, return_counts=True)
+    account = keys // parts
+    # Home client: the one with most transfers of the account
+    order = np.lexsort((counts, account))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = account[order][1:] != account[order][:-1]
+    home = np.zeros(n, dtype=np.int64)
+    home[account[order][last]] = keys[order][last] % parts
+    cross = int((home[graph.src] != home[graph.dst]).sum())
+    clients_per_account = np.bincount(account, minlength=n)
+    sizes = np.bincount(client, minlength=parts)
+    total = max(len(graph), 1)
+    return {
+        'transactions': len(graph),
+        'accounts': n,
+        'clients': parts,
+        'cross_partition_edges': cross,
+        'cross_partition_ratio': cross / total,
+        'shared_accounts': int((clients_per_account > 1).sum()),
+        'shared_account_ratio': float((clients_per_account > 1).sum()) /
+            max(n, 1),
+        'min_transactions': int(sizes.min()),
+        'max_transactions': int(sizes.max()),
+        'imbalance': float(sizes.max()) * parts / total - 1,
+    }
+
+def write_parts(paths, dst_dir, client, parts):
+    """Copy every input line to the file of its client, keeping order"""
+    outputs = [open(os.path.join(dst_dir, fname(i)), 'wb',
+                    buffering=WRITE_BUFFER) for i in range(parts)]
+    try:
+        pos = 0
+        for path in paths:
+            with open(path, 'rb') as f:
+                for line in f:
+                    outputs[client[pos]].write(line)
+                    pos += 1
+    finally:
+        for out in outputs:
+            out.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Partition trxNNN.txt transactions across clients by '
+        'the accounts they touch')
+    parser.add_argument('src_dir')
+    parser.add_argument('dst_dir')
+    parser.add_argument('client_count', type=int)
+    parser.add_argument('--strategy', choices=STRATEGIES, default='mincut')
+    parser.add_argument('--rounds', type=int, default=20,
+        help='label propagation rounds of mincut')
+    parser.add_argument('--imbalance', type=float, default=0.05,
+        help='allowed excess of transactions per client over the mean '
+        '(mincut)')
+    parser.add_argument('--balance-weight', type=float, default=1.0,
+        help='weight of the label load in the mincut score')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--report-only', action='store_true',
+        help='print the report without writing files')
+    opts = parser.parse_args()
+
+    if np is None:
+        print('numpy is required', file = sys.stderr)
+        sys.exit(-1)
+    if os.path.realpath(opts.src_dir) == os.path.realpath(opts.dst_dir):
+        parser.error('src_dir and dst_dir must differ')
+    paths = sorted(glob.glob(os.path.join(opts.src_dir, "trx*.txt")))
+    if not paths:
+        parser.error('no trx*.txt files in {}'.format(opts.src_dir))
+    if any(os.path.exists(path + '.batch') for path in paths):
+        print('.batch files are not partitioned, transactions are reordered',
+              file = sys.stderr)
+
+    start_time = time.time()
+    graph = Graph().load(paths)
+    print('read {} transactions between {} accounts in {:.1f} s'.format(
+        len(graph), graph.accounts, time.time() - start_time),
+        file = sys.stderr)
+    client = PARTITIONERS[opts.strategy](graph, opts.client_count, opts)
+    stats = report(graph, client, opts.client_count)
+    stats['strategy'] = opts.strategy
+    print(json.dumps(stats, indent=2, sort_keys=True))
+    if not opts.report_only:
+        os.makedirs(opts.dst_dir, exist_ok=True)
+        write_parts(paths, opts.dst_dir, client, opts.client_count)
+        with open(os.path.join(opts.dst_dir, 'partition.json'), 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+    print('partitioned {} files into {} in {:.1f} s'.format(len(paths),
+        opts.client_count, time.time() - start_time), file = sys.stderr)
+
+# vim: et ts=4 bs=4
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Container placement for run.py.
+#
+# With host_resources in config.yml, every host is described by its cores,
+# NUMA nodes and memory:
+#
+#   host_resources:
+#     default: {cores: 32, numa_nodes: 2, memory: 128G}
+#     192.168.103.161: {cores: 64, nodes: ["0-15,32-47", "16-31,48-63"]}
+#
+# Tarantool containers get server_cores cores each, client containers
+# client_cores, and reserved_cores per host are left to the system. A
+# container is kept within one NUMA node when it fits. Containers go to
+# the hosts with the most free cores left, clients never get cores of
+# Tarantool containers of the same host. Only when there are not enough
+# cores, containers share them, and the placement is reported as
+# oversubscribed. The arena of a host is split between its Tarantool
+# containers and capped by ARENA_SHARE of the memory not taken by clients.
+#
+# Without host_resources containers are spread evenly with integer division
+# and not pinned, as before.
+#
+#   placement.py config.yml host_count server_count client_count
+#
+# prints the placement of a benchmark.
+#
+
+from __future__ import print_function
+
+import sys
+import json
+
+DEFAULT_CORES = {'server_cores': 1, 'client_cores': 1, 'reserved_cores': 1}
+# Share of the memory left after clients and reserved_memory usable for the
+# arena, the rest is for tuples outside of it, WAL buffers and the OS
+ARENA_SHARE = 0.75
+RESERVED_MEMORY = 2.0
+CLIENT_MEMORY = 1.0
+
+UNITS = {'': 1.0, 'K': 1.0 / 1024 ** 2, 'M': 1.0 / 1024, 'G': 1.0,
+         'T': 1024.0}
+
+def parse_memory(value):
+    """Return GB of 128G, 512M, 1T or a plain number of GB"""
+    if value is None:
+        return None
+    value = str(value).strip().upper().rstrip('B')
+    unit = value[-1:].isalpha() and value[-1:] or ''
+    if unit not in UNITS:
+        raise ValueError('invalid memory size: {0}'.format(value))
+    return float(value[:len(value) - len(unit)]) * UNITS[unit]
+
+def parse_cpulist(value):
+    """Return [0, 1, 2, 5] for "0-2,5" """
+    cores = []
+    for part in str(value).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cores.extend(range(int(first), int(last) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+def format_cpulist(cores):
+    """Return "0-2,5" for [0, 1, 2, 5]"""
+    ranges = []
+    for core in sorted(cores):
+        if ranges and ranges[-1][1] == core - 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ','.join(first == last and str(first) or
+                    '{0}-{1}'.format(first, last) for first, last in ranges)
+
+class Host(object):
+    """Free cores of a host, by NUMA node"""
+    def __init__(self, name, resources, reserved):
+        self.name = name
+        if 'nodes' in resources:
+            self.nodes = [parse_cpulist(node) for node in resources['nodes']]
+        else:
+            cores = int(resources['cores'])
+            count = int(resources.get('numa_nodes', 1))
+            self.nodes = [list(range(cores * i // count,
+                                     cores * (i + 1) // count))
+                          for i in range(count)]
+        self.cores = sum(len(node) for node in self.nodes)
+        self.memory = parse_memory(resources.get('memory'))
+        self.reserved = self.nodes[0][:reserved]
+        self.free = [[core for core in node if core not in self.reserved]
+                     for node in self.nodes]
+        self.servers = []
+        self.clients = []
+
+    def free_cores(self):
+        return sum(len(node) for node in self.free)
+
+    def take(self, count):
+        """Take count free cores, from one NUMA node if possible"""
+        nodes = sorted(self.free, key=len, reverse=True)
+        if len(nodes[0]) >= count:
+            nodes = nodes[:1]
+        cores = []
+        for node in nodes:
+            need = count - len(cores)
+            cores.extend(node[:need])
+            del node[:need]
+        return cores
+
+    def unused_cores(self, placed):
+        """Cores not in any of the placed cpusets"""
+        used = set(core for cores in placed for core in cores)
+        return [core for node in self.nodes for core in node
+                if core not in used]
+
+def spread(count, hosts, capacity):
+    """
+    Return containers per host: to the host with the lowest share of its
+    capacity taken, preferring hosts that still have room
+    """
+    counts = dict((host.name, 0) for host in hosts)
+    for i in range(count):
+        def load(host):
+            cap = capacity(host)
+            return (counts[host.name] >= cap, float(counts[host.name] + 1) /
+                    max(cap, 1))
+        best = min(hosts, key=load)
+        counts[best.name] += 1
+    return counts
+
+def legacy_spread(count, hostnames):
+    """
+    populate_hosts(): ceil(count / hosts) per host until count is placed,
+    the rest on the last host
+    """
+    counts = {}
+    total = count
+    per_host = count // len(hostnames)
+    if count % len(hostnames) != 0:
+        per_host += 1
+    for hostname in hostnames:
+        counts[hostname] = hostname != hostnames[-1] and \
+            min(per_host, count) or count
+        count -= counts[hostname]
+        if count <= 0:
+            break
+    if sum(counts.values()) != total:
+        raise ValueError('{0} containers spread as {1}'.format(total, counts))
+    return counts
+
+def server_hostnames(benchmark, pool):
+    return pool['server'][:min(len(pool['server']), benchmark['host_count'])]
+
+def plan(benchmark, pool, cfg):
+    """
+    Return {'hosts': {hostname: {...}}, 'warnings': [...]} with server and
+    client counts, cpusets and arena of every host
+    """
+    servers = server_hostnames(benchmark, pool)
+    resources = cfg.get('host_resources')
+    hosts = {}
+    warnings = []
+    if not resources:
+        arena = float(cfg.get('arena', 100) * benchmark['host_count']) / \
+            benchmark['server_count']
+        counts = {'client': legacy_spread(benchmark['client_count'],
+                                          pool['client']),
+                  'server': legacy_spread(benchmark['server_count'], servers)}
+        for what in ('client', 'server'):
+            for hostname, count in counts[what].items():
+                host = hosts.setdefault(hostname, {'server_count': 0,
+                    'client_count': 0, 'server_cpusets': [],
+                    'client_cpusets': [], 'arena': arena})
+                host[what + '_count'] = count
+        return {'hosts': hosts, 'warnings': warnings}
+
+    opts = dict(DEFAULT_CORES)
+    for name in opts:
+        opts[name] = int(cfg.get(name, opts[name]))
+    machines = {}
+    for hostname in list(servers) + list(pool['client']):
+        if hostname in machines:
+            continue
+        spec = dict(resources.get('default', {}))
+        spec.update(resources.get(hostname, {}))
+        if 'cores' not in spec and 'nodes' not in spec:
+            raise ValueError('host_resources: no cores for {0}'.format(
+                hostname))
+        machines[hostname] = Host(hostname, spec, opts['reserved_cores'])
+
+    def place(what, count, hostnames):
+        size = opts[what + '_cores']
+        candidates = [machines[hostname] for hostname in hostnames]
+        counts = spread(count, candidates,
+                        lambda host: host.free_cores() // size)
+        for host in candidates:
+            have = host.free_cores() // size
+            placed = getattr(host, what + 's')
+            for i in range(counts[host.name]):
+                if i < have:
+                    placed.append(host.take(size))
+                    continue
+                # Out of free cores: share the cores of this role, or the
+                # cores no server uses, or any cores of the host
+                shared = placed[:have] or \
+                    [[core] for core in host.unused_cores(host.servers)] or \
+                    [[core] for core in host.unused_cores([])]
+                placed.append(shared[i % len(shared)])
+            if counts[host.name] > have:
+                warnings.append('{0}: {1} {2} containers on {3} free cores '
+                    'for {4} cores each, cores are shared'.format(host.name,
+                    counts[host.name], what, have * size, size))
+
+    place('server', benchmark['server_count'], servers)
+    place('client', benchmark['client_count'], pool['client'])
+
+    for host in machines.values():
+        arena = float(cfg.get('arena', 100)) / max(len(host.servers), 1)
+        if host.memory is not None and host.servers:
+            limit = (host.memory - RESERVED_MEMORY - len(host.clients) *
+                     float(cfg.get('client_memory', CLIENT_MEMORY))) * \
+                ARENA_SHARE / len(host.servers)
+            if limit < arena:
+                warnings.append('{0}: arena {1:.2f} GB per server capped to '
+                    '{2:.2f} GB by {3:.0f} GB of memory'.format(host.name,
+                    arena, limit, host.memory))
+                arena = max(limit, 0)
+        hosts[host.name] = {
+            'server_count': len(host.servers),
+            'client_count': len(host.clients),
+            'server_cpusets': [format_cpulist(c) for c in host.servers],
+            'client_cpusets': [format_cpulist(c) for c in host.clients],
+            'arena': arena,
+            'cores': host.cores,
+            'numa_nodes': len(host.nodes),
+        }
+    return {'hosts': hosts, 'warnings': warnings}
+
+def report(placement):
+    """Return the placement as lines of text"""
+    lines = []
+    for hostname, host in sorted(placement['hosts'].items()):
+        line = '{0}: {1} servers, {2} clients'.format(hostname,
+            host['server_count'], host['client_count'])
+        if host['server_count']:
+            line += ', arena {0:.2f} GB'.format(host['arena'])
+        lines.append(line)
+        for what in ('server', 'client'):
+            if host[what + '_cpusets']:
+                lines.append('  {0} cpusets: {1}'.format(what,
+                    ' '.join(host[what + '_cpusets'])))
+    for warning in placement['warnings']:
+        lines.append('warning: ' + warning)
+    return lines
+
+if __name__ == '__main__':
+    import yaml
+    if len(sys.argv) != 5:
+        print('Usage: placement.py config.yml host_count server_count '
+              'client_count', file=sys.stderr)
+        sys.exit(2)
+    with open(sys.argv[1]) as f:
+        cfg = yaml.safe_load(f)[0]
+    benchmark = {'host_count': int(sys.argv[2]),
+                 'server_count': int(sys.argv[3]),
+                 'client_count': int(sys.argv[4])}
+    pool = {'client': cfg['client_hosts'], 'server': cfg['server_hosts']}
+    result = plan(benchmark, pool, cfg)
+    print('\n'.join(report(result)))
+    print(json.dumps(result, indent=2, sort_keys=True))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+#
+# Regroup trxNNN.txt (and trxNNN.txt.batch) files for a new client count.
+#
+# Input files are treated as one stream which is cut into client_count
+# parts of equal size in bytes or lines. Cuts are moved to the next line
+# boundary, or to the next batch boundary when .batch files are present,
+# so every output trxNNN.txt.batch still describes its trxNNN.txt. Data is
+# copied by the kernel with copy_file_range()/sendfile().
+#
+
+import os
+import sys
+import glob
+import time
+import bisect
+import argparse
+import concurrent.futures
+
+INDEX_CHUNK = 64 * 1024 * 1024
+WINDOW = 64 * 1024
+
+def fname(i):
+    return "trx%03d.txt" % i
+
+def bname(i):
+    return "trx%03d.txt.batch" % i
+
+class Source(object):
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.index = None
+        self.lines = None
+        self.batches = None
+        self.bounds = None
+        if os.path.exists(path + ".batch"):
+            with open(path + ".batch") as f:
+                self.batches = [int(line) for line in f if line.strip()]
+            self.bounds = [0]
+            for size in self.batches:
+                self.bounds.append(self.bounds[-1] + size)
+
+    def scan(self):
+        """Count newlines per INDEX_CHUNK bytes"""
+        self.index = []
+        buf = bytearray(INDEX_CHUNK)
+        with open(self.path, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                self.index.append(buf.count(b'\n', 0, n))
+        self.lines = sum(self.index)
+        if self.bounds is not None and self.bounds[-1] != self.lines:
+            raise ValueError("{}: {} lines, but .batch file covers {}".format(
+                self.path, self.lines, self.bounds[-1]))
+        return self
+
+    def read(self, offset, size):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def next_line_start(self, offset):
+        """Return the first line start at or after offset"""
+        if offset <= 0:
+            return 0
+        pos = offset - 1
+        while pos < self.size:
+            data = self.read(pos, WINDOW)
+            nl = data.find(b'\n')
+            if nl >= 0:
+                return pos + nl + 1
+            pos += len(data)
+        return self.size
+
+    def lines_before(self, offset):
+        chunk = offset // INDEX_CHUNK
+        count = sum(self.index[:chunk])
+        data = self.read(chunk * INDEX_CHUNK, offset - chunk * INDEX_CHUNK)
+        return count + data.count(b'\n')
+
+    def line_offset(self, line):
+        """Return the byte offset of the beginning of the line"""
+        if line <= 0:
+            return 0
+        if line >= self.lines:
+            return self.size
+        count = 0
+        for chunk, n in enumerate(self.index):
+            if count + n >= line:
+                break
+            count += n
+        data = self.read(chunk * INDEX_CHUNK, INDEX_CHUNK)
+        pos = -1
+        for _ in range(line - count):
+            pos = data.find(b'\n', pos + 1)
+        return chunk * INDEX_CHUNK + pos + 1
+
+    def snap(self, line):
+        """Move the line number forward to a batch boundary"""
+        if self.bounds is None:
+            return line
+        return self.bounds[bisect.bisect_left(self.bounds, line)]
+
+    def batch_range(self, line_begin, line_end):
+        return self.batches[bisect.bisect_left(self.bounds, line_begin):
+                            bisect.bisect_left(self.bounds, line_end)]
+
+#
+# Kernel-side copy
+#
+
+copy_method = 'copy_file_range'
+
+def copy_range(src_fd, dst_fd, offset, count):
+    global copy_method
+    while count > 0:
+        try:
+            if copy_method == 'copy_file_range':
+                n = os.copy_file_range(src_fd, dst_fd, count, offset)
+            elif copy_method == 'sendfile':
+                n = os.sendfile(dst_fd, src_fd, offset, count)
+            else:
+                n = os.write(dst_fd, os.pread(src_fd, min(count, WINDOW * 16),
+                                              offset))
+        except (OSError, AttributeError) as e:
+            if copy_method == 'read':
+                raise
+            copy_method = copy_method == 'copy_file_range' and 'sendfile' \
+                or 'read'
+            print('falling back to {}: {}'.format(copy_method, e),
+                  file = sys.stderr)
+            continue
+        if n == 0:
+            raise IOError('unexpected end of file')
+        offset += n
+        count -= n
+
+def write_part(part):
+    (dst_dir, i, pieces, with_batch) = part
+    path = os.path.join(dst_dir, fname(i))
+    total = 0
+    batches = []
+    dst_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        for (src, begin, end, line_begin, line_end) in pieces:
+            src_fd = os.open(src.path, os.O_RDONLY)
+            try:
+                copy_range(src_fd, dst_fd, begin, end - begin)
+            finally:
+                os.close(src_fd)
+            total += end - begin
+            if with_batch:
+                batches.extend(src.batch_range(line_begin, line_end))
+    finally:
+        os.close(dst_fd)
+    if with_batch:
+        with open(os.path.join(dst_dir, bname(i)), 'w') as f:
+            f.write(''.join('{}\n'.format(b) for b in batches))
+    return path, total
+
+#
+# Planning
+#
+
+def locate(sources, weights, target):
+    """Find the source and its local weight offset for a global target"""
+    for src, weight in zip(sources, weights):
+        if target < weight:
+            return src, target
+        target -= weight
+    return sources[-1], weights[-1]
+
+def cut(src, unit, balance):
+    """Return (offset, line) of a cut near unit in src"""
+    if balance == 'lines':
+        line = src.snap(unit)
+        return src.line_offset(line), line
+    offset = src.next_line_start(unit)
+    if src.index is None:
+        return offset, None
+    line = src.snap(src.lines_before(offset))
+    return src.line_offset(line), line
+
+def plan(sources, client_count, balance):
+    if balance == 'lines':
+        weights = [src.lines for src in sources]
+    else:
+        weights = [src.size for src in sources]
+    total = sum(weights)
+    cuts = [(0, 0, 0)]
+    for i in range(1, client_count):
+        src, unit = locate(sources, weights, total * i // client_count)
+        offset, line = cut(src, unit, balance)
+        cuts.append((sources.index(src), offset, line))
+    last = sources[-1]
+    cuts.append((len(sources) - 1, last.size, last.lines))
+
+    parts = []
+    for (sa, oa, la), (sb, ob, lb) in zip(cuts, cuts[1:]):
+        pieces = []
+        for s in range(sa, sb + 1):
+            src = sources[s]
+            begin, line_begin = s == sa and (oa, la) or (0, 0)
+            end, line_end = s == sb and (ob, lb) or (src.size, src.lines)
+            if end > begin:
+                pieces.append((src, begin, end, line_begin, line_end))
+        parts.append(pieces)
+    return parts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Regroup trxNNN.txt files for a new client count')
+    parser.add_argument('src_dir')
+    parser.add_argument('dst_dir')
+    parser.add_argument('client_count', type=int)
+    parser.add_argument('--balance', choices=('bytes', 'lines'),
+        default='bytes', help='balance output files by bytes or by lines')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='number of files written concurrently')
+    opts = parser.parse_args()
+
+    if os.path.realpath(opts.src_dir) == os.path.realpath(opts.dst_dir):
+        parser.error('src_dir and dst_dir must differ')
+    paths = sorted(glob.glob(os.path.join(opts.src_dir, "trx*.txt")))
+    if not paths:
+        parser.error('no trx*.txt files in {}'.format(opts.src_dir))
+    sources = [Source(path) for path in paths]
+    with_batch = sources[0].batches is not None
+    if any((src.batches is not None) != with_batch for src in sources):
+        parser.error('.batch files must exist for all or none of the inputs')
+
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(opts.jobs) as pool:
+        # Line index is needed to cut at line or batch boundaries only
+        if opts.balance == 'lines' or with_batch:
+            list(pool.map(Source.scan, sources))
+            print('indexed {} files in {:.1f} s'.format(len(sources),
+                time.time() - start_time), file = sys.stderr)
+        parts = plan(sources, opts.client_count, opts.balance)
+        os.makedirs(opts.dst_dir, exist_ok=True)
+        tasks = [(opts.dst_dir, i, pieces, with_batch)
+            for i, pieces in enumerate(parts)]
+        for path, size in pool.map(write_part, tasks):
+            print('Creating {} ({} bytes)'.format(path, size),
+                  file = sys.stderr)
+    print('regrouped {} files into {} in {:.1f} s'.format(len(sources),
+        opts.client_count, time.time() - start_time), file = sys.stderr)
+
+# vim: et ts=4 bs=4
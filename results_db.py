@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Local history of benchmark results with regression detection.
+#
+# Every run.py benchmark is stored in results.db (SQLite) with its
+# benchmarks.csv row, Tarantool version and metrics. `report` compares the
+# latest run of every row with the previous runs of the same row.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+DB_PATH = 'results.db'
+# Relative change treated as noise
+THRESHOLD = 0.1
+# Number of previous runs the latest one is compared with
+HISTORY = 5
+
+def lower_is_better(name):
+    """Phase times and latencies; throughput is higher-is-better"""
+    return name.endswith('_time') or '_latency_' in name
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS run (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        benchmark_id INTEGER NOT NULL,
+        topology TEXT NOT NULL,
+        version TEXT NOT NULL,
+        date REAL NOT NULL,
+        result_dir TEXT
+    );
+    CREATE INDEX IF NOT EXISTS run_benchmark_idx
+        ON run (benchmark_id, topology, date);
+    CREATE INDEX IF NOT EXISTS run_version_idx ON run (version, date);
+    CREATE TABLE IF NOT EXISTS metric (
+        run_id INTEGER NOT NULL REFERENCES run (run_id),
+        name TEXT NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (run_id, name)
+    );
+"""
+
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def topology(benchmark):
+    return ('hosts={host_count} servers={server_count} '
+            'clients={client_count} redundancy={redundancy} '
+            'batch={batch:d} hardware_failure={hardware_failure:d}').format(
+                **benchmark)
+
+def collect_metrics(result_dir):
+    """Read metrics of a finished benchmark from out/<id>"""
+    metrics = {}
+    times = {}
+    for what in ('start', 'load', 'exec', 'save'):
+        path = os.path.join(result_dir, '.timestamp_' + what)
+        if os.path.exists(path):
+            with open(path) as f:
+                times[what] = int(f.read())
+    for name, begin, end in (('load_time', 'start', 'load'),
+                             ('exec_time', 'load', 'exec'),
+                             ('save_time', 'exec', 'save')):
+        if begin in times and end in times:
+            metrics[name] = times[end] - times[begin]
+    path = os.path.join(result_dir, 'analytics.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            phases = json.load(f)['phases']
+        for phase, stats in phases.items():
+            metrics[phase + '_throughput'] = stats['throughput']
+            for p in ('p50', 'p99', 'p999'):
+                if stats['latency_ms'][p] is not None:
+                    metrics['{0}_latency_{1}'.format(phase, p)] = \
+                        stats['latency_ms'][p]
+    return metrics
+
+def insert(conn, benchmark, version, metrics, result_dir=None, date=None):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO run (benchmark_id, topology, version, date, result_dir)
+        VALUES (?, ?, ?, ?, ?)
+    """, (benchmark['benchmark_id'], topology(benchmark), version or '',
+          date or time.time(), result_dir))
+    run_id = cur.lastrowid
+    cur.executemany("INSERT INTO metric (run_id, name, value) VALUES (?, ?, ?)",
+                    [(run_id, name, value) for name, value in metrics.items()])
+    conn.commit()
+    return run_id
+
+def record(benchmark, version, result_dir, path=DB_PATH):
+    """Store a run.py benchmark, return the run id"""
+    conn = connect(path)
+    try:
+        return insert(conn, benchmark, version, collect_metrics(result_dir),
+                      result_dir)
+    finally:
+        conn.close()
+
+def metrics_of(conn, run_id):
+    return dict(conn.execute("SELECT name, value FROM metric WHERE run_id = ?",
+                             (run_id,)))
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+def regressions(conn, threshold=THRESHOLD, history=HISTORY):
+    """
+    Compare the latest run of every (benchmark_id, topology) with the
+    median of up to `history` previous runs. Yields (benchmark_id,
+    topology, version, name, baseline, value, change) for changes for
+    the worse beyond threshold.
+    """
+    rows = conn.execute("""
+        SELECT benchmark_id, topology, MAX(date) FROM run
+        GROUP BY benchmark_id, topology ORDER BY benchmark_id
+    """).fetchall()
+    for (benchmark_id, topo, date) in rows:
+        runs = conn.execute("""
+            SELECT run_id, version, date FROM run
+            WHERE benchmark_id = ? AND topology = ?
+            ORDER BY date DESC LIMIT ?
+        """, (benchmark_id, topo, history + 1)).fetchall()
+        if len(runs) < 2:
+            continue
+        latest = runs[0]
+        current = metrics_of(conn, latest[0])
+        previous = [metrics_of(conn, r[0]) for r in runs[1:]]
+        for name, value in sorted(current.items()):
+            values = [m[name] for m in previous if name in m]
+            if not values:
+                continue
+            baseline = median(values)
+            if baseline == 0:
+                continue
+            change = (value - baseline) / abs(baseline)
+            worse = lower_is_better(name) and change or -change
+            if worse > threshold:
+                yield (benchmark_id, topo, latest[1], name, baseline, value,
+                       change)
+
+def report(conn, threshold=THRESHOLD, history=HISTORY):
+    found = False
+    for (benchmark_id, topo, version, name, baseline, value, change) in \
+            regressions(conn, threshold, history):
+        found = True
+        print('REGRESSION #{0} ({1}) version {2}: {3} {4:.2f} -> {5:.2f} '
+              '({6:+.1f}%)'.format(benchmark_id, topo, version, name,
+              baseline, value, change * 100))
+    if not found:
+        print('no regressions beyond {0:.0f}%'.format(threshold * 100))
+    return not found
+
+def query(conn, benchmark_id=None, version=None):
+    sql = "SELECT run_id, benchmark_id, topology, version, date FROM run"
+    where, params = [], []
+    if benchmark_id is not None:
+        where.append("benchmark_id = ?")
+        params.append(benchmark_id)
+    if version is not None:
+        where.append("version = ?")
+        params.append(version)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date"
+    for (run_id, bid, topo, ver, date) in conn.execute(sql, params).fetchall():
+        metrics = metrics_of(conn, run_id)
+        print('#{0} {1} ({2}) version {3}: {4}'.format(bid,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(date)), topo, ver,
+            ' '.join('{0}={1:g}'.format(k, v)
+                     for k, v in sorted(metrics.items()))))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark results history')
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('report', help='flag regressions of the latest runs')
+    p.add_argument('--threshold', type=float, default=THRESHOLD,
+        help='relative change treated as noise (default 0.1)')
+    p.add_argument('--history', type=int, default=HISTORY,
+        help='number of previous runs to compare with')
+    p = sub.add_parser('query', help='list stored runs')
+    p.add_argument('--benchmark', type=int)
+    p.add_argument('--version')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    if args.command == 'query':
+        query(conn, args.benchmark, args.version)
+    else:
+        threshold = getattr(args, 'threshold', THRESHOLD)
+        history = getattr(args, 'history', HISTORY)
+        sys.exit(report(conn, threshold, history) and 0 or 1)
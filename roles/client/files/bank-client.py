@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# asyncio load driver for the bank HTTP API described in README.md, a
+# drop-in for imdgtest-client-1.0-SNAPSHOT.jar:
+#
+#   bank-client.py -id N -server host:port [-server ...] load [-batch N] file...
+#   bank-client.py -id N -server ... exec-trans [-batch N] [-rate R] file...
+#   bank-client.py -id N -server ... save -out file
+#
+# Every server gets a pool of keep-alive connections. Requests go to
+# server N % servers first and fail over to the next ones on errors, like
+# the jar does. Requests are logged to client-N.log in the log4j format
+# of the jar, so analyze_logs.py handles both clients.
+#
+# Closed loop (default): -concurrency requests are in flight, the next one
+# is sent when one completes. Open loop (-rate R): batches are sent at R
+# per second regardless of responses. Latency is measured from the
+# intended send time, so queueing behind slow requests is not hidden
+# (coordinated omission). In closed loop the same correction is applied
+# when -expected-interval is given.
+#
+# Needs Python 3.5+ and nothing outside the standard library.
+#
+
+import sys
+import math
+import time
+import socket
+import asyncio
+import logging
+import argparse
+
+DEFAULT_PORT = 8080
+RETRIES = 2
+# Body pieces written to the output file at once by `save`
+CHUNK_SIZE = 1024 * 1024
+
+log = logging.getLogger('Driver')
+
+class Histogram(object):
+    """
+    Log-linear histogram of microseconds, values are kept with `digits`
+    significant decimal digits (same layout as analyze_logs.Histogram).
+    """
+    def __init__(self, digits=2):
+        self.sub_buckets = 10 ** digits
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def key(self, value):
+        if value < self.sub_buckets:
+            return (0, int(value))
+        exponent = int(math.log10(value)) - int(math.log10(self.sub_buckets)) + 1
+        return (exponent, int(value / 10 ** exponent))
+
+    def record(self, value):
+        k = self.key(value)
+        self.counts[k] = self.counts.get(k, 0) + 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def record_corrected(self, value, expected_interval):
+        """
+        HdrHistogram recordValueWithExpectedInterval(): a request that took
+        longer than the expected interval delayed the requests that would
+        have been sent meanwhile, record them too.
+        """
+        self.record(value)
+        if not expected_interval:
+            return
+        missed = value - expected_interval
+        while missed >= expected_interval:
+            self.record(missed)
+            missed -= expected_interval
+
+    def percentile(self, p):
+        if self.total == 0:
+            return None
+        rank = max(1, int(math.ceil(self.total * p / 100.0)))
+        seen = 0
+        for (exponent, mantissa) in sorted(self.counts):
+            seen += self.counts[(exponent, mantissa)]
+            if seen >= rank:
+                return min((mantissa + 1) * 10 ** exponent - 1, self.max)
+        return self.max
+
+    def format(self):
+        def ms(value):
+            return value is None and '-' or '{0:.3f}'.format(value / 1000.0)
+        return 'p50={0} p90={1} p99={2} p999={3} max={4} ms'.format(
+            ms(self.percentile(50)), ms(self.percentile(90)),
+            ms(self.percentile(99)), ms(self.percentile(99.9)),
+            ms(self.total and self.max or None))
+
+class HTTPError(Exception):
+    pass
+
+class Connection(object):
+    """One keep-alive HTTP/1.1 connection"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    @property
+    def closed(self):
+        return self.writer is None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b'', sink=None):
+        """
+        Return (status, body). With `sink` the body is passed to it piece
+        by piece instead and b'' is returned.
+        """
+        if self.closed:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+            sock = self.writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        head = ('{0} {1} HTTP/1.1\r\n'
+                'Host: {2}:{3}\r\n'
+                'Content-Type: application/octet-stream\r\n'
+                'Content-Length: {4}\r\n'
+                '\r\n').format(method, path, self.host, self.port, len(body))
+        # One write: head and body in separate segments stall on delayed ACK
+        self.writer.write(head.encode('ascii') + body)
+        await self.writer.drain()
+
+        line = await self.reader.readline()
+        if not line:
+            raise HTTPError('connection closed by server')
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        pieces = []
+        emit = sink or pieces.append
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Trailers
+                    while (await self.reader.readline()) not in (b'\r\n', b''):
+                        pass
+                    break
+                emit(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+        elif 'content-length' in headers:
+            left = int(headers['content-length'])
+            while left > 0:
+                piece = await self.reader.readexactly(min(left, CHUNK_SIZE))
+                emit(piece)
+                left -= len(piece)
+        else:
+            while True:
+                piece = await self.reader.read(CHUNK_SIZE)
+                if not piece:
+                    break
+                emit(piece)
+            headers['connection'] = 'close'
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, b''.join(pieces)
+
+class Pool(object):
+    """Keep-alive connections to one server, at most `size` at once"""
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def request(self, method, path, body=b'', sink=None):
+        await self.slots.acquire()
+        conn = self.idle and self.idle.pop() or Connection(self.host, self.port)
+        try:
+            result = await conn.request(method, path, body, sink)
+        except:
+            conn.close()
+            raise
+        finally:
+            self.slots.release()
+        if not conn.closed:
+            self.idle.append(conn)
+        return result
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+
+def parse_server(server):
+    host, _, port = server.partition(':')
+    return host, int(port or DEFAULT_PORT)
+
+class Client(object):
+    def __init__(self, client_id, servers, concurrency, retries=RETRIES):
+        self.pools = [Pool(host, port, concurrency)
+                      for (host, port) in map(parse_server, servers)]
+        self.current = client_id % len(self.pools)
+        self.retries = retries
+
+    async def request(self, method, path, body=b'', sink=None, rewind=None):
+        """
+        Send to the current server, switch to the next one on errors.
+        rewind is called before every retry, to drop what a failed attempt
+        has passed to sink.
+        """
+        for attempt in range(self.retries + 1):
+            pool = self.pools[self.current]
+            if attempt and rewind is not None:
+                rewind()
+            try:
+                status, data = await pool.request(method, path, body, sink)
+                if status == 200:
+                    return data
+                reason = 'http {0}: {1}'.format(status,
+                    data[:200].decode('utf-8', 'replace').strip())
+            except (OSError, HTTPError, ValueError,
+                    asyncio.IncompleteReadError) as e:
+                reason = str(e) or type(e).__name__
+            log.warning('%s %s to %s:%d failed: %s', method, path.split('?')[0],
+                        pool.host, pool.port, reason)
+            if attempt < self.retries and len(self.pools) > 1:
+                self.current = (self.current + 1) % len(self.pools)
+        raise HTTPError(reason)
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+
+class Stats(object):
+    def __init__(self, operation, expected_interval=None):
+        self.operation = operation
+        # Microseconds
+        self.expected_interval = expected_interval
+        self.latency = Histogram()
+        self.service = Histogram()
+        self.requests = 0
+        self.records = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def record(self, records, intended, sent, done):
+        latency = (done - intended) * 1e6
+        service = (done - sent) * 1e6
+        self.latency.record_corrected(latency, self.expected_interval)
+        self.service.record(service)
+        self.requests += 1
+        self.records += records
+        log.debug('Operation %s %d records, latency %.3f ms, service %.3f ms',
+                  self.operation, records, latency / 1000.0, service / 1000.0)
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        log.info('Summary %s: %d requests, %d records, %d errors in %.3f s, '
+                 '%.1f records/s', self.operation, self.requests, self.records,
+                 self.errors, elapsed, elapsed and self.records / elapsed or 0)
+        log.info('Latency %s: %s', self.operation, self.latency.format())
+        log.info('Service time %s: %s', self.operation, self.service.format())
+
+def read_batches(paths, batch, batch_file=None):
+    """
+    Yield lists of lines. Batch sizes are taken from batch_file (one per
+    line, as written by gen-transactions.py) while it lasts, then `batch`.
+    """
+    sizes = iter(())
+    if batch_file:
+        with open(batch_file) as f:
+            sizes = iter([int(line) for line in f if line.strip()])
+    for path in paths:
+        with open(path, 'rb') as f:
+            lines = []
+            limit = next(sizes, batch)
+            for line in f:
+                if not line.strip():
+                    continue
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                lines.append(line)
+                if len(lines) >= limit:
+                    yield lines
+                    lines = []
+                    limit = next(sizes, batch)
+            if lines:
+                yield lines
+
+async def send(client, url, lines, stats, intended):
+    sent = time.monotonic()
+    try:
+        await client.request('POST', url.format(len(lines)), b''.join(lines))
+    except HTTPError as e:
+        stats.errors += 1
+        log.error('Operation %s failed for %d records: %s', stats.operation,
+                  len(lines), e)
+        return
+    stats.record(len(lines), intended, sent, time.monotonic())
+
+async def closed_loop(client, url, batches, stats, concurrency):
+    async def worker():
+        # The generator is shared, every batch is taken by one worker
+        for lines in batches:
+            await send(client, url, lines, stats, time.monotonic())
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+async def open_loop(client, url, batches, stats, concurrency, rate):
+    """Batch i is due at start + i / rate, at most `concurrency` in flight"""
+    loop = asyncio.get_event_loop()
+    slots = asyncio.Semaphore(concurrency)
+    pending = set()
+    start = time.monotonic()
+    for i, lines in enumerate(batches):
+        intended = start + i / rate
+        delay = intended - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await slots.acquire()
+        task = loop.create_task(send(client, url, lines, stats, intended))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        task.add_done_callback(lambda t: slots.release())
+    if pending:
+        await asyncio.wait(pending)
+
+async def run_load(client, opts):
+    stats = Stats('load')
+    await closed_loop(client, '/bulk_load?count={0}',
+                      read_batches(opts.files, opts.batch), stats,
+                      opts.concurrency)
+    stats.summary()
+    return stats
+
+async def run_trans(client, opts):
+    stats = Stats('transactions', opts.expected_interval and
+                  opts.expected_interval * 1000.0)
+    batches = read_batches(opts.files, opts.batch, opts.batch_file)
+    if opts.rate:
+        await open_loop(client, '/transactions?count={0}', batches, stats,
+                        opts.concurrency, opts.rate)
+    else:
+        await closed_loop(client, '/transactions?count={0}', batches, stats,
+                          opts.concurrency)
+    stats.summary()
+    return stats
+
+async def run_save(client, opts):
+    stats = Stats('get_all')
+    lines = [0]
+    with open(opts.out, 'wb') as f:
+        def sink(piece):
+            lines[0] += piece.count(b'\n')
+            f.write(piece)
+        def rewind():
+            f.seek(0)
+            f.truncate()
+            lines[0] = 0
+        started = time.monotonic()
+        try:
+            await client.request('GET', '/get_all', sink=sink, rewind=rewind)
+            stats.record(lines[0], started, started, time.monotonic())
+        except HTTPError as e:
+            stats.errors += 1
+            log.error('Operation get_all failed: %s', e)
+    stats.summary()
+    return stats
+
+def setup_logging(client_id):
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: '
+                                  '%(message)s', '%y/%m/%d %H:%M:%S')
+    handler = logging.FileHandler('client-{0}.log'.format(client_id), 'w')
+    handler.setFormatter(formatter)
+    handler.setLevel(logging.DEBUG)
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(formatter)
+    console.setLevel(logging.INFO)
+    log.addHandler(handler)
+    log.addHandler(console)
+    log.setLevel(logging.DEBUG)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='asyncio client for the bank HTTP API')
+    parser.add_argument('-id', dest='client_id', type=int, required=True)
+    parser.add_argument('-server', dest='servers', action='append',
+        required=True, help='host[:port], may be repeated or comma-separated')
+    parser.add_argument('-concurrency', type=int, default=4,
+        help='requests in flight (default 4)')
+    parser.add_argument('-retries', type=int, default=RETRIES,
+        help='switch to the next server up to this many times per request')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('load', help='POST /bulk_load')
+    p.add_argument('-batch', type=int, default=25000)
+    p.add_argument('files', nargs='+')
+    p = sub.add_parser('exec-trans', help='POST /transactions')
+    p.add_argument('-batch', type=int, default=100)
+    p.add_argument('-batch-file', dest='batch_file',
+        help='batch sizes, one per line (.batch of gen-transactions.py)')
+    p.add_argument('-rate', type=float, default=0,
+        help='open loop: batches per second (default: closed loop)')
+    p.add_argument('-expected-interval', dest='expected_interval',
+        type=float, default=0, help='closed loop: expected ms between '
+        'requests of one worker, enables coordinated omission correction')
+    p.add_argument('files', nargs='+')
+    p = sub.add_parser('save', help='GET /get_all')
+    p.add_argument('-out', required=True)
+    opts = parser.parse_args(argv)
+    opts.servers = [s for arg in opts.servers for s in arg.split(',') if s]
+    return opts
+
+def main(argv=None):
+    opts = parse_args(argv)
+    setup_logging(opts.client_id)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = Client(opts.client_id, opts.servers, opts.concurrency,
+                    opts.retries)
+    run = {'load': run_load, 'exec-trans': run_trans,
+           'save': run_save}[opts.command]
+    try:
+        stats = loop.run_until_complete(run(client, opts))
+    finally:
+        client.close()
+        loop.close()
+    return stats.errors and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,45 +6,94 @@ import os
 import sqlite3
 import csv
 import logging
-import shutil
+import argparse
+import zlib
+import json
+import hashlib
+import multiprocessing
 
-CLIENT_DIR = os.path.abspath("../../client/files")
+import digest
 
-if len(sys.argv) < 2:
-    print('Usage: {} client_count'.format(sys.argv[0]), file = sys.stderr)
-    sys.exit(-1)
-client_count = int(sys.argv[1])
+try:
+    import numpy as np
+    import dataset
+except ImportError:
+    np = None
 
-##
+CLIENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-os.chdir(os.path.join(CLIENT_DIR, "results"))
+# Number of transactions accumulated before they are applied to the ledger
+REPLAY_CHUNK = 1000000
+
+# Bump when the way expected balances are computed changes, so that old
+# cache entries are not used
+CACHE_VERSION = 1
+HASH_BUFFER = 4 * 1024 * 1024
+
+# Checksum buckets of --verify buckets and the size of the blocks saved
+# files are scanned in
+BUCKETS = 4096
+SCAN_BLOCK = 8 * 1024 * 1024
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay transactions and check saved accounts')
+    parser.add_argument('client_count', type=int)
+    parser.add_argument('--engine', choices=('numpy', 'sqlite'),
+        help='replay engine (default: numpy, sqlite if numpy is not '
+        'available), not used with --jobs and --dataset')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='verify client files in parallel using N processes')
+    parser.add_argument('--partitions', type=int, default=0,
+        help='number of account partitions for --jobs (default: jobs)')
+    parser.add_argument('--accounts',
+        default=os.path.join(CLIENT_DIR, "accounts"),
+        help='directory with accountsNNN files')
+    parser.add_argument('--trx', default=os.path.join(CLIENT_DIR, "trx"),
+        help='directory with trxNNN.txt files')
+    parser.add_argument('--results',
+        default=os.path.join(CLIENT_DIR, "results"),
+        help='directory with saved accountsNNN.tsv files, checker.log is '
+        'written there')
+    parser.add_argument('--dataset',
+        help='read accounts and transactions from a dataset.py directory '
+        'instead of --accounts/--trx (numpy engine)')
+    parser.add_argument('--cache',
+        default=os.path.join(CLIENT_DIR, "check-cache"),
+        help='directory for expected balances keyed by input digest '
+        '(numpy engine)')
+    parser.add_argument('--cache-size', type=int, default=4096,
+        help='cache size limit in MB, least recently used entries are '
+        'removed')
+    parser.add_argument('--no-cache', dest='cache', action='store_const',
+        const=None, help='always replay transactions')
+    parser.add_argument('--verify', choices=('buckets', 'full'),
+        default='buckets', help='compare per-bucket checksums first and '
+        'accounts only in mismatching buckets, or compare every account '
+        '(numpy engine)')
+    parser.add_argument('--buckets', type=int, default=BUCKETS,
+        help='number of checksum buckets for --verify buckets')
+    args = parser.parse_args(argv)
+    if args.dataset and args.jobs > 1:
+        parser.error('--dataset and --jobs cannot be used together')
+    if args.engine and args.jobs > 1:
+        parser.error('--jobs replays in its own processes, --engine does '
+                     'not apply')
+    if args.engine == 'sqlite' and args.dataset:
+        parser.error('--dataset requires the numpy engine')
+    return args
+
+# Set by main()
+args = None
+client_count = 0
+accounts_dir = trx_dir = results_dir = None
+saved_paths = []
 
 log = logging.getLogger('checker')
-log.setLevel(logging.DEBUG)
-console_handler = logging.StreamHandler()
-log.addHandler(console_handler)
-file_handler = logging.FileHandler('checker.log')
-log.addHandler(file_handler)
-log.info("started")
-
-conn = sqlite3.connect('accounts.db')
-cur = conn.cursor()
-cur.executescript("""
-    PRAGMA synchronous = OFF;
-    PRAGMA journal_mode = OFF;
-""")
-
-cur.executescript(
-"""
-    CREATE TABLE account (
-        account_id VARCHAR(64) PRIMARY KEY,
-        balance INT8 NOT NULL
-    );
-""");
-
-conn.commit()
 
 def tomoney(s):
+    if s.startswith("-"):
+        return -tomoney(s[1:])
     parts = s.split(".")
     if len(parts) == 1:
         return int(parts[0]) * 100
@@ -61,66 +110,732 @@ def tomoney(s):
             return m1 * 100 + int(parts[1]) * 10
     raise ValueError('tomoney: ' + s)
 
-log.info("importing accounts...")
-for client_id in range(client_count):
-    path = os.path.join(CLIENT_DIR, "accounts",
-        "accounts{:03d}".format(client_id))
-    log.info('importing %s', path)
+def accounts_path(client_id):
+    return os.path.join(accounts_dir, "accounts{:03d}".format(client_id))
+
+def trx_path(client_id):
+    return os.path.join(trx_dir, "trx{:03d}.txt".format(client_id))
+
+#
+# SQLite engine: one UPDATE per transaction leg
+#
+
+def check_sqlite():
+    conn = sqlite3.connect('accounts.db')
+    cur = conn.cursor()
+    cur.executescript("""
+        PRAGMA synchronous = OFF;
+        PRAGMA journal_mode = OFF;
+    """)
+
+    cur.executescript(
+    """
+        DROP TABLE IF EXISTS account;
+        CREATE TABLE account (
+            account_id VARCHAR(64) PRIMARY KEY,
+            balance INT8 NOT NULL
+        );
+    """);
+
+    conn.commit()
+
+    log.info("importing accounts...")
+    for client_id in range(client_count):
+        path = accounts_path(client_id)
+        log.info('importing %s', path)
+        with open(path, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter = '\t')
+            for (account_id, info, balance_str) in reader:
+                balance = tomoney(balance_str)
+                cur.execute("INSERT INTO account (account_id, balance) "+
+                            " VALUES(?, ?)", (account_id, balance))
+        conn.commit()
+
+    log.info("processing transactions...")
+    for client_id in range(client_count):
+        path = trx_path(client_id)
+        log.info('processing %s', path)
+        with open(path, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter = '\t')
+            for (date, trx_id, src, dst, amount_str) in reader:
+                amount = tomoney(amount_str)
+                cur.execute("""
+                    UPDATE account SET balance = balance - ?
+                    WHERE account_id = ?
+                """, (amount, src))
+                cur.execute("""
+                    UPDATE account SET balance = balance + ?
+                    WHERE account_id = ?
+                """, (amount, dst))
+        conn.commit()
+
+    ok = True
+    log.info("checking accounts...")
+    for path in saved_paths:
+        log.info('checking %s', path)
+        with open(path, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter = '\t')
+            for (account_id, info, balance_str) in reader:
+                balance = tomoney(balance_str)
+                cur.execute("SELECT balance FROM account WHERE account_id = ?",
+                            (account_id,))
+                row = cur.fetchone()
+                if row is None:
+                    log.error("invalid account_id=%s in file=%s", account_id,
+                              path)
+                    ok = False
+                    continue
+                real_balance = row[0]
+                if real_balance != balance:
+                    log.error("invalid balance for account_id=%s in file=%s:"+
+                              "expected=%s got=%s", account_id, path,
+                              real_balance, balance)
+                    ok = False
+    conn.close()
+    return ok
+
+#
+# NumPy engine: account ids are interned into a dense index once, the
+# ledger is an int64 array of kopecks and transactions are applied in
+# chunks with np.add.at().
+#
+
+class Ledger(object):
+    def __init__(self):
+        self.index = {}
+        self.ids = []
+        self.balance = None
+        self.id_hash = None
+
+    def get_index(self):
+        if self.index is None:
+            self.index = dict((account_id, i)
+                              for i, account_id in enumerate(self.ids))
+        return self.index
+
+    def get_id_hash(self):
+        if self.id_hash is None:
+            self.id_hash = hash_ids(self.ids)
+        return self.id_hash
+
+    def load(self, paths):
+        balances = []
+        for path in paths:
+            log.info('importing %s', path)
+            with open(path, 'r') as csvfile:
+                reader = csv.reader(csvfile, delimiter = '\t')
+                for (account_id, info, balance_str) in reader:
+                    if account_id in self.index:
+                        log.error("duplicate account_id=%s in file=%s",
+                                  account_id, path)
+                        continue
+                    self.index[account_id] = len(self.ids)
+                    self.ids.append(account_id)
+                    balances.append(tomoney(balance_str))
+        self.balance = np.array(balances, dtype=np.int64)
+
+    def load_dataset(self, data):
+        self.ids = data.ids()
+        self.index = data.index()
+        self.balance = np.zeros(len(self.ids), dtype=np.int64)
+        known = np.zeros(len(self.ids), dtype=bool)
+        for client_id in range(client_count):
+            table = data.accounts(client_id)
+            log.info('importing %s', table.path)
+            codes = table.column('id')
+            first = np.zeros(len(codes), dtype=bool)
+            first[np.unique(codes, return_index=True)[1]] = True
+            fresh = first & ~known[codes]
+            for j in np.flatnonzero(~fresh):
+                log.error("duplicate account_id=%s in file=%s",
+                          self.ids[codes[j]], table.path)
+            self.balance[codes[fresh]] = table.column('balance')[fresh]
+            known[codes[fresh]] = True
+
+    def replay_dataset(self, table):
+        log.info('processing %s', table.path)
+        amount = table.column('amount')
+        # Negative codes are accounts missing from the dataset
+        for begin in range(0, len(amount), REPLAY_CHUNK):
+            end = begin + REPLAY_CHUNK
+            self.apply(table.column('src')[begin:end],
+                       table.column('dst')[begin:end], amount[begin:end])
+
+    def apply(self, src, dst, amount):
+        src = np.array(src, dtype=np.int64)
+        dst = np.array(dst, dtype=np.int64)
+        amount = np.array(amount, dtype=np.int64)
+        # Unknown accounts are skipped just like UPDATE ... WHERE does
+        mask = src >= 0
+        np.add.at(self.balance, src[mask], -amount[mask])
+        mask = dst >= 0
+        np.add.at(self.balance, dst[mask], amount[mask])
+
+    def replay(self, path):
+        log.info('processing %s', path)
+        index = self.index
+        src, dst, amount = [], [], []
+        with open(path, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter = '\t')
+            for (date, trx_id, src_id, dst_id, amount_str) in reader:
+                src.append(index.get(src_id, -1))
+                dst.append(index.get(dst_id, -1))
+                amount.append(tomoney(amount_str))
+                if len(amount) >= REPLAY_CHUNK:
+                    self.apply(src, dst, amount)
+                    src, dst, amount = [], [], []
+        if amount:
+            self.apply(src, dst, amount)
+
+    def check(self, path):
+        log.info('checking %s', path)
+        ok = True
+        index = self.get_index()
+        pos, got = [], []
+        with open(path, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter = '\t')
+            for (account_id, info, balance_str) in reader:
+                i = index.get(account_id)
+                if i is None:
+                    log.error("invalid account_id=%s in file=%s", account_id,
+                              path)
+                    ok = False
+                    continue
+                pos.append(i)
+                got.append(tomoney(balance_str))
+        pos = np.array(pos, dtype=np.int64)
+        got = np.array(got, dtype=np.int64)
+        expected = self.balance[pos]
+        for j in np.flatnonzero(expected != got):
+            log.error("invalid balance for account_id=%s in file=%s:"+
+                      "expected=%s got=%s", self.ids[pos[j]], path,
+                      expected[j], got[j])
+            ok = False
+        return ok
+
+#
+# Expected balances only depend on the input files. They are stored as
+# dataset.py tables named by a digest of the inputs, so a dataset shared
+# by several benchmarks is replayed once.
+#
+
+class BalanceCache(object):
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.memo_path = os.path.join(path, 'digests.json')
+        os.makedirs(path, exist_ok=True)
+        # Digests of files by path, size and mtime, so unchanged inputs
+        # are not read again
+        self.memo = {}
+        if os.path.exists(self.memo_path):
+            with open(self.memo_path) as f:
+                self.memo = json.load(f)
+
+    def file_digest(self, path):
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        entry = self.memo.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(HASH_BUFFER)
+                if not data:
+                    break
+                h.update(data)
+        self.memo[path] = [stamp, h.hexdigest()]
+        return h.hexdigest()
+
+    def key(self, paths):
+        h = hashlib.blake2b(digest_size=20)
+        h.update('v{}\n'.format(CACHE_VERSION).encode())
+        for path in paths:
+            h.update('{}\t{}\n'.format(os.path.basename(path),
+                                       self.file_digest(path)).encode())
+        tmp_path = self.memo_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.memo, f)
+        os.rename(tmp_path, self.memo_path)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.col')
+
+    def get(self, key):
+        path = self.entry_path(key)
+        if not os.path.exists(path):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        table = dataset.Table(path)
+        ledger = Ledger()
+        ledger.ids = table.string_list('id')
+        # Built on first use, --verify buckets may not need it
+        ledger.index = None
+        ledger.balance = table.column('balance')
+        if 'id_hash' in table:
+            ledger.id_hash = table.column('id_hash')
+        return ledger
+
+    def put(self, key, ledger):
+        dataset.write_table(self.entry_path(key), len(ledger.ids),
+                            {'balance': ledger.balance,
+                             'id_hash': ledger.get_id_hash()},
+                            {'id': ledger.ids})
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.col') and name != '{}.col'.format(keep):
+                st = os.stat(os.path.join(self.path, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for (mtime, size, name) in entries)
+        for (mtime, size, name) in sorted(entries):
+            if total <= self.limit:
+                break
+            log.info("removing %s from cache", name)
+            os.unlink(os.path.join(self.path, name))
+            total -= size
+
+def input_paths(data):
+    if data is None:
+        return ([accounts_path(i) for i in range(client_count)] +
+                [trx_path(i) for i in range(client_count)])
+    return ([data.table('ids').path] +
+            [data.accounts(i).path for i in range(client_count)] +
+            [data.trx(i).path for i in range(client_count)])
+
+def expected_balances(data=None):
+    ledger = Ledger()
+    log.info("importing accounts...")
+    if data is not None:
+        ledger.load_dataset(data)
+    else:
+        ledger.load(accounts_path(client_id)
+                    for client_id in range(client_count))
+    log.info("imported %d accounts", len(ledger.ids))
+
+    log.info("processing transactions...")
+    for client_id in range(client_count):
+        if data is not None:
+            ledger.replay_dataset(data.trx(client_id))
+        else:
+            ledger.replay(trx_path(client_id))
+    return ledger
+
+#
+# Bucketed verification. Account ids are hashed into buckets; a bucket
+# keeps the number of rows, the wrapping sum of hash(id, balance) and the
+# sum of balances. Saved files are scanned block by block with vectorized
+# parsing, so the pass needs O(buckets) memory besides the expected state.
+# Clients may save overlapping dumps, so a saved bucket matches if it is
+# the expected bucket taken k >= 1 times. Accounts are compared one by one
+# only in the buckets that do not match.
+#
+
+def mix64(x):
+    """splitmix64 finalizer of a uint64 array, wraps around"""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+FNV_PRIME = np.uint64(0x100000001b3)
+
+def hash_matrix(chars, length):
+    """Hash rows of a zero-padded uint8 matrix, ignoring the padding"""
+    h = mix64(length.astype(np.uint64))
+    for k in range(chars.shape[1]):
+        h = np.where(k < length, (h ^ chars[:, k]) * FNV_PRIME, h)
+    return mix64(h)
+
+def hash_ids(ids, chunk=1000000):
+    result = np.empty(len(ids), dtype=np.uint64)
+    for begin in range(0, len(ids), chunk):
+        part = np.array([i.encode() for i in ids[begin:begin + chunk]])
+        if not len(part):
+            continue
+        chars = part.view(np.uint8).reshape(len(part), part.itemsize)
+        result[begin:begin + len(part)] = hash_matrix(chars,
+            np.char.str_len(part))
+    return result
+
+def gather(buf, begin, end):
+    """Fields [begin, end) of buf as a zero-padded uint8 matrix"""
+    length = end - begin
+    width = max(int(length.max()), 1)
+    pos = begin[:, None] + np.arange(width)
+    chars = buf[np.minimum(pos, len(buf) - 1)]
+    chars[pos >= end[:, None]] = 0
+    return chars, length
+
+def parse_money(chars, length, path):
+    """Vectorized tomoney() of a gather() matrix"""
+    digit = (chars >= ord('0')) & (chars <= ord('9'))
+    dot = chars == ord('.')
+    minus = chars == ord('-')
+    valid = digit | dot | (chars == 0)
+    valid[:, 0] |= minus[:, 0]
+    bad = (~valid.all(axis=1) | (dot.sum(axis=1) > 1) |
+           (length - np.where(dot.any(axis=1), dot.argmax(axis=1) + 1,
+                              length) > 2) | (length == 0))
+    if bad.any():
+        raise ValueError('tomoney: invalid balance in {}'.format(path))
+    value = np.zeros(len(chars), dtype=np.int64)
+    for k in range(chars.shape[1]):
+        value = np.where(digit[:, k], value * 10 + (chars[:, k] - ord('0')),
+                         value)
+    decimals = np.where(dot.any(axis=1), length - dot.argmax(axis=1) - 1, 0)
+    value *= 10 ** (2 - decimals)
+    return np.where(minus[:, 0], -value, value)
+
+def scan_results(path):
+    """
+    Yield (buf, id_begin, id_end, id_hash, balance) for blocks of
+    complete lines of a saved accounts file
+    """
+    with open(path, 'rb') as f:
+        tail = b''
+        while True:
+            data = f.read(SCAN_BLOCK)
+            block = tail + data
+            if not data:
+                if not block:
+                    break
+                if not block.endswith(b'\n'):
+                    block += b'\n'
+                tail = b''
+            else:
+                cut = block.rfind(b'\n') + 1
+                block, tail = block[:cut], block[cut:]
+                if not block:
+                    continue
+            buf = np.frombuffer(block, dtype=np.uint8)
+            ends = np.flatnonzero(buf == ord('\n'))
+            begins = np.concatenate(([0], ends[:-1] + 1))
+            rows = ends > begins
+            begins, ends = begins[rows], ends[rows]
+            tabs = np.flatnonzero(buf == ord('\t'))
+            first = np.searchsorted(tabs, begins)
+            last = np.searchsorted(tabs, ends) - 1
+            if (last <= first).any():
+                raise ValueError('invalid line in {}'.format(path))
+            id_end = tabs[first]
+            chars, length = gather(buf, begins, id_end)
+            id_hash = hash_matrix(chars, length)
+            chars, length = gather(buf, tabs[last] + 1, ends)
+            yield (buf, begins, id_end, id_hash,
+                   parse_money(chars, length, path))
+            if not data:
+                break
+
+class Buckets(object):
+    def __init__(self, count):
+        self.count = count
+        self.rows = np.zeros(count, dtype=np.int64)
+        self.digest = np.zeros(count, dtype=np.uint64)
+        self.money = np.zeros(count, dtype=np.int64)
+
+    def bucket(self, id_hash):
+        return (id_hash % np.uint64(self.count)).astype(np.intp)
+
+    def add(self, id_hash, balance):
+        bucket = self.bucket(id_hash)
+        self.rows += np.bincount(bucket, minlength=self.count)
+        np.add.at(self.digest, bucket,
+                  mix64(id_hash ^ mix64(balance.view(np.uint64))))
+        np.add.at(self.money, bucket, balance)
+
+    def copies(self, expected):
+        """Per bucket k if this is expected taken k >= 1 times, else 0"""
+        k = self.rows // np.maximum(expected.rows, 1)
+        match = ((expected.rows > 0) & (k >= 1) &
+                 (self.rows == k * expected.rows) &
+                 (self.digest == k.astype(np.uint64) * expected.digest) &
+                 (self.money == k * expected.money))
+        match |= (expected.rows == 0) & (self.rows == 0)
+        return np.where(match, np.maximum(k, 1), 0)
+
+def verify_buckets(ledger, count):
+    log.info("checking accounts in %d buckets...", count)
+    expected = Buckets(count)
+    expected.add(ledger.get_id_hash(), ledger.balance)
+    saved = Buckets(count)
+    for path in saved_paths:
+        log.info('scanning %s', path)
+        for (buf, begin, end, id_hash, balance) in scan_results(path):
+            saved.add(id_hash, balance)
+
+    copies = saved.copies(expected)
+    bad = np.flatnonzero(copies == 0)
+    # Money conservation: the saved total, with every dump counted once,
+    # must be the expected total. A differing bucket is taken as many
+    # times as its rows suggest.
+    good = copies > 0
+    total = int(expected.money.sum())
+    saved_total = int((saved.money[good] // copies[good]).sum())
+    conserved = True
+    for b in bad:
+        k = max(int(round(float(saved.rows[b]) /
+                          max(int(expected.rows[b]), 1))), 1)
+        conserved = conserved and int(saved.money[b]) % k == 0
+        saved_total += int(saved.money[b]) // k
+    conserved = conserved and saved_total == total
+    ok = True
+    if not conserved:
+        log.error("total money is not conserved: expected=%s got=%s",
+                  total, saved_total)
+        ok = False
+    if not len(bad):
+        if ok:
+            log.info("total money %s, %d accounts saved %s time(s)",
+                     total, len(ledger.ids),
+                     ','.join(str(k) for k in np.unique(copies)))
+        return ok
+    log.info("%d of %d buckets differ", len(bad), count)
+
+    # Compare rows of the differing buckets only
+    index = ledger.get_index()
+    selected = np.zeros(count, dtype=bool)
+    selected[bad] = True
+    seen = np.zeros(len(ledger.ids), dtype=bool)
+    for path in saved_paths:
+        log.info('checking %s', path)
+        for (buf, begin, end, id_hash, balance) in scan_results(path):
+            for j in np.flatnonzero(selected[saved.bucket(id_hash)]):
+                account_id = buf[begin[j]:end[j]].tobytes().decode()
+                i = index.get(account_id)
+                if i is None:
+                    log.error("invalid account_id=%s in file=%s",
+                              account_id, path)
+                    ok = False
+                    continue
+                seen[i] = True
+                if ledger.balance[i] != balance[j]:
+                    log.error("invalid balance for account_id=%s in "
+                              "file=%s:expected=%s got=%s", account_id,
+                              path, ledger.balance[i], balance[j])
+                    ok = False
+    missing = selected[expected.bucket(ledger.get_id_hash())] & ~seen
+    if missing.any():
+        log.error("%d accounts of differing buckets are not saved, "
+                  "e.g. account_id=%s", missing.sum(),
+                  ledger.ids[np.flatnonzero(missing)[0]])
+        ok = False
+    return ok
+
+def check_numpy(data=None, cache=None):
+    ledger = None
+    if cache is not None:
+        key = cache.key(input_paths(data))
+        ledger = cache.get(key)
+        if ledger is not None:
+            log.info("expected balances of %d accounts from %s",
+                     len(ledger.ids), cache.entry_path(key))
+    if ledger is None:
+        ledger = expected_balances(data)
+        if cache is not None:
+            cache.put(key, ledger)
+
+    if args.verify == 'buckets':
+        return verify_buckets(ledger, args.buckets)
+    ok = True
+    log.info("checking accounts...")
+    for path in saved_paths:
+        if not ledger.check(path):
+            ok = False
+    return ok
+
+#
+# Parallel engine: client files are parsed by a process pool into partial
+# per-file states which are hash-partitioned by account id, then every
+# partition is merged and compared by a separate worker.
+#
+
+def partition_of(account_id, partitions):
+    return zlib.crc32(account_id.encode()) % partitions
+
+def parse_accounts(path, partitions):
+    parts = [{} for _ in range(partitions)]
+    dups = []
     with open(path, 'r') as csvfile:
         reader = csv.reader(csvfile, delimiter = '\t')
         for (account_id, info, balance_str) in reader:
-            balance = tomoney(balance_str)
-            cur.execute("INSERT INTO account (account_id, balance) "+
-                        " VALUES(?, ?)", (account_id, balance))
-    conn.commit()
+            part = parts[partition_of(account_id, partitions)]
+            if account_id in part:
+                dups.append(account_id)
+                continue
+            part[account_id] = tomoney(balance_str)
+    return path, parts, dups
 
-log.info("processing transactions...")
-for client_id in range(client_count):
-    path = os.path.join(CLIENT_DIR, "trx",
-        "trx{:03d}.txt".format(client_id))
-    log.info('processing %s', path)
+def parse_trx(path, partitions):
+    delta = {}
     with open(path, 'r') as csvfile:
         reader = csv.reader(csvfile, delimiter = '\t')
         for (date, trx_id, src, dst, amount_str) in reader:
             amount = tomoney(amount_str)
-            cur.execute("""
-                UPDATE account SET balance = balance - ?
-                WHERE account_id = ?
-            """, (amount, src))
-            cur.execute("""
-                UPDATE account SET balance = balance + ?
-                WHERE account_id = ?
-            """, (amount, dst))
-            conn.commit()
-
-ok = True
-log.info("checking accounts...")
-for client_id in range(client_count):
-    path = os.path.join(CLIENT_DIR, "results",
-        "accounts{:03d}.tsv".format(client_id))
-    log.info('checking %s', path)
+            delta[src] = delta.get(src, 0) - amount
+            delta[dst] = delta.get(dst, 0) + amount
+    parts = [{} for _ in range(partitions)]
+    for account_id, value in delta.items():
+        parts[partition_of(account_id, partitions)][account_id] = value
+    return path, parts, []
+
+def parse_results(path, partitions):
+    parts = [[] for _ in range(partitions)]
     with open(path, 'r') as csvfile:
         reader = csv.reader(csvfile, delimiter = '\t')
         for (account_id, info, balance_str) in reader:
-            balance = tomoney(balance_str)
-            cur.execute("SELECT balance FROM account WHERE account_id = ?",
-                        (account_id,))
-            row = cur.fetchone()
-            if row is None:
-                log.error("invalid account_id=%s in file=%s", account_id, path)
-                ok = False
+            parts[partition_of(account_id, partitions)].append(
+                (account_id, tomoney(balance_str), path))
+    return path, parts, []
+
+def parse_task(task):
+    (parse, path, partitions) = task
+    return parse(path, partitions)
+
+def compare_partition(task):
+    (part, accounts, deltas, results) = task
+    balance = {}
+    dups = []
+    # In file order, the first balance of a duplicate account is kept like
+    # the other engines do
+    for (path, chunk) in sorted(accounts, key=lambda item: item[0]):
+        for account_id, value in chunk.items():
+            if account_id in balance:
+                dups.append((account_id, path))
                 continue
-            real_balance = row[0]
-            if real_balance != balance:
-                log.error("invalid balance for account_id=%s in file=%s:"+
-                          "expected=%s got=%s", account_id, path, real_balance,
-                          balance)
+            balance[account_id] = value
+    # Unknown accounts are skipped just like UPDATE ... WHERE does
+    for (path, chunk) in deltas:
+        for account_id, value in chunk.items():
+            if account_id in balance:
+                balance[account_id] += value
+    errors = []
+    count = 0
+    for (path, chunk) in results:
+        for (account_id, got, path) in chunk:
+            count += 1
+            expected = balance.get(account_id)
+            if expected is None:
+                errors.append("invalid account_id={} in file={}".format(
+                    account_id, path))
+            elif expected != got:
+                errors.append("invalid balance for account_id={} in "
+                    "file={}:expected={} got={}".format(account_id, path,
+                    expected, got))
+    return part, count, errors, dups
+
+def run_stage(pool, name, parse, paths, partitions):
+    log.info("%s %d files...", name, len(paths))
+    stage_time = time.time()
+    parts = [[] for _ in range(partitions)]
+    tasks = [(parse, path, partitions) for path in paths]
+    done = 0
+    for (path, chunks, dups) in pool.imap_unordered(parse_task, tasks):
+        done += 1
+        for account_id in dups:
+            log.error("duplicate account_id=%s in file=%s", account_id, path)
+        for part, chunk in enumerate(chunks):
+            parts[part].append((path, chunk))
+        log.info('%s %s [%d/%d]', name, path, done, len(paths))
+    log.info("%s done in %.1f s", name, time.time() - stage_time)
+    return parts
+
+def check_parallel(jobs, partitions):
+    with multiprocessing.Pool(jobs) as pool:
+        accounts = run_stage(pool, "importing", parse_accounts,
+            [accounts_path(i) for i in range(client_count)], partitions)
+        deltas = run_stage(pool, "processing", parse_trx,
+            [trx_path(i) for i in range(client_count)], partitions)
+        results = run_stage(pool, "loading", parse_results,
+            saved_paths, partitions)
+
+        log.info("checking %d partitions...", partitions)
+        stage_time = time.time()
+        tasks = [(part, accounts[part], deltas[part], results[part])
+            for part in range(partitions)]
+        # Drop references so that partitions are freed once sent
+        accounts = deltas = results = None
+        ok = True
+        done = 0
+        for (part, count, errors, dups) in pool.imap_unordered(
+                compare_partition, tasks):
+            done += 1
+            for (account_id, path) in dups:
+                log.error("duplicate account_id=%s in file=%s", account_id,
+                          path)
+            for error in errors:
+                log.error(error)
                 ok = False
+            log.info("checked partition %d: %d accounts, %d errors [%d/%d]",
+                     part, count, len(errors), done, partitions)
+        log.info("checking done in %.1f s", time.time() - stage_time)
+    return ok
+
+def main(argv=None):
+    global args, client_count, accounts_dir, trx_dir, results_dir, \
+        saved_paths
+    args = parse_args(argv)
+    client_count = args.client_count
+    accounts_dir = os.path.abspath(args.accounts)
+    trx_dir = os.path.abspath(args.trx)
+    results_dir = os.path.abspath(args.results)
+    dataset_dir = args.dataset and os.path.abspath(args.dataset)
+    cache_dir = args.cache and os.path.abspath(args.cache)
+
+    os.chdir(results_dir)
+
+    log.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler()
+    log.addHandler(console_handler)
+    file_handler = logging.FileHandler('checker.log')
+    log.addHandler(file_handler)
+    log.info("started")
+
+    engine = args.engine or 'numpy'
+    if engine == 'numpy' and np is None:
+        log.info("numpy is not available, falling back to sqlite")
+        engine = 'sqlite'
+    if args.jobs > 1:
+        engine = 'parallel'
+    if dataset_dir:
+        if np is None:
+            log.error("--dataset requires numpy")
+            return 2
+        engine = 'dataset'
+    log.info("using %s engine", engine)
+
+    # Every distinct dump is checked once, see digest.py
+    saved_paths, same_dumps, missing_dumps = digest.saved_dumps(results_dir,
+                                                                client_count)
+    for client_id, path in sorted(same_dumps.items()):
+        log.info("client %d saved the same accounts as %s", client_id, path)
+    for client_id in missing_dumps:
+        log.error("no saved accounts of client %d", client_id)
+
+    start_time = time.time()
+    cache = None
+    if cache_dir and engine in ('numpy', 'dataset'):
+        cache = BalanceCache(cache_dir, args.cache_size * 1024 * 1024)
+    if engine == 'parallel':
+        ok = check_parallel(args.jobs, args.partitions or args.jobs)
+    elif engine == 'dataset':
+        ok = check_numpy(dataset.Dataset(dataset_dir), cache)
+    elif engine == 'numpy':
+        ok = check_numpy(cache=cache)
+    else:
+        ok = check_sqlite()
+    ok = ok and not missing_dumps
+    log.info("checked in %.1f s", time.time() - start_time)
+
+    if ok:
+        log.info("OK!")
+        return 0
+    log.error("invalid results")
+    return 2
 
-if ok:
-    log.info("OK!")
-    os.chdir("..")
-    shutil.rmtree(prefix)
-    sys.exit(0)
-log.error("invalid results")
-sys.exit(2)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,14 +7,23 @@ import psycopg2
 import logging
 import shutil
 import csv
-
-if len(sys.argv) < 5:
-    print('Usage: {} accounts_dir trx_dir results_dir client_count'.format(sys.argv[0]), file = sys.stderr)
-    sys.exit(-1)
-accounts_dir = sys.argv[1]
-trx_dir = sys.argv[2]
-results_dir = sys.argv[3]
-client_count = int(sys.argv[4])
+import argparse
+
+import digest
+
+parser = argparse.ArgumentParser(
+    description='Replay transactions in PostgreSQL and check saved accounts')
+parser.add_argument('accounts_dir')
+parser.add_argument('trx_dir')
+parser.add_argument('results_dir')
+parser.add_argument('client_count', type=int)
+parser.add_argument('--row-by-row', action='store_true',
+    help='replay with the plpgsql loop and check one account per query')
+args = parser.parse_args()
+accounts_dir = args.accounts_dir
+trx_dir = args.trx_dir
+results_dir = args.results_dir
+client_count = args.client_count
 
 ##
 
@@ -26,6 +35,14 @@ file_handler = logging.FileHandler(os.path.join(results_dir, 'checker.log'))
 log.addHandler(file_handler)
 log.info("started")
 
+# Every distinct dump is checked once, see digest.py
+saved_paths, same_dumps, missing_dumps = digest.saved_dumps(results_dir,
+                                                            client_count)
+for client_id, path in sorted(same_dumps.items()):
+    log.info("client %d saved the same accounts as %s", client_id, path)
+for client_id in missing_dumps:
+    log.error("no saved accounts of client %d", client_id)
+
 conn = psycopg2.connect('')
 cur = conn.cursor()
 
@@ -48,9 +65,6 @@ def create_schema():
             amount MONEY NOT NULL
             );
 
-        CREATE INDEX transaction_src_id_idx ON transaction (src_id);
-        CREATE INDEX transaction_dst_id_idx ON transaction (dst_id);
-
         CREATE OR REPLACE FUNCTION process() RETURNS void AS $$
             DECLARE
                 row RECORD;
@@ -78,7 +92,7 @@ def import_accounts():
                 columns = ('account_id', 'info', 'balance'))
     conn.commit()
 
-def process_transactions():
+def import_transactions():
     log.info("importing transactions...")
     for client_id in range(client_count):
         path = os.path.join(trx_dir, "trx{:03d}.txt".format(client_id))
@@ -88,47 +102,69 @@ def process_transactions():
                 columns = ('ts', 'transaction_id', 'src_id', 'dst_id', 'amount'))
     conn.commit()
 
+def process_transactions():
     log.info("processing transactions...")
+    cur.execute("""
+        CREATE INDEX transaction_src_id_idx ON transaction (src_id);
+        CREATE INDEX transaction_dst_id_idx ON transaction (dst_id);
+    """)
     cur.callproc("process");
     conn.commit();
 
-#log.info("importing results...")
-#for client_id in range(client_count):
-#    path = os.path.join(results_dir, "accounts{:03d}.tsv".format(client_id))
-#    log.info('importing %s', path)
-#    with open(path, 'r') as csvfile:
-#        cur.copy_from(csvfile, 'account_result', sep='\t',
-#            columns = ('account_id', 'info', 'balance'))
-#    conn.commit()
-
-log.info("checking results...")
-#cur.execute("""
-#    SELECT o.account_id AS orig_id, o.balance AS orig_balance,
-#           n.account_id AS new_id, n.balance AS new_balance
-#    FROM account o
-#    FULL OUTER JOIN account_result n USING(account_id)
-#    WHERE o.balance != n.balance OR
-#          o.account_id IS NULL OR
-#          n.account_id IS NULL
-#""")
-#while True:
-#    row = cur.fetchone()
-#    if row == None:
-#        break;
-#    (orig_id, orig_balance, new_id, new_balance) = row
-#    if orig_id != new_id:
-#        log.info("invalid account: orig=%s new=%s",
-#            orig_id, new_id)
-#    elif orig_balance != new_balance:
-#        log.error("invalid balance: account=%s, expected=%s, got=%s",
-#            orig_id, orig_balance, new_balance)
-#    else:
-#        raise Exception('Invalid row: '+ str(row))
+def process_transactions_bulk():
+    log.info("processing transactions...")
+    cur.execute("""
+        UPDATE account a SET balance = a.balance + d.delta
+        FROM (
+            SELECT account_id, SUM(delta) AS delta FROM (
+                SELECT src_id AS account_id, amount * -1 AS delta
+                FROM transaction
+                UNION ALL
+                SELECT dst_id AS account_id, amount AS delta
+                FROM transaction
+            ) legs
+            GROUP BY account_id
+        ) d
+        WHERE a.account_id = d.account_id
+    """)
+    log.info("updated %d accounts", cur.rowcount)
+    conn.commit()
+
+def import_results():
+    log.info("importing results...")
+    for path in saved_paths:
+        log.info('importing %s', path)
+        with open(path, 'r') as csvfile:
+            cur.copy_from(csvfile, 'account_result', sep='\t',
+                columns = ('account_id', 'info', 'balance'))
+    conn.commit()
+
+def check_bulk():
+    log.info("checking results...")
+    cur.execute("""
+        SELECT o.account_id AS orig_id, o.balance AS orig_balance,
+               n.account_id AS new_id, n.balance AS new_balance
+        FROM account o
+        FULL OUTER JOIN account_result n USING(account_id)
+        WHERE o.balance != n.balance OR
+              o.account_id IS NULL OR
+              n.account_id IS NULL
+    """)
+    ok = True
+    for (orig_id, orig_balance, new_id, new_balance) in cur:
+        ok = False
+        if orig_id is None:
+            log.error("invalid account_id=%s in results", new_id)
+        elif new_id is None:
+            log.error("missing account_id=%s in results", orig_id)
+        else:
+            log.error("invalid balance for account_id=%s: "+
+                      "expected=%s got=%s", orig_id, orig_balance, new_balance)
+    return ok
 
 def check():
     ok = True
-    for client_id in range(client_count):
-        path = os.path.join(results_dir, "accounts{:03d}.tsv".format(client_id))
+    for path in saved_paths:
         log.info('checking %s', path)
         with open(path, 'r') as csvfile:
             reader = csv.reader(csvfile, delimiter = '\t')
@@ -156,10 +192,19 @@ def check():
     print('return', ok)
     return ok
 
+start_time = time.time()
 create_schema();
 import_accounts();
-process_transactions();
-ok = check()
+import_transactions();
+if args.row_by_row:
+    process_transactions();
+    ok = check()
+else:
+    process_transactions_bulk()
+    import_results()
+    ok = check_bulk()
+ok = ok and not missing_dumps
+log.info("checked in %.1f s", time.time() - start_time)
 if ok:
     log.info("OK!")
     sys.exit(0)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+#
+# Columnar binary copy of accounts-N/ and trx-N/.
+#
+#   ./dataset.py convert --accounts accounts-24 --trx trx-24 --out data-24
+#   ./dataset.py tsv data-24 --accounts accounts-24 --trx trx-24
+#   ./dataset.py info data-24
+#
+# data-N/ holds ids.col, the account ids interned over the whole dataset,
+# and accountsNNN.col/trxNNN.col with one column per field:
+#
+#   accounts: id (int32 code), info (string), balance (int64 kopecks)
+#   trx:      date (int64 epoch seconds), trx_id (string), src, dst
+#             (int32 codes), amount (int64 kopecks), batch (int32 sizes
+#             from .batch, if any)
+#
+# Transactions may refer to accounts that are not in accounts-N; such ids
+# are kept in the `extra` string column of the file and coded as
+# -1 - <position in extra>.
+#
+# A .col file is a 16 byte prefix (magic, header length), a JSON header
+# describing the columns and the columns themselves, 64 byte aligned.
+# Strings are stored as <name>.offsets (int64, rows + 1) and <name>.data
+# (uint8). Readers map the file and return numpy views into it, nothing
+# is parsed or copied on load.
+#
+
+import os
+import re
+import sys
+import json
+import mmap
+import glob
+import struct
+import argparse
+import multiprocessing
+
+import numpy as np
+
+MAGIC = b'TXCOL001'
+ALIGN = 64
+WRITE_BUFFER = 16 * 1024 * 1024
+# Rows formatted at once when writing TSV
+CHUNK_SIZE = 100000
+
+def tomoney(s):
+    if s.startswith('-'):
+        return -tomoney(s[1:])
+    parts = s.split('.')
+    if len(parts) == 1:
+        return int(parts[0]) * 100
+    elif len(parts) == 2 and len(parts[1]) <= 2:
+        return int(parts[0] or 0) * 100 + int(parts[1].ljust(2, '0'))
+    raise ValueError('tomoney: ' + s)
+
+CENTS = np.array(['{:02d}'.format(i) for i in range(100)])
+
+def frommoney(kopecks):
+    """Format an int64 array of kopecks as 'roubles.kk' strings"""
+    sign = np.where(kopecks < 0, '-', '')
+    kopecks = np.abs(kopecks)
+    return [s + str(r) + '.' + c for s, r, c in zip(sign.tolist(),
+            (kopecks // 100).tolist(), CENTS[kopecks % 100].tolist())]
+
+#
+# .col files
+#
+
+def encode_strings(values):
+    """Return (offsets, data) arrays of a list of str"""
+    data = [v.encode() for v in values]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in data], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(data), dtype=np.uint8)
+
+def write_table(path, rows, columns, strings={}):
+    """
+    Write numpy arrays from `columns` and lists of str from `strings`
+    (both dicts by column name) into a .col file of `rows` rows
+    """
+    arrays = list(columns.items())
+    for name, values in strings.items():
+        offsets, data = encode_strings(values)
+        arrays += [(name + '.offsets', offsets), (name + '.data', data)]
+    header = {'rows': rows, 'columns': {}}
+    offset = 0
+    for name, array in arrays:
+        array = np.ascontiguousarray(array)
+        header['columns'][name] = {'dtype': array.dtype.str,
+                                   'offset': offset, 'length': len(array)}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    data = json.dumps(header, sort_keys=True).encode()
+    start = -(-(16 + len(data)) // ALIGN) * ALIGN
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb', buffering=WRITE_BUFFER) as f:
+        f.write(MAGIC + struct.pack('<Q', len(data)) + data)
+        f.write(b'\0' * (start - f.tell()))
+        for name, array in arrays:
+            array = np.ascontiguousarray(array)
+            f.write(array.tobytes())
+            f.write(b'\0' * (-array.nbytes % ALIGN))
+    os.rename(tmp_path, path)
+
+class Table(object):
+    """Read-only mapping of a .col file"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            prefix = f.read(16)
+            if prefix[:8] != MAGIC:
+                raise ValueError('{}: not a .col file'.format(path))
+            size = struct.unpack('<Q', prefix[8:])[0]
+            header = json.loads(f.read(size).decode())
+            self.rows = header['rows']
+            self.columns = header['columns']
+            self.start = -(-(16 + size) // ALIGN) * ALIGN
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, name):
+        return name in self.columns or name + '.offsets' in self.columns
+
+    def column(self, name):
+        meta = self.columns[name]
+        return np.frombuffer(self.map, dtype=np.dtype(meta['dtype']),
+                             count=meta['length'],
+                             offset=self.start + meta['offset'])
+
+    def strings(self, name):
+        """Return (offsets, data) of a string column"""
+        return self.column(name + '.offsets'), self.column(name + '.data')
+
+    def string_list(self, name, begin=0, end=None):
+        offsets, data = self.strings(name)
+        if end is None:
+            end = len(offsets) - 1
+        raw = data[offsets[begin]:offsets[end]].tobytes()
+        base = offsets[begin]
+        bounds = (offsets[begin:end + 1] - base).tolist()
+        return [raw[bounds[i]:bounds[i + 1]].decode()
+                for i in range(end - begin)]
+
+    def __len__(self):
+        return self.rows
+
+#
+# Dataset directory
+#
+
+class Dataset(object):
+    def __init__(self, path):
+        self.path = path
+        self._ids = None
+
+    def table(self, name):
+        return Table(os.path.join(self.path, name + '.col'))
+
+    def accounts(self, client_id):
+        return self.table('accounts{:03d}'.format(client_id))
+
+    def trx(self, client_id):
+        return self.table('trx{:03d}'.format(client_id))
+
+    def client_count(self):
+        return len(glob.glob(os.path.join(self.path, 'accounts*.col')))
+
+    def ids(self):
+        """Account ids as a list of str, ids()[code] is the id"""
+        if self._ids is None:
+            self._ids = self.table('ids').string_list('id')
+        return self._ids
+
+    def index(self):
+        return dict((account_id, code)
+                    for code, account_id in enumerate(self.ids()))
+
+#
+# TSV -> .col
+#
+
+def client_files(directory, pattern):
+    """Return {client_id: path} of files named like pattern (with NNN)"""
+    regex = re.compile('^' + pattern.replace('NNN', r'(\d+)') + '$')
+    result = {}
+    for name in os.listdir(directory):
+        m = regex.match(name)
+        if m:
+            result[int(m.group(1))] = os.path.join(directory, name)
+    return result
+
+def read_lines(path):
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                yield line.split('\t')
+
+# Dictionary of account ids, inherited by forked converter processes
+INDEX = {}
+
+def convert_accounts(task):
+    (path, out_path) = task
+    codes, info, balance = [], [], []
+    for (account_id, account_info, balance_str) in read_lines(path):
+        codes.append(INDEX[account_id])
+        info.append(account_info)
+        balance.append(tomoney(balance_str))
+    write_table(out_path, len(codes),
+                {'id': np.array(codes, dtype=np.int32),
+                 'balance': np.array(balance, dtype=np.int64)},
+                {'info': info})
+    return out_path, len(codes)
+
+def convert_trx(task):
+    (path, out_path) = task
+    dates, trx_ids, src, dst, amount = [], [], [], [], []
+    extra = {}
+
+    def code(account_id):
+        c = INDEX.get(account_id)
+        if c is None:
+            c = extra.setdefault(account_id, -1 - len(extra))
+        return c
+
+    for (date, trx_id, src_id, dst_id, amount_str) in read_lines(path):
+        dates.append(date)
+        trx_ids.append(trx_id)
+        src.append(code(src_id))
+        dst.append(code(dst_id))
+        amount.append(tomoney(amount_str))
+    columns = {
+        'date': np.array(dates, dtype='datetime64[s]').astype(np.int64),
+        'src': np.array(src, dtype=np.int32),
+        'dst': np.array(dst, dtype=np.int32),
+        'amount': np.array(amount, dtype=np.int64),
+    }
+    if os.path.exists(path + '.batch'):
+        with open(path + '.batch') as f:
+            columns['batch'] = np.array([int(l) for l in f if l.strip()],
+                                        dtype=np.int32)
+    write_table(out_path, len(amount), columns, {'trx_id': trx_ids,
+                                    'extra': sorted(extra, key=extra.get,
+                                                    reverse=True)})
+    return out_path, len(amount)
+
+def convert(opts):
+    accounts = client_files(opts.accounts, 'accountsNNN')
+    trx = client_files(opts.trx, r'trxNNN\.txt') if opts.trx else {}
+    os.makedirs(opts.out, exist_ok=True)
+    ids = []
+    for client_id, path in sorted(accounts.items()):
+        for fields in read_lines(path):
+            if fields[0] not in INDEX:
+                INDEX[fields[0]] = len(ids)
+                ids.append(fields[0])
+    if len(ids) >= 2 ** 31:
+        sys.exit('too many accounts for int32 codes')
+    write_table(os.path.join(opts.out, 'ids.col'), len(ids), {}, {'id': ids})
+    print('{}: {} accounts'.format(os.path.join(opts.out, 'ids.col'),
+                                   len(ids)))
+    tasks = [(convert_accounts, (path, os.path.join(opts.out,
+              'accounts{:03d}.col'.format(i))))
+             for i, path in sorted(accounts.items())]
+    tasks += [(convert_trx, (path, os.path.join(opts.out,
+               'trx{:03d}.col'.format(i))))
+              for i, path in sorted(trx.items())]
+    with multiprocessing.get_context('fork').Pool(opts.jobs) as pool:
+        for (path, rows) in pool.imap_unordered(run_task, tasks):
+            print('{}: {} rows'.format(path, rows))
+
+def run_task(task):
+    (func, args) = task
+    return func(args)
+
+#
+# .col -> TSV
+#
+
+def decode_codes(codes, ids, extra):
+    return [ids[c] if c >= 0 else extra[-1 - c] for c in codes.tolist()]
+
+def write_accounts_tsv(dataset, client_id, path):
+    table = dataset.accounts(client_id)
+    ids = dataset.ids()
+    with open(path, 'w', buffering=WRITE_BUFFER) as f:
+        for begin in range(0, len(table), CHUNK_SIZE):
+            end = min(begin + CHUNK_SIZE, len(table))
+            f.write(''.join(map('{}\t{}\t{}\n'.format,
+                decode_codes(table.column('id')[begin:end], ids, ()),
+                table.string_list('info', begin, end),
+                frommoney(table.column('balance')[begin:end]))))
+
+def write_trx_tsv(dataset, client_id, path):
+    table = dataset.trx(client_id)
+    ids = dataset.ids()
+    extra = table.string_list('extra')
+    with open(path, 'w', buffering=WRITE_BUFFER) as f:
+        for begin in range(0, len(table), CHUNK_SIZE):
+            end = min(begin + CHUNK_SIZE, len(table))
+            dates = np.datetime_as_string(
+                table.column('date')[begin:end].astype('datetime64[s]'),
+                unit='s')
+            f.write(''.join(map('{}\t{}\t{}\t{}\t{}\n'.format,
+                dates.tolist(), table.string_list('trx_id', begin, end),
+                decode_codes(table.column('src')[begin:end], ids, extra),
+                decode_codes(table.column('dst')[begin:end], ids, extra),
+                frommoney(table.column('amount')[begin:end]))))
+    if 'batch' in table:
+        with open(path + '.batch', 'w') as f:
+            f.write(''.join('{}\n'.format(n)
+                            for n in table.column('batch').tolist()))
+
+def to_tsv(opts):
+    dataset = Dataset(opts.dataset)
+    if opts.accounts:
+        os.makedirs(opts.accounts, exist_ok=True)
+        for i in range(dataset.client_count()):
+            path = os.path.join(opts.accounts, 'accounts{:03d}'.format(i))
+            write_accounts_tsv(dataset, i, path)
+            print(path)
+    if opts.trx:
+        os.makedirs(opts.trx, exist_ok=True)
+        for i in range(len(glob.glob(os.path.join(opts.dataset,
+                                                  'trx*.col')))):
+            path = os.path.join(opts.trx, 'trx{:03d}.txt'.format(i))
+            write_trx_tsv(dataset, i, path)
+            print(path)
+
+def info(opts):
+    for path in sorted(glob.glob(os.path.join(opts.dataset, '*.col'))):
+        table = Table(path)
+        print('{}: {} rows, {}'.format(path, len(table), ' '.join(
+            '{}={}[{}]'.format(name, meta['dtype'], meta['length'])
+            for name, meta in sorted(table.columns.items()))))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Columnar binary copy of accounts and transactions')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('convert', help='TSV to .col files')
+    p.add_argument('--accounts', required=True,
+        help='directory with accountsNNN files')
+    p.add_argument('--trx', help='directory with trxNNN.txt files')
+    p.add_argument('--out', required=True, help='output directory')
+    p.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='number of converter processes')
+    p = sub.add_parser('tsv', help='regenerate TSV files from .col files')
+    p.add_argument('dataset')
+    p.add_argument('--accounts', help='directory for accountsNNN files')
+    p.add_argument('--trx', help='directory for trxNNN.txt files')
+    p = sub.add_parser('info', help='list .col files and columns')
+    p.add_argument('dataset')
+    opts = parser.parse_args()
+    {'convert': convert, 'tsv': to_tsv, 'info': info}[opts.command](opts)
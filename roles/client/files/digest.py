@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Order-independent digest of a saved accounts dump:
+#
+#   digest.py accounts_out.tsv > accounts_out.digest
+#
+# The digest is the number of lines and the sum modulo 2^128 of the
+# md5 hashes of the lines, so dumps of the same accounts in any order
+# have the same digest. bench.sh computes it after `save`, and save.yml
+# fetches a full dump only from the first client and from the clients
+# whose digest differs from the first one. check.py and checkpg.py then
+# check every distinct dump once.
+# It runs in the client containers, so it sticks to what the python3 3.4
+# of ubuntu 14.04 has.
+#
+
+import os
+import sys
+import hashlib
+import argparse
+
+DIGEST_SIZE = 16
+MODULUS = 1 << (8 * DIGEST_SIZE)
+READ_BUFFER = 4 * 1024 * 1024
+
+def digest_file(path):
+    """Return the digest of a dump as 'rows\\tsum' with sum in hex"""
+    rows = 0
+    total = 0
+    with open(path, 'rb', buffering=READ_BUFFER) as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if not line:
+                continue
+            rows += 1
+            total += int.from_bytes(hashlib.md5(line).digest(), 'little')
+    return '{}\t{:032x}'.format(rows, total % MODULUS)
+
+def dump_path(results_dir, client_id):
+    return os.path.join(results_dir, 'accounts{:03d}.tsv'.format(client_id))
+
+def digest_path(results_dir, client_id):
+    return os.path.join(results_dir, 'accounts{:03d}.digest'.format(client_id))
+
+def read_digest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+def saved_dumps(results_dir, client_count):
+    """
+    Return (paths, same, missing): fetched dumps to check, {client_id: path}
+    of clients that were not fetched because their digest equals the digest
+    of a fetched dump, and ids of clients with neither a dump nor a
+    matching digest.
+    """
+    paths = []
+    fetched = {}
+    skipped = []
+    missing = []
+    for client_id in range(client_count):
+        path = dump_path(results_dir, client_id)
+        digest = read_digest(digest_path(results_dir, client_id))
+        if os.path.exists(path):
+            paths.append(path)
+            if digest is not None:
+                fetched.setdefault(digest, path)
+        elif digest is not None:
+            skipped.append((client_id, digest))
+        else:
+            missing.append(client_id)
+    same = {}
+    for (client_id, digest) in skipped:
+        if digest in fetched:
+            same[client_id] = fetched[digest]
+        else:
+            missing.append(client_id)
+    return paths, same, sorted(missing)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Order-independent digest of a saved accounts dump')
+    parser.add_argument('path')
+    opts = parser.parse_args(argv)
+    print(digest_file(opts.path))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import time
+import random
+import string
+import argparse
+import multiprocessing
+
+import numpy as np
+
+# Must match gen-transactions.py, otherwise transactions refer to
+# accounts which do not exist
+ACCOUNT_MIN=100
+ACCOUNT_MAX=50100
+
+# Every field of a row is a hash of the seed and the account id, so a file
+# generates its own rows only, starting at its first one, and the output
+# does not depend on how ids are split between files and processes.
+# Rows are generated BLOCK_SIZE at a time.
+BLOCK_SIZE = 100000
+WRITE_BUFFER = 16 * 1024 * 1024
+GOLDEN = np.uint64(0x9e3779b97f4a7c15)
+
+INFO_ALPHABET = string.ascii_lowercase
+INFO_MIN = 5
+INFO_MAX = 40
+
+'''
+- Account ID: string consisting of 3-50 symbols;
+- Extra data: string consisting of 0-40 symbols;
+- Balance: decimal number, decimal separator is dot ('.'), no group separator is used.
+'''
+
+def mix64(x):
+    """splitmix64 finalizer of a uint64 array"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+def uniform(h, n):
+    """Map uint64 hashes to [0, n), the bias is below n / 2^64"""
+    return (h % np.uint64(n)).astype(np.int64)
+
+def generate_rows(opts, first, size):
+    """Rows of accounts [first, first + size)"""
+    ids = np.arange(first, first + size, dtype=np.uint64)
+    # Hash lanes: 1..INFO_MAX info characters, then length and balance
+    lanes = np.arange(1, INFO_MAX + 3, dtype=np.uint64) * GOLDEN
+    with np.errstate(over='ignore'):
+        key = mix64(np.array([opts.seed], dtype=np.uint64))
+        base = mix64(ids ^ key)
+        chars = mix64(base[:, None] + lanes[None, :INFO_MAX])
+        length = INFO_MIN + uniform(mix64(base + lanes[INFO_MAX]),
+                                    INFO_MAX - INFO_MIN + 1)
+        kopecks = uniform(mix64(base + lanes[INFO_MAX + 1]),
+                          opts.balance_max * 100)
+    alphabet = np.frombuffer(INFO_ALPHABET.encode(), dtype=np.uint8)
+    info = alphabet[uniform(chars, len(alphabet))]
+    # Trailing zero bytes are stripped by the S dtype
+    info[np.arange(INFO_MAX) >= length[:, None]] = 0
+    info = info.view('S{}'.format(INFO_MAX)).ravel().astype(str)
+    cents = np.array(['{:02d}'.format(i) for i in range(100)])[kopecks % 100]
+    rows = map('{}\t{}\t{}.{}\n'.format, range(first, first + size),
+        info.tolist(), (kopecks // 100).tolist(), cents.tolist())
+    return list(rows)
+
+def generate_file(task):
+    (opts, path, begin, end) = task
+    with open(path, 'w', buffering=WRITE_BUFFER) as f:
+        for first in range(begin, end, BLOCK_SIZE):
+            f.write(''.join(generate_rows(opts, first,
+                                          min(BLOCK_SIZE, end - first))))
+    return path, end - begin
+
+def client_counts(path):
+    counts = set()
+    with open(path, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter='\t')
+        next(reader, None) # skip header
+        for row in reader:
+            counts.add(int(row[3]))
+    return sorted(counts)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate accounts-<clients>/accountsNNN partitions')
+    parser.add_argument('clients', type=int, nargs='*',
+        help='client counts to generate partitions for')
+    parser.add_argument('--benchmarks',
+        help='take client counts from benchmarks.csv')
+    parser.add_argument('--seed', type=int,
+        help='random seed (printed if not specified)')
+    parser.add_argument('--out', default='.',
+        help='directory for accounts-<clients> directories')
+    parser.add_argument('--account-min', type=int, default=ACCOUNT_MIN)
+    parser.add_argument('--account-max', type=int, default=ACCOUNT_MAX)
+    parser.add_argument('--balance-max', type=int, default=10000000,
+        help='maximal initial balance in roubles')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='number of writer processes')
+    opts = parser.parse_args()
+
+    layouts = set(opts.clients)
+    if opts.benchmarks:
+        layouts.update(client_counts(opts.benchmarks))
+    if not layouts:
+        parser.error('no client counts specified')
+    if opts.seed is None:
+        opts.seed = random.SystemRandom().randrange(2 ** 32)
+    print('seed={} accounts=[{}, {}) layouts={}'.format(opts.seed,
+        opts.account_min, opts.account_max, sorted(layouts)), file = sys.stderr)
+
+    # Every layout splits the same id space into contiguous ranges
+    total = opts.account_max - opts.account_min
+    tasks = []
+    for clients in sorted(layouts):
+        out_dir = os.path.join(opts.out, 'accounts-{}'.format(clients))
+        os.makedirs(out_dir, exist_ok=True)
+        for client_id in range(clients):
+            path = os.path.join(out_dir, 'accounts{:03d}'.format(client_id))
+            begin = opts.account_min + total * client_id // clients
+            end = opts.account_min + total * (client_id + 1) // clients
+            tasks.append((opts, path, begin, end))
+
+    start_time = time.time()
+    with multiprocessing.Pool(opts.jobs) as pool:
+        for (path, count) in pool.imap_unordered(generate_file, tasks):
+            print('{}: {} accounts'.format(path, count), file = sys.stderr)
+    print('generated {} files in {:.1f} s'.format(len(tasks),
+        time.time() - start_time), file = sys.stderr)
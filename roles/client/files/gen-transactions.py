@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 import time
 import random
 import string
+import argparse
+import multiprocessing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 ACCOUNT_MIN=100
 ACCOUNT_MAX=50100
 
+# Rows formatted and written at once in sharded mode
+CHUNK_SIZE = 100000
+WRITE_BUFFER = 16 * 1024 * 1024
+
+ID_ALPHABET = string.ascii_uppercase + string.digits
+ID_LENGTH = 16
+
 '''
 - Date in ISO 8601 format;
 - Document/transaction identifier: string consisting of upto 50 symbols;
@@ -16,19 +31,150 @@ ACCOUNT_MAX=50100
 - Amount: decimal number, decimal separator is dot ('.'), no group separator is used.
 '''
 
-if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        count = int(sys.argv[1])
-    else:
-        count = 100000
-
+def generate_stdout(opts):
+    random.seed(opts.seed)
     start_time = time.time()
-    for tr in range(count):
+    for tr in range(opts.count):
         date = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(start_time + tr))
-        tr_id = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(16)) 
-        src_account_id = random.randint(ACCOUNT_MIN, ACCOUNT_MAX - 1)
-        dst_account_id = random.randint(ACCOUNT_MIN, ACCOUNT_MAX - 1)
+        tr_id = ''.join(random.choice(ID_ALPHABET) for _ in range(ID_LENGTH))
+        src_account_id = random.randint(opts.account_min, opts.account_max - 1)
+        dst_account_id = random.randint(opts.account_min, opts.account_max - 1)
         amount = random.random() * 10000
         print('{0}\t{1}\t{2}\t{3}\t{4:0.2f}'.format(date, tr_id, src_account_id, dst_account_id, amount))
 
+#
+# Sharded mode: every client file is generated from its own child of the
+# root seed, so the output does not depend on the number of processes.
+#
+
+class AccountSampler(object):
+    """
+    Draws account ids from [account_min, account_max) with the given
+    distribution. Hot accounts are spread over the id space by a
+    permutation derived from the root seed.
+    """
+    def __init__(self, opts, rng):
+        self.base = opts.account_min
+        self.n = opts.account_max - opts.account_min
+        self.distribution = opts.distribution
+        self.perm = None
+        if self.distribution != 'uniform':
+            self.perm = rng.permutation(self.n)
+        if self.distribution == 'zipf':
+            weights = 1.0 / np.arange(1, self.n + 1) ** opts.zipf_s
+            self.cdf = np.cumsum(weights)
+            self.cdf /= self.cdf[-1]
+        elif self.distribution == 'hotset':
+            self.hot_count = max(1, int(self.n * opts.hot_fraction))
+            self.hot_probability = opts.hot_probability
+
+    def sample(self, rng, size):
+        if self.distribution == 'uniform':
+            return rng.integers(0, self.n, size) + self.base
+        if self.distribution == 'zipf':
+            rank = np.searchsorted(self.cdf, rng.random(size), side='right')
+            np.minimum(rank, self.n - 1, out=rank)
+        else:
+            rank = rng.integers(self.hot_count, self.n, size)
+            hot = rng.random(size) < self.hot_probability
+            rank[hot] = rng.integers(0, self.hot_count, int(hot.sum()))
+        return self.perm[rank] + self.base
+
+def format_chunk(rng, sampler, start, first, size):
+    dates = np.datetime_as_string(
+        np.datetime64(start, 's') + np.arange(first, first + size), unit='s')
+    alphabet = np.frombuffer(ID_ALPHABET.encode(), dtype=np.uint8)
+    ids = alphabet[rng.integers(0, len(alphabet), (size, ID_LENGTH))]
+    ids = ids.view('S{}'.format(ID_LENGTH)).ravel().astype(str)
+    src = sampler.sample(rng, size)
+    dst = sampler.sample(rng, size)
+    kopecks = rng.integers(0, 1000000, size)
+    cents = np.array(['{:02d}'.format(i) for i in range(100)])[kopecks % 100]
+    rows = map('{}\t{}\t{}\t{}\t{}.{}\n'.format, dates.tolist(), ids.tolist(),
+        src.tolist(), dst.tolist(), (kopecks // 100).tolist(), cents.tolist())
+    return ''.join(rows)
 
+def generate_client(task):
+    (opts, client_id, seed, first, count) = task
+    sampler = AccountSampler(opts, np.random.default_rng(opts.root_seed))
+    rng = np.random.default_rng(seed)
+    path = os.path.join(opts.out, 'trx{:03d}.txt'.format(client_id))
+    with open(path, 'w', buffering=WRITE_BUFFER) as f:
+        done = 0
+        while done < count:
+            size = min(CHUNK_SIZE, count - done)
+            f.write(format_chunk(rng, sampler, opts.start, first + done, size))
+            done += size
+    # Batch boundaries for the client, one batch size per line
+    with open(path + '.batch', 'w', buffering=WRITE_BUFFER) as f:
+        full, rest = divmod(count, opts.batch_size)
+        f.write('{}\n'.format(opts.batch_size) * full)
+        if rest:
+            f.write('{}\n'.format(rest))
+    return path, count
+
+def generate_sharded(opts):
+    if np is None:
+        print('numpy is required for --clients', file = sys.stderr)
+        sys.exit(-1)
+    if opts.seed is None:
+        opts.seed = random.SystemRandom().randrange(2 ** 32)
+    if opts.start is None:
+        opts.start = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+    if opts.out is None:
+        opts.out = 'trx-{}'.format(opts.clients)
+    print('seed={} start={} distribution={} out={}'.format(opts.seed,
+        opts.start, opts.distribution, opts.out), file = sys.stderr)
+    os.makedirs(opts.out, exist_ok=True)
+
+    seeds = np.random.SeedSequence(opts.seed).spawn(opts.clients + 1)
+    opts.root_seed = seeds[0]
+    per_client, rest = divmod(opts.count, opts.clients)
+    tasks = []
+    first = 0
+    for client_id in range(opts.clients):
+        count = per_client + (client_id < rest and 1 or 0)
+        tasks.append((opts, client_id, seeds[client_id + 1], first, count))
+        first += count
+
+    start_time = time.time()
+    with multiprocessing.Pool(opts.jobs) as pool:
+        for (path, count) in pool.imap_unordered(generate_client, tasks):
+            print('{}: {} transactions'.format(path, count), file = sys.stderr)
+    print('generated {} transactions in {:.1f} s'.format(opts.count,
+        time.time() - start_time), file = sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate transactions for the bank benchmark')
+    parser.add_argument('count', type=int, nargs='?', default=100000,
+        help='total number of transactions')
+    parser.add_argument('--seed', type=int,
+        help='random seed (printed if not specified)')
+    parser.add_argument('--clients', type=int,
+        help='write trxNNN.txt and trxNNN.txt.batch for N clients '
+             'instead of printing to stdout')
+    parser.add_argument('--out',
+        help='output directory for --clients (default: trx-<clients>)')
+    parser.add_argument('--start',
+        help='timestamp of the first transaction, YYYY-MM-DDTHH:MM:SS')
+    parser.add_argument('--distribution', default='uniform',
+        choices=('uniform', 'zipf', 'hotset'))
+    parser.add_argument('--zipf-s', type=float, default=1.1,
+        help='zipf exponent')
+    parser.add_argument('--hot-fraction', type=float, default=0.01,
+        help='fraction of hot accounts for hotset')
+    parser.add_argument('--hot-probability', type=float, default=0.9,
+        help='probability to pick a hot account for hotset')
+    parser.add_argument('--account-min', type=int, default=ACCOUNT_MIN)
+    parser.add_argument('--account-max', type=int, default=ACCOUNT_MAX)
+    parser.add_argument('--batch-size', type=int, default=100,
+        help='transactions per batch in .batch files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='number of generator processes')
+    opts = parser.parse_args()
+
+    if opts.clients:
+        generate_sharded(opts)
+    else:
+        generate_stdout(opts)
@@ -5,21 +5,50 @@ cd $(dirname $(readlink -f $0))
 #ping 10.50.10.254 -c 1
 #ping sh1.tarantool.org -c 1
 
+{% if client_driver == 'python' %}
+CMD="python3 ./bank-client.py -id {{ client_id }} -concurrency {{ client_concurrency }}"
+{% else %}
 CMD="java -jar ./imdgtest-client-1.0-SNAPSHOT.jar -id {{ client_id }}"
 #CMD="${CMD} -switch-server-on-http-error -socketTimeout 5000 -server-retries 2 -http-retries 10"
+{% endif %}
 {% for host in groups['tarantool_containers'] %}
 CMD="${CMD} -server {{ hostvars[host]['ansible_ssh_host'] }}:{{ hostvars[host]['http_port'] }}"
 {% endfor %}
 
+TRANS_OPTS="-batch {{ client_trx_batch }}"
+{% if client_driver == 'python' %}
+{% if batch %}
+TRANS_OPTS="${TRANS_OPTS} -batch-file transactions.tsv.batch"
+{% endif %}
+{% if client_rate %}
+TRANS_OPTS="${TRANS_OPTS} -rate {{ client_rate }}"
+{% endif %}
+{% endif %}
+
+# Phase boundaries in nanoseconds, fetched as client-N-timing.tsv.
+# CLOCK_REALTIME is used because it is the only clock comparable between
+# containers on different hosts (hosts run ntp).
+stamp() {
+	printf '%s\t%s\n' "$1" "$(date +%s%N)" >> timing.tsv
+}
+
 case "$1" in
 	load)
-		${CMD} load -batch 25000 accounts.tsv
+		: > timing.tsv
+		stamp load_start
+		${CMD} load -batch {{ client_load_batch }} accounts.tsv
+		stamp load_end
                 ;;
 	save)
+		stamp save_start
 		${CMD} save -out accounts_out.tsv
+		stamp save_end
+		python3 ./digest.py accounts_out.tsv > accounts_out.digest
 		;;
 	trans)
-		${CMD} exec-trans -batch 100 transactions.tsv
+		stamp exec_start
+		${CMD} exec-trans ${TRANS_OPTS} transactions.tsv
+		stamp exec_end
 		;;
 	*)
 		echo "Usage: $0 load|save|trans"
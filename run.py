@@ -9,64 +9,150 @@ import logging
 import yaml
 import time
 import csv
-import ansible
-import ansible.playbook
-import ansible.color
+try:
+    import ansible
+    import ansible.playbook
+    import ansible.color
+except ImportError:
+    # Only run.py --local works without Ansible
+    ansible = None
 import getpass
 import time
+import argparse
+import multiprocessing
+import shutil
+import json
+
+import analyze_logs
+import analyze_sar
+import bench_export
+import datasets
+import local_run
+import placement
+import results_db
+
+# config.yml settings passed to the client role as is
+CLIENT_OPTIONS = ('client_driver', 'client_load_batch', 'client_trx_batch',
+                  'client_concurrency', 'client_rate', 'fetch_all_results')
+# and to the container_host role
+HOST_OPTIONS = ('docker_workers',)
 
 #
 # Utils
 #
 
-def populate_hosts(inventory, benchmark, what):
-    count = benchmark[what + '_count']
-    hosts = cfg[what + '_hosts']
-    host_count = len(hosts)
-    if what == 'server':
-        host_count = min(host_count, benchmark['host_count'])
-    per_host = count / host_count
-    if count % host_count != 0: per_host += 1
-    for hostname in hosts:
-        host = inventory.get(hostname, None)
-        if host is None:
-            host = {}
-            inventory[hostname] = host
-        host[what + '_count'] = hostname != hosts[-1] and per_host or count
-        print 'host', what, host[what + '_count']
-        count -= per_host
-        if count <= 0:
-            break
-
-def create_inventory(benchmark):
-    inventory_hosts = {}
-    populate_hosts(inventory_hosts, benchmark, 'client')
-    populate_hosts(inventory_hosts, benchmark, 'server')
+def create_inventory(benchmark, pool, hosts, path):
+    """Write the hosts inventory for a placement.plan() result"""
     sb = []
     sb.append('localhost ansible_connection=local')
     sb.append('[hosts_all]')
-    for hostname in cfg['client_hosts']:
+    for hostname in pool['client']:
          sb.append(hostname)
-    for hostname in cfg['server_hosts']:
+    for hostname in pool['server']:
          sb.append(hostname)
     sb.append('')
- 
+
     sb.append('[hosts]')
     sb.append('')
-    for (hostname, opts) in inventory_hosts.items():
+    for (hostname, opts) in hosts.items():
         sb.append("{0} server_count={1} client_count={2} prefix=bench-{3}- "
             "redundancy={4} batch={5} hardware_failure={6} arena={7:.2f}".format(
-                hostname, opts.get('server_count', 0),
-                opts.get('client_count', 0), benchmark['benchmark_id'],
-                benchmark['redundancy'], benchmark['batch'] and '1' or '0',
-                benchmark['hardware_failure'] and '1' or '0',
-                float(cfg.get('arena', 100) * benchmark['host_count']) / benchmark['server_count']))
+                hostname, opts['server_count'], opts['client_count'],
+                benchmark['benchmark_id'], benchmark['redundancy'],
+                benchmark['batch'] and '1' or '0',
+                benchmark['hardware_failure'] and '1' or '0', opts['arena']))
     sb.append('')
     data = '\n'.join(sb)
     log.debug("inventory file (hosts):\n%s", data)
-    with open('hosts', 'w+') as inventory_file:
+    with open(path, 'w+') as inventory_file:
         inventory_file.write(data)
-    return ansible.inventory.Inventory('hosts')
+    return ansible.inventory.Inventory(path)
+
+def plan_placement(benchmark, pool, result_dir):
+    """
+    Place containers on the hosts of the pool, log the placement and save
+    it to placement.json
+    """
+    plan = placement.plan(benchmark, pool, cfg)
+    for line in placement.report(plan):
+        if line.startswith('warning: '):
+            log.warning("%s", line[len('warning: '):])
+        else:
+            log.info("%s", line)
+    with open(os.path.join(result_dir, 'placement.json'), 'w') as f:
+        json.dump(plan, f, indent=2, sort_keys=True)
+    return plan
+
+def hosts_needed(benchmark):
+    """
+    Return the number of client and server hosts a benchmark occupies.
+    Without clients_per_host in config.yml clients are spread over all
+    client hosts, as placement.plan() does.
+    """
+    servers = min(benchmark['host_count'], len(cfg['server_hosts']))
+    clients = len(cfg['client_hosts'])
+    per_host = cfg.get('clients_per_host')
+    if per_host:
+        clients = min(clients, -(-benchmark['client_count'] // per_host))
+    return clients, servers
+
+def cluster_key(benchmark, pool):
+    """
+    Benchmarks with equal keys produce the same containers inventory and
+    can run on the same containers.
+    """
+    return (tuple(pool['client']), tuple(pool['server']),
+            benchmark['host_count'], benchmark['server_count'],
+            benchmark['client_count'], benchmark['redundancy'],
+            benchmark['batch'])
+
+class Manifest(object):
+    """
+    Run state of a benchmark stored in out/<id>/manifest.json: status,
+    start and finish time of every phase and the list of result files.
+    """
+    def __init__(self, result_dir):
+        self.path = os.path.join(result_dir, 'manifest.json')
+        self.data = {'status': 'new', 'phases': {}, 'artifacts': []}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def set_status(self, status):
+        self.data['status'] = status
+        self.save()
+
+    def started(self, phase):
+        return phase in self.data['phases']
+
+    def finished(self, phase):
+        return 'finished' in self.data['phases'].get(phase, {})
+
+    def start(self, phase):
+        self.data['phases'][phase] = {'started': time.time()}
+        self.save()
+
+    def finish(self, phase):
+        self.data['phases'][phase]['finished'] = time.time()
+        self.save()
+
+    def reset(self, phase):
+        self.data['phases'].pop(phase, None)
+        self.save()
+
+    def add_artifact(self, name):
+        if name not in self.data['artifacts']:
+            self.data['artifacts'].append(name)
+            self.save()
+
+# Containers left running by the previous successful benchmark
+warm_cluster = {}
 
 def ansible_display(msg, color=None, stderr=False, screen_only=False,
                     log_only=False, runner=None):
@@ -102,7 +188,20 @@ file_handler.setFormatter(formatter)
 log.addHandler(file_handler)
 log.info("started")
 # Hack ansible to log to our logger object
-ansible.callbacks.display = ansible_display
+if ansible is not None:
+    ansible.callbacks.display = ansible_display
+
+parser = argparse.ArgumentParser(description='Run benchmarks.csv')
+parser.add_argument('--parallel', action='store_true',
+    help='run benchmarks on disjoint host subsets concurrently')
+parser.add_argument('--local', action='store_true',
+    help='run benchmarks on this host with local_bank.py servers and '
+    'bank-client.py clients, without Docker and Ansible')
+args = parser.parse_args()
+if args.local and args.parallel:
+    parser.error('--local runs benchmarks one by one')
+if not args.local and ansible is None:
+    parser.error('Ansible is not installed, only --local is available')
 
 #
 # Parse configuration
@@ -110,8 +209,9 @@ ansible.callbacks.display = ansible_display
 
 log.debug("parsing configuration file")
 cfg = {}
-with open('config.yml', 'r') as cfgfile:
-    cfg = yaml.load(cfgfile)[0]
+if not args.local or os.path.exists('config.yml'):
+    with open('config.yml', 'r') as cfgfile:
+        cfg = yaml.load(cfgfile)[0]
 log.debug("done")
 
 log.debug("parsing benchmarks configuration")
@@ -134,253 +234,568 @@ log.debug("done")
 
 # Ask sudo password
 sudo_pass = ""
-if cfg['sudo']:
-    sudo_pass = getpass.getpass("sudo password> ")
+timeout = None
+if not args.local:
+    if cfg['sudo']:
+        sudo_pass = getpass.getpass("sudo password> ")
+    timeout = cfg['ansible_timeout']
 
-timeout = cfg['ansible_timeout']
+# Export results left in the spool by previous runs
+if 'export' in cfg:
+    bench_export.drain_background(log)
 
-# Create direcotry for results
-os.mkdir('out')
-
-for benchmark in benchmarks:
-    result_dir = os.path.join('out', str(benchmark['benchmark_id']))
+def run_benchmark(benchmark, pool):
+    result_dir = os.path.abspath(os.path.join('out',
+        str(benchmark['benchmark_id'])))
     client_dir = os.path.join('roles', 'client', 'files')
-    os.mkdir(result_dir)
+    if not os.path.isdir(result_dir):
+        os.mkdir(result_dir)
+    manifest = Manifest(result_dir)
+    if manifest.data['status'] == 'done':
+        log.info("benchmark #%s is already done, skipping",
+                 benchmark['benchmark_id'])
+        return True
+    # Files fetched by the playbooks, moved to result_dir afterwards
+    results_dir = os.path.join(result_dir, 'results')
+    containers_path = os.path.join(result_dir, 'containers')
     #
     # Add extra logging target
     #
     fh = logging.FileHandler(os.path.join(result_dir, "benchmark.log"))
     fh.setFormatter(formatter)
     log.addHandler(fh)
+    try:
+        if manifest.data['status'] != 'new':
+            log.info("resuming benchmark #%s after status '%s'",
+                     benchmark['benchmark_id'], manifest.data['status'])
+        manifest.data['benchmark'] = benchmark
+        manifest.set_status('running')
+        ok = False
+        try:
+            ok = run_phases(benchmark, pool, manifest, result_dir, client_dir,
+                            results_dir, containers_path)
+        finally:
+            manifest.set_status(ok and 'done' or 'failed')
+    finally:
+        log.removeHandler(fh)
+    return ok
 
-    log.info("benchmark #%(benchmark_id)s: server_count=%(server_count)s "
-             "client_count=%(client_count)s batch=%(batch)s "
-             "hardware_failure=%(hardware_failure)s", benchmark)
-
+def run_cluster(benchmark, pool, manifest, result_dir, client_dir, results_dir,
+                containers_path):
+    """
+    Run the benchmark on containers and fetch sar files and server logs
+    """
     #
-    # Create inventory
+    # Place containers and create inventory
     #
-    inventory = create_inventory(benchmark)
-    for host in inventory.get_hosts('hosts'):
-        log.info("host %s server_count=%s client_count=%s",
-            host.name, host.vars['server_count'], host.vars['client_count'])
+    plan = plan_placement(benchmark, pool, result_dir)
+    inventory = create_inventory(benchmark, pool, plan['hosts'],
+        os.path.join(result_dir, 'hosts'))
+
+    extra_vars = {
+        'results_dir': results_dir,
+        'containers_inventory': containers_path,
+        'accounts_dir': os.path.abspath(os.path.join(client_dir,
+            "accounts-{0}".format(benchmark['client_count']))),
+        'trx_dir': os.path.abspath(os.path.join(client_dir,
+            "trx-{0}".format(benchmark['client_count']))),
+    }
+    for name in CLIENT_OPTIONS + HOST_OPTIONS:
+        if name in cfg:
+            extra_vars[name] = cfg[name]
+    # cpusets by host, passed as a variable rather than in the inventory
+    # where "1,3" would be parsed as a tuple
+    extra_vars['placement'] = dict((hostname, {
+        'server_cpusets': opts['server_cpusets'],
+        'client_cpusets': opts['client_cpusets']})
+        for (hostname, opts) in plan['hosts'].items()
+        if opts['server_cpusets'] or opts['client_cpusets'])
+    log.info('using accounts from %s', extra_vars['accounts_dir'])
+    log.info('using transactions from %s', extra_vars['trx_dir'])
 
     stats = ansible.callbacks.AggregateStats()
     playbook_cb = ansible.callbacks.PlaybookCallbacks(
         verbose=ansible.utils.VERBOSITY)
     runner_cb = ansible.callbacks.PlaybookRunnerCallbacks(stats,
         verbose=ansible.utils.VERBOSITY)
-    #
-    # Cleanup containers
-    #
-    log.info("cleanup containers")
-    pb = ansible.playbook.PlayBook(
-        playbook='04_cleanup_containers.yml',
-        inventory=inventory,
-        forks=len(inventory.get_hosts('hosts_all')) + 5,
-        callbacks=playbook_cb,
-        runner_callbacks=runner_cb,
-        stats = stats,
-        sudo_pass = sudo_pass,
-        sudo = cfg['sudo'],
-        timeout = timeout,
-        any_errors_fatal = True
-    )
-    if not ansible_run(pb):
-        continue
- 
-    #
-    # Build containers
-    #
-    log.info("build containers")
-    pb = ansible.playbook.PlayBook(
-        playbook='05_create_containers.yml',
-        inventory=inventory,
-        forks=len(inventory.get_hosts('hosts')) + 5,
-        callbacks=playbook_cb,
-        runner_callbacks=runner_cb,
-        stats = stats,
-        sudo_pass = sudo_pass,
-        sudo = cfg['sudo'],
-        timeout = timeout,
-        any_errors_fatal = True
-    )
-    if not ansible_run(pb):
-        continue
+
+    def playbook(path, inventory, forks, sudo=False, client_stage='all',
+                 **kwargs):
+        if sudo:
+            kwargs.update(sudo_pass = sudo_pass, sudo = cfg['sudo'])
+        pb_vars = dict(extra_vars, client_stage=client_stage)
+        return ansible.playbook.PlayBook(
+            playbook=path,
+            inventory=inventory,
+            forks=forks,
+            callbacks=playbook_cb,
+            runner_callbacks=runner_cb,
+            stats = stats,
+            timeout = timeout,
+            extra_vars = pb_vars,
+            **kwargs
+        )
+
+    def push_datasets(containers):
+        """
+        Archive the datasets of the clients and push the ones missing from
+        the dataset cache of their hosts
+        """
+        archive_dir = os.path.abspath(cfg.get('dataset_archive',
+            os.path.join(client_dir, 'dataset-archive')))
+        clients = [(host.get_variables()['client_id'],
+                    host.get_variables()['zone'])
+                   for host in containers.get_hosts('client_containers')]
+        log.info("archive datasets in %s", archive_dir)
+        try:
+            extra_vars.update(datasets.prepare(clients,
+                extra_vars['accounts_dir'], extra_vars['trx_dir'],
+                benchmark['batch'], archive_dir))
+        except (IOError, OSError):
+            log.exception("failed to archive datasets")
+            return False
+        extra_vars['dataset_archive'] = archive_dir
+        log.info("push datasets")
+        pb = playbook('13_push_datasets.yml', inventory,
+            len(inventory.get_hosts('hosts')) + 5, sudo=True)
+        return ansible_run(pb)
+
+    def containers_alive():
+        """
+        Ping the containers of containers_path: a later benchmark on the
+        same hosts removes them with 04_cleanup_containers.yml
+        """
+        pb = playbook('06_ping.yml',
+            ansible.inventory.Inventory(containers_path),
+            benchmark['server_count'] + benchmark['client_count'] + 5)
+        for host, info in pb.run().items():
+            if info['failures'] or info['unreachable']:
+                log.info("container %s is gone", host)
+                return False
+        return True
+
+    key = cluster_key(benchmark, pool)
+    # Benchmark phases are already executed, only collect results
+    executed = manifest.finished('run')
+
+    if not executed:
+        resumed = (manifest.finished('containers') and
+                   manifest.data.get('cluster_key') == list(key) and
+                   os.path.exists(containers_path) and containers_alive())
+        reuse = (cfg.get('reuse_cluster', True) and
+                 not benchmark['hardware_failure'] and
+                 warm_cluster.get('key') == key)
+        warm = dict(warm_cluster)
+        warm_cluster.clear()
+
+        if resumed:
+            log.info("reusing containers created before restart")
+        elif reuse:
+            #
+            # Keep containers, Tarantool data is wiped by deploy
+            #
+            log.info("reusing containers of benchmark #%s",
+                     warm['benchmark_id'])
+            manifest.start('containers')
+            shutil.copy(warm['containers'], containers_path)
+            pb = playbook('07_rotate_sysstat.yml', inventory,
+                len(inventory.get_hosts('hosts_all')) + 5, sudo=True)
+            if not ansible_run(pb):
+                return False
+        else:
+            manifest.start('containers')
+            #
+            # Cleanup containers
+            #
+            log.info("cleanup containers")
+            pb = playbook('04_cleanup_containers.yml', inventory,
+                len(inventory.get_hosts('hosts_all')) + 5, sudo=True,
+                any_errors_fatal = True)
+            if not ansible_run(pb):
+                return False
+
+            #
+            # Build containers
+            #
+            log.info("build containers")
+            pb = playbook('05_create_containers.yml', inventory,
+                len(inventory.get_hosts('hosts')) + 5, sudo=True,
+                any_errors_fatal = True)
+            if not ansible_run(pb):
+                return False
     try:
-        with open('containers', 'r') as inventory_file:
+        with open(containers_path, 'r') as inventory_file:
             log.debug("inventory file (containers):\n%s", inventory_file.read())
-            containers = ansible.inventory.Inventory('containers')
+            containers = ansible.inventory.Inventory(containers_path)
         log.info("done")
     except:
         log.exception("failed to build containers")
-        continue
-    #
-    # Prepare data directory
-    #
-    trx_dir = os.path.join(client_dir, "trx")
-    accounts_dir = os.path.join(client_dir, "accounts")
-    if os.path.lexists(trx_dir):
-        log.info("exists: %s", trx_dir)
-        os.unlink(trx_dir)
-    if os.path.lexists(accounts_dir):
-        log.info("exists: %s", accounts_dir)
-        os.unlink(accounts_dir)
-    new_trx_dir = "trx-{0}".format(benchmark['client_count'])
-    new_accounts_dir = "accounts-{0}".format(benchmark['client_count'])
-    log.info('using accounts from %s', os.path.join(client_dir, new_accounts_dir))
-    os.symlink(new_accounts_dir, accounts_dir)
-    log.info('using transactions from %s', os.path.join(client_dir, new_trx_dir))
-    os.symlink(new_trx_dir, trx_dir)
-
-    time.sleep(5)
+        return False
 
-    #
-    # Test connection
-    #
-    for i in range(3):
-        log.info("ping")
-        pb = ansible.playbook.PlayBook(
-            playbook='06_ping.yml',
-            inventory=containers,
-            forks=benchmark['server_count'] + 5,
-            callbacks=playbook_cb,
-            runner_callbacks=runner_cb,
-            stats = stats,
-            timeout = timeout
-        )
+    if not executed:
+        if not manifest.finished('containers'):
+            manifest.data['cluster_key'] = list(key)
+            manifest.finish('containers')
+            time.sleep(5)
+
+        #
+        # Test connection
+        #
+        for i in range(3):
+            log.info("ping")
+            pb = playbook('06_ping.yml', containers,
+                benchmark['server_count'] + 5)
+            if not ansible_run(pb):
+                continue
+
+        #
+        # Deploy cluster
+        #
+        log.info("deploy cluster")
+        pb = playbook('10_deploy_cluster.yml', containers,
+            benchmark['server_count'] + 5, any_errors_fatal = True)
         if not ansible_run(pb):
-            continue
+            # Containers may be gone, recreate them on restart
+            manifest.reset('containers')
+            return False
+        log.info("done")
+
+        #
+        # Distribute data, valid until the benchmark removes it
+        #
+        if manifest.finished('distribute') and not manifest.started('run'):
+            log.info("data is already distributed")
+        else:
+            log.info("distribute data")
+            manifest.start('distribute')
+            if cfg.get('dataset_cache', True) and \
+                    not push_datasets(containers):
+                return False
+            pb = playbook('14_distribute_data.yml', containers,
+                benchmark['client_count'] + 5, client_stage='deploy')
+            if not ansible_run(pb):
+                return False
+            manifest.finish('distribute')
+            log.info("done")
+
+        #
+        # Run benchmark
+        #
+        log.info("run benchmark")
+        manifest.start('run')
+        pb = playbook('15_run_benchmark.yml', containers,
+            benchmark['client_count'] + 5, client_stage='run')
+        pb.run()
+        manifest.finish('run')
+        log.info("done")
 
     #
-    # Deploy cluster
+    # Fetch statistics
     #
-    log.info("deploy cluster")
-    pb = ansible.playbook.PlayBook(
-        playbook='10_deploy_cluster.yml',
-        inventory=containers,
-        forks=benchmark['server_count'] + 5,
-        callbacks=playbook_cb,
-        runner_callbacks=runner_cb,
-        stats = stats,
-        timeout = timeout,
-        any_errors_fatal = True
-    )
-    if not ansible_run(pb):
-        continue
-    log.info("done")
+    if not manifest.finished('sar'):
+        log.info("fetch statistics")
+        manifest.start('sar')
+        pb = playbook('20_fetch_sar.yml', inventory,
+            len(inventory.get_hosts('hosts')) + 5, sudo=True)
+        pb.run()
+        try:
+            for host in inventory.get_hosts('hosts'):
+                name = host.name + '.sar'
+                os.rename(os.path.join(results_dir, name),
+                          os.path.join(result_dir, name))
+                manifest.add_artifact(name)
+            manifest.finish('sar')
+            log.info("done")
+        except:
+            log.exception("failed to fetch statistics")
 
     #
-    # Run benchmark
+    # Fetch logs
     #
-    log.info("run benchmark")
-    pb = ansible.playbook.PlayBook(
-        playbook='15_run_benchmark.yml',
-        inventory=containers,
-        forks=benchmark['client_count'] + 5,
-        callbacks=playbook_cb,
-        runner_callbacks=runner_cb,
-        stats = stats,
-        timeout = timeout
-    )
-    pb.run()
+    if not manifest.finished('logs'):
+        log.info("fetch logs")
+        manifest.start('logs')
+        pb = playbook('18_fetch_logs.yml', containers,
+            benchmark['server_count'] + 5)
+        pb.run()
+        try:
+            for host in containers.get_hosts('tarantool_containers'):
+                name = host.name + '.log'
+                os.rename(os.path.join(results_dir, name),
+                          os.path.join(result_dir, name))
+                manifest.add_artifact(name)
+            manifest.finish('logs')
+            log.info("done")
+        except:
+            log.exception("failed to fetch logs")
+
+    if not benchmark['hardware_failure'] and not executed:
+        warm_cluster.update(key=key, containers=containers_path,
+                            benchmark_id=benchmark['benchmark_id'])
+    return True
+
+def run_phases(benchmark, pool, manifest, result_dir, client_dir, results_dir,
+               containers_path):
+    log.info("benchmark #%(benchmark_id)s: server_count=%(server_count)s "
+             "client_count=%(client_count)s batch=%(batch)s "
+             "hardware_failure=%(hardware_failure)s", benchmark)
+    log.info("client hosts: %s, server hosts: %s",
+             ' '.join(pool['client']), ' '.join(pool['server']))
+
+    if args.local:
+        ok = local_run.run(benchmark, manifest, client_dir, result_dir,
+                           results_dir, cfg, log)
+    else:
+        ok = run_cluster(benchmark, pool, manifest, result_dir, client_dir,
+                         results_dir, containers_path)
+    if not ok:
+        return False
     log.info("done")
 
+    if not manifest.finished('report'):
+        log.info("prepare report")
+        manifest.start('report')
+        try:
+            times = {}
+            for what in ('start', 'load', 'exec', 'save'):
+                name = '.timestamp_' + what
+                dst_path = os.path.join(result_dir, name)
+                # Moved already if a previous attempt failed later on
+                if not os.path.exists(dst_path):
+                    os.rename(os.path.join(results_dir, name), dst_path)
+                manifest.add_artifact(name)
+                with open(dst_path) as f:
+                    times[what] = int(f.read())
+            load_time = times['load'] - times['start']
+            exec_time = times['exec'] - times['load']
+            save_time = times['save'] - times['exec']
+            log.info("load time: %d s", load_time)
+            log.info("exec time: %d s", exec_time)
+            log.info("save time: %d s", save_time)
+            dst_path = os.path.join(result_dir, "_results.txt")
+            if not os.path.exists(dst_path):
+                os.rename(os.path.join(results_dir, "_results.txt"), dst_path)
+            manifest.add_artifact("_results.txt")
+            # Last, so that a retried report does not export twice
+            if 'export' in cfg:
+                bench_export.push({
+                    '{0}.load_time'.format(benchmark['benchmark_id']): load_time,
+                    '{0}.exec_time'.format(benchmark['benchmark_id']): exec_time,
+                    '{0}.save_time'.format(benchmark['benchmark_id']): save_time,
+                }, cfg['export'], log, cfg.get('version', ''))
+            manifest.finish('report')
+        except Exception:
+            # Not marked done, a resumed run prepares the report again
+            log.exception("failed to prepare report")
+            return False
+
     #
-    # Fetch statistics
+    # Move results
     #
-    log.info("fetch statistics")
-    pb = ansible.playbook.PlayBook(
-        playbook='20_fetch_sar.yml',
-        inventory=inventory,
-        forks=len(inventory.get_hosts('hosts')) + 5,
-        callbacks=playbook_cb,
-        runner_callbacks=runner_cb,
-        stats = stats,
-        sudo_pass = sudo_pass,
-        sudo = cfg['sudo'],
-        timeout = timeout,
-    )
-    pb.run()
-    try:
-        for host in inventory.get_hosts('hosts'):
-            src_path = os.path.join(client_dir, 'results', host.name + '.sar')
-            dst_path = os.path.join(result_dir, host.name + '.sar')
-            os.rename(src_path, dst_path)
-        log.info("done")
-    except:
-        log.exception("failed to fetch statistics")
+    if not manifest.finished('results'):
+        manifest.start('results')
+        for i in range(benchmark['client_count']):
+            for what in ("load", "exec", "save"):
+                name = 'client-{0:d}-{1}.log'.format(i, what)
+                src_path = os.path.join(results_dir, name)
+                dst_path = os.path.join(result_dir, name)
+                try:
+                    os.rename(src_path, dst_path)
+                    manifest.add_artifact(name)
+                except:
+                    log.exception("failed to move %s to %s for client_id=%d",
+                                  src_path, dst_path, i)
+
+            names = ['accounts{0:03d}.tsv'.format(i),
+                     'client-{0:d}-timing.tsv'.format(i)]
+            # Dumps with the same digest as another client's are not fetched
+            digest = 'accounts{0:03d}.digest'.format(i)
+            if os.path.exists(os.path.join(results_dir, digest)):
+                names.append(digest)
+                if not os.path.exists(os.path.join(results_dir, names[0])):
+                    del names[0]
+            for name in names:
+                src_path = os.path.join(results_dir, name)
+                dst_path = os.path.join(result_dir, name)
+                try:
+                   os.rename(src_path, dst_path)
+                   manifest.add_artifact(name)
+                except:
+                    log.exception("failed to move file %s to %s for "
+                                  "client_id=%d", src_path, dst_path, i)
+        manifest.finish('results')
 
     #
-    # Fetch logs
+    # Verify saved accounts, only local runs have all the data at hand
     #
-    log.info("fetch logs")
-    pb = ansible.playbook.PlayBook(
-        playbook='18_fetch_logs.yml',
-        inventory=containers,
-        forks=benchmark['server_count'] + 5,
-        callbacks=playbook_cb,
-        runner_callbacks=runner_cb,
-        stats = stats,
-        timeout = timeout
-    )
-    pb.run()
+    verified = True
+    if args.local:
+        verified = manifest.finished('verify')
+        if not verified:
+            log.info("verify results")
+            manifest.start('verify')
+            verified = local_run.verify(benchmark, client_dir, result_dir,
+                                        cfg, log)
+            manifest.add_artifact('checker.log')
+            if verified:
+                manifest.finish('verify')
+                log.info("done")
+
     try:
-        for host in containers.get_hosts('tarantool_containers'):
-            src_path = os.path.join(client_dir, 'results', host.name + '.log')
-            dst_path = os.path.join(result_dir, host.name + '.log')
-            os.rename(src_path, dst_path)
-        log.info("done")
+        report = analyze_logs.analyze(result_dir)
+        for phase, stats in sorted(report['phases'].items()):
+            log.info("%s: %d records, %.1f rec/s, latency p50=%s p99=%s "
+                     "p999=%s ms, stragglers=%s", phase, stats['records'],
+                     stats['throughput'], stats['latency_ms']['p50'],
+                     stats['latency_ms']['p99'], stats['latency_ms']['p999'],
+                     stats['stragglers'])
+        manifest.add_artifact('analytics.json')
+        manifest.add_artifact('throughput.csv')
     except:
-        log.exception("failed to fetch logs")
+        log.exception("failed to analyze client logs")
 
-    log.info("done")
+    try:
+        timing = analyze_logs.analyze_timing(result_dir)
+        for phase in analyze_logs.PHASES:
+            stats = timing['phases'].get(phase)
+            if stats is None:
+                continue
+            log.info("%s: makespan %.3f s, client %.3f..%.3f s, "
+                     "start skew %.3f s, end skew %.3f s, %s records/s",
+                     phase, stats['makespan'], stats['min_duration'],
+                     stats['max_duration'], stats['start_skew'],
+                     stats['end_skew'], stats['throughput'])
+        manifest.add_artifact('timing.json')
+    except:
+        log.exception("failed to analyze client timings")
 
-    log.info("prepare report")
     try:
-        times = {}
-        for what in ('start', 'load', 'exec', 'save'):
-            src_path = os.path.join(client_dir, 'results', '.timestamp_' + what)
-            dst_path = os.path.join(result_dir, '.timestamp_' + what)
-            os.rename(src_path, dst_path)
-            with open(dst_path) as f:
-                times[what] = int(f.read())
-        load_time = times['load'] - times['start']
-        exec_time = times['exec'] - times['load']
-        save_time = times['save'] - times['exec']
-        log.info("load time: %d s", load_time)
-        log.info("exec time: %d s", exec_time)
-        log.info("save time: %d s", save_time)
-        os.rename(os.path.join(client_dir, "results", "_results.txt"),
-                  os.path.join(result_dir, "_results.txt"))
+        report = analyze_sar.analyze(result_dir, cfg.get('sar_interfaces'))
+        for (phase, begin, end) in analyze_sar.PHASES:
+            if phase in report['phases']:
+                for line in analyze_sar.format_phase(phase,
+                                                     report['phases'][phase]):
+                    log.info("%s", line)
+        manifest.add_artifact('sar_report.json')
     except:
-        log.exception("failed to prepare report")
+        log.exception("failed to analyze sar files")
 
-    #
-    # Move results
-    #
-    for i in range(benchmark['client_count']):
-        for what in ("load", "exec", "save"):
-            name = 'client-{0:d}-{1}.log'.format(i, what)
-            src_path = os.path.join(client_dir, 'results', name)
-            dst_path = os.path.join(result_dir, name)
-            try:
-                os.rename(src_path, dst_path)
-            except:
-                log.exception("failed to move %s to %s for client_id=%d",
-                              i, src_path, dst_path)
-
-        name = 'accounts{0:03d}.tsv'.format(i)
-        src_path = os.path.join(client_dir, 'results', name)
-        dst_path = os.path.join(result_dir, name)
+    # Once per benchmark, a rerun would add a duplicate history row
+    if not manifest.finished('history'):
+        manifest.start('history')
         try:
-           os.rename(src_path, dst_path)
+            run_id = results_db.record(benchmark, cfg.get('version', ''),
+                                       result_dir)
+            log.info("stored in %s as run %d", results_db.DB_PATH, run_id)
+            manifest.finish('history')
         except:
-            log.exception("failed to move file %s to %s for client_id=%d",
-                src_path, dst_path, i)
-
-    os.unlink(trx_dir)
-    os.unlink(accounts_dir)
+            log.exception("failed to store results")
 
+    if not verified:
+        return False
     log.info("benchmark #%(benchmark_id)s is done", benchmark)
-    log.removeHandler(fh)
+    return True
+
+def run_sequential(benchmarks):
+    if args.local:
+        pool = {'client': ['localhost'], 'server': ['localhost']}
+    else:
+        pool = {'client': cfg['client_hosts'], 'server': cfg['server_hosts']}
+    ok = True
+    for benchmark in benchmarks:
+        ok = run_benchmark(benchmark, pool) and ok
+    return ok
+
+def run_child(benchmark, pool, warm, finished):
+    """run_benchmark() in a process of run_parallel(), warm_cluster is
+    passed in and sent back through the finished queue. The exit code is
+    0 if the benchmark succeeded"""
+    warm_cluster.update(warm)
+    ok = False
+    try:
+        ok = run_benchmark(benchmark, pool)
+    finally:
+        finished.put(dict(warm_cluster))
+        wait_export()
+    sys.exit(0 if ok else 1)
+
+def run_parallel(benchmarks):
+    """
+    Greedily start every pending benchmark whose hosts fit into the free
+    part of client_hosts/server_hosts. Each benchmark runs in its own
+    process with its own inventory and out/<id> directory.
+    Return True if every benchmark succeeded.
+    """
+    free = {'client': list(cfg['client_hosts']),
+            'server': list(cfg['server_hosts'])}
+    pending = list(benchmarks)
+    running = {}
+    # Containers left by finished benchmarks, by cluster key
+    warm = {}
+    finished = multiprocessing.Queue()
+    failed = []
+    while pending or running:
+        for benchmark in list(pending):
+            clients, servers = hosts_needed(benchmark)
+            if len(free['client']) < clients or len(free['server']) < servers:
+                continue
+            pool = {'client': free['client'][:clients],
+                    'server': free['server'][:servers]}
+            del free['client'][:clients]
+            del free['server'][:servers]
+            log.info("starting benchmark #%s on %d client and %d server hosts",
+                     benchmark['benchmark_id'], clients, servers)
+            # The benchmark reuses the containers of its hosts or removes
+            # them, other warm clusters on these hosts are gone either way
+            state = warm.pop(cluster_key(benchmark, pool), {})
+            hosts = set(pool['client'] + pool['server'])
+            for key in list(warm):
+                if hosts.intersection(key[0] + key[1]):
+                    del warm[key]
+            proc = multiprocessing.Process(target=run_child,
+                args=(benchmark, pool, state, finished))
+            proc.start()
+            running[proc] = (benchmark, pool)
+            pending.remove(benchmark)
+        time.sleep(1)
+        for proc in list(running):
+            if proc.is_alive():
+                continue
+            proc.join()
+            (benchmark, pool) = running.pop(proc)
+            log.info("benchmark #%s finished, exit code %s",
+                     benchmark['benchmark_id'], proc.exitcode)
+            if proc.exitcode != 0:
+                failed.append(benchmark['benchmark_id'])
+            for what in ('client', 'server'):
+                free[what].extend(pool[what])
+                free[what].sort(key=cfg[what + '_hosts'].index)
+        # Only exited processes have sent their state
+        while not finished.empty():
+            state = finished.get()
+            if state:
+                warm[state['key']] = state
+    if failed:
+        log.error("failed benchmarks: %s", ' '.join(str(benchmark_id)
+                                                    for benchmark_id in failed))
+    return not failed
+
+# Create direcotry for results, benchmarks which are done are skipped
+if not os.path.isdir('out'):
+    os.mkdir('out')
+
+def wait_export():
+    """Let background exports finish, the process exits next"""
+    if not bench_export.wait_background():
+        log.warning("export is still running, the rest of the results "
+                    "stay in %s", bench_export.SPOOL_PATH)
+
+try:
+    if args.parallel:
+        ok = run_parallel(benchmarks)
+    else:
+        ok = run_sequential(benchmarks)
+finally:
+    wait_export()
+if not ok:
+    sys.exit(1)
@@ -0,0 +1,106 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import bench_export
+
+log = logging.getLogger('test_bench_export')
+
+class ResultServer(object):
+    """Local stand-in of the result server, answers /push with status"""
+    def __init__(self, status=200):
+        self.paths = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.paths.append(self.path)
+                self.send_response(server.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.status = status
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.address = '127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class DrainTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spool = bench_export.Spool(os.path.join(self.dir, 'spool'))
+        self.backoff = bench_export.BACKOFF
+        bench_export.BACKOFF = 0
+
+    def tearDown(self):
+        bench_export.BACKOFF = self.backoff
+        shutil.rmtree(self.dir)
+
+    def results(self, count):
+        return dict(('%d.exec_time' % i, i) for i in range(count))
+
+    def assertCompacted(self):
+        self.assertEqual(self.spool.pending()[0], [])
+        self.assertEqual(os.path.getsize(self.spool.path), 0)
+        self.assertEqual(self.spool.read_offset(), 0)
+
+    def test_background_drain(self):
+        server = ResultServer()
+        try:
+            bench_export.push(self.results(100), server.address + ':secret',
+                              log, '1.6', spool=self.spool)
+            self.assertTrue(bench_export.wait_background(10))
+        finally:
+            server.close()
+        self.assertEqual(len(server.paths), 100)
+        self.assertTrue(all('key=secret' in path for path in server.paths))
+        self.assertCompacted()
+
+    def test_failed_records_stay_in_spool(self):
+        server = ResultServer(status=503)
+        try:
+            bench_export.push(self.results(3), server.address + ':secret',
+                              log, '1.6', spool=self.spool)
+            self.assertTrue(bench_export.wait_background(10))
+            self.assertEqual(len(server.paths),
+                             3 * (bench_export.RETRIES + 1))
+            self.assertEqual(len(self.spool.pending()[0]), 3)
+            self.assertNotEqual(os.path.getsize(self.spool.path), 0)
+            server.status = 200
+            self.assertEqual(bench_export.drain(log, self.spool), 3)
+        finally:
+            server.close()
+        self.assertCompacted()
+
+    def test_spool_reused_after_compaction(self):
+        server = ResultServer()
+        try:
+            for count in (5, 7):
+                bench_export.push(self.results(count), server.address +
+                                  ':secret', log, '1.6', spool=self.spool,
+                                  background=False)
+                self.assertCompacted()
+        finally:
+            server.close()
+        self.assertEqual(len(server.paths), 12)
+
+if __name__ == '__main__':
+    unittest.main()